@@ -1,7 +1,7 @@
 import os
-import nearai
 import json
 import logging
+import time
 from traceback import format_exc
 from nearai.agents.environment import Environment
 
@@ -9,10 +9,18 @@ from nearai.agents.environment import Environment
 env: Environment = globals()["env"]
 
 
+imports_started = time.perf_counter()
 try:
-    from prompts import scratchpad_prompt
+    from prompts import (scratchpad_prompt, builder_prompt, ask_for_secrets_prompt, agent_built_prompt,
+                         agent_not_built_prompt, pending_secrets_prompt, agent_code_prompt)
     from utils import Context
-    from tools import generate, upload, update_agent, create_secret, start_login_flow, finish_login_flow
+    from nearai.shared.auth_data import AuthData
+    from utils.prompt_assembly import PromptAssembler, STATIC, SESSION, TURN
+    from utils.router import Route, route, record_route
+    from utils.tool_executor import ToolExecutor
+    from tools import (generate, upload, update_agent, restore_version, create_secret, create_secrets,
+                       start_login_flow, finish_login_flow)
+    from tools.definitions import tool_definitions
 
     if os.environ.get("DEBUG", False):
         logger = logging.getLogger("system_logger")
@@ -27,22 +35,44 @@ try:
         logger.addHandler(console_handler)
 
 
+    # Tool modules are imported by the tools package on their first call, see `tools/__init__.py`
+    imports_duration = time.perf_counter() - imports_started
     context = Context(env)
+    context.metrics.record("import", "agent.py", imports_started, imports_duration)
+    env.add_system_log(f"Builder modules imported in {imports_duration:.3f}s")
     context.load_state()
 
+    builder_tools = [generate, upload, update_agent, restore_version, create_secret, create_secrets, start_login_flow,
+                     finish_login_flow]
+
+
+    def run_route(message: str, command: Route, arguments: dict):
+        """Runs the tool of a command message without asking the model"""
+        env.add_system_log(record_route(context.state, command.name))
+        tool = {tool.__name__: tool for tool in builder_tools}[command.tool]
+        result = tool(**arguments)
+        if isinstance(result, dict) and "error" in result:
+            env.add_reply(f"Unfortunately {command.tool} failed:\n{result['error']}")
+
+        if command.private:
+            context.write_message_to_scratchpad(f"Assistant: Used tool {command.tool}")
+        else:
+            context.write_message_to_scratchpad("User: " + message)
+            context.write_message_to_scratchpad(f"Assistant: Used tool {command.tool} with arguments: {json.dumps(arguments)}")
+
 
     def run(env: Environment):
         try:
             config = env.env_vars.get("NEARAI_CONFIG", None)
 
             if config is not None:
-                config = json.loads(config)
-                nearai.CONFIG = nearai.CONFIG.update_with({"auth": config})
+                # The auth belongs to the conversation, see `utils.clients.current_auth`
+                context.auth = AuthData(**json.loads(config))
             else:
-                env.add_system_log("Cannot update nearai.CONFIG, no environ set. Loging in", logging.DEBUG)
+                env.add_system_log("Cannot set the auth, no environ set. Loging in", logging.DEBUG)
 
         except Exception as e:
-            env.add_system_log("Cannot update nearai.CONFIG, no environ set", logging.DEBUG)
+            env.add_system_log("Cannot set the auth, no environ set", logging.DEBUG)
             env.add_reply(f"Error when loging in:\n{format_exc()}")
 
         if context.state is not None:
@@ -50,89 +80,61 @@ try:
         else:
             context.env.add_system_log(f"State is empty")
 
-        if context.env.get_last_message()["content"].find("nearai login save") == 0:
-            finish_login_flow(context.env.get_last_message()["content"])
-            context.env.mark_done()
-            return
-
         try:
-            tool_registry = env.get_tool_registry(new=True)
-            tool_registry.register_tool(generate)
-            tool_registry.register_tool(upload)
-            tool_registry.register_tool(update_agent)
-            tool_registry.register_tool(create_secret)
-            tool_registry.register_tool(start_login_flow)
-            tool_registry.register_tool(finish_login_flow)
-
-            prompts = [
-                {
-                    "role": "system",
-                    "content": "You are an agent that builds other agents. "        
-                               "Before running `generate` tool, ask if user confirms your plan"
-                               "Use `generate` tool when the user asks to build an agent."
-                               "Use `update_agent` tool when user wants to make any improvements in the code you generated"
-                               "Use `create_secret` tool when user wants to save any secret of api-key into the secure agent's vault"
-                               "Use `start_login_flow` tool when user wants to login"
-                               "Use `finish_login_flow` tool when user message starts with `nearai login save`"
-                               "When the user only asks questions, respond only with a short text answer, without invoking any tools."
-                               "IMPORTANT: generate the code without asking user for API KEYS!"
-                }
-            ]
-
-            pending_secrets = context.state.pending_secrets
-            ask_for_secrets_prompt = {
-                "role": "system",
-                "content": "User can provide you with instructions or keys which can be useful to make private API calls. "
-                           "In that case you should save secrets into the secret vault using `create_secret` tool."
-                           "You must generate agent first and only after you can ask for the api keys."
-            }
-            if pending_secrets and pending_secrets.use_secrets:
-                    ask_for_secrets_prompt["content"] += (f"\nCurrent code expectes next environment variables: {str(pending_secrets.keys)}"
-                                          f"So make sure that you save secrets with the correct keys from the provided list.")
-
-            prompts.append(ask_for_secrets_prompt)
-
-            prompts.append({
-                "role": "system",
-                "content": scratchpad_prompt(context.state.scratchpad)
-            })
+            # Commands like `login` or `upload 1.0.0` don't need the model to pick the tool
+            message = env.get_last_message()["content"]
+            routed = route(message, context.state)
+            if routed is not None:
+                run_route(message, *routed)
+                return
+            env.add_system_log(record_route(context.state, "llm"))
+
+            assembler = PromptAssembler()
+            assembler.add("builder", builder_prompt, STATIC)
+            assembler.add("ask_for_secrets", ask_for_secrets_prompt, STATIC)
 
             if len(context.state.agent_py) > 10:
 
                 env.add_system_log(f"The agent is built, the code is:\n=======\n{context.state.agent_py}\n======")
 
-                prompts.append({
-                    "role": "system",
-                    "content": "You already built the agent, further you should only use `update_agent` tool, "
-                               "and never `generate` tool, "
-                               "unless user explicitly asks you to create new agent from scratch."
-                               f"\nCurrent code of agent is:"
-                               f"\n{context.state.agent_py}"
-                })
+                assembler.add("agent_status", agent_built_prompt, SESSION)
+                assembler.add("agent_code", agent_code_prompt(context.state.agent_py), SESSION)
             else:
-                prompts.append({
-                    "role": "system",
-                    "content": "The agent wasn't built yet, in case if you think that such agent exists just ignore it"
-                               "and generate the new one"
-                })
+                assembler.add("agent_status", agent_not_built_prompt, SESSION)
+
+            pending_secrets = context.state.pending_secrets
+            if pending_secrets and pending_secrets.use_secrets:
+                assembler.add("pending_secrets", pending_secrets_prompt(str(pending_secrets.keys)), SESSION)
 
-            messages = prompts + [env.get_last_message()]
-            tools = tool_registry.get_all_tool_definitions()
+            assembler.add("scratchpad", scratchpad_prompt(context.state.scratchpad, context.state.scratchpad_digest), TURN)
+            assembler.report(env)
 
+            messages = assembler.messages() + [env.get_last_message()]
+            # Generated by tools/build_definitions.py, the tools aren't inspected every turn
+            tools = tool_definitions()
 
-            response = env.completions_and_run_tools(messages, tools=tools)
+            # Tool calls of the response run concurrently when they don't touch the same state, see `utils/tool_executor.py`
+            definitions = {definition["function"]["name"]: definition for definition in tools}
+            executor = ToolExecutor(env, {tool.__name__: tool for tool in builder_tools}, definitions)
+            response = executor.completions(messages)
+            calls = executor.run(response.choices[0].message)
             context.write_message_to_scratchpad("User: " + env.get_last_message()["content"])
             for choice in response.choices:
                 context.env.add_system_log(choice.message, logging.DEBUG)
-                if choice.message.role == "assistant" and choice.message.tool_calls is None:
-                    context.write_message_to_scratchpad(f"Assistant: {choice.message.content}")
-                elif choice.message.tool_calls is not None:
-                    for tool_call in choice.message.tool_calls:
-                        context.write_message_to_scratchpad(f"Assistant: Used tool {tool_call.function.name} with arguments: {tool_call.function.arguments}")
+            if calls:
+                for call in calls:
+                    context.write_message_to_scratchpad(f"Assistant: Used tool {call.name} with arguments: {call.raw_arguments}")
+            elif response.choices[0].message.role == "assistant":
+                context.write_message_to_scratchpad(f"Assistant: {response.choices[0].message.content}")
         except Exception:
             env.add_reply(f"Unfortunately agent was stopped because of the error:\n{format_exc()}")
         finally:
+            Context().completion_cache.flush(Context().files)
             Context().dump_state()
+            # Metrics of the turn go to the storage with the other thread files, in one flush
+            Context().metrics.flush(Context().files)
+            Context().flush_files()
+            Context().release()
             env.mark_done()
 
     run(env)
@@ -1,17 +1,44 @@
-def scratchpad_prompt(scratchpad: str):
+def scratchpad_prompt(scratchpad: str, digest: str = ""):
+    digest_section = "" if not digest else f"""
+The summary of the earlier conversation, that is no longer in the scratchpad, is:
+<digest>
+{digest}
+</digest>
+"""
     return f"""
 You have memory of the previous conversation with user, it is called scratchpad. 
 The scratchpad will be updated automatically.
 You should carefully read it before deciding on the next step.
 When responding, ensure that you use the scratchpad correctly. 
 If multiple steps are needed, iterate through them until you gather all necessary data.
-
+{digest_section}
 The current scratchpad is:
 <scratchpad>
 {scratchpad}
 </scratchpad>
 """
 
+def scratchpad_digest_prompt(digest: str, entries: str, max_words: int):
+    return f"""
+You maintain a short summary of the conversation between a user and an agent that builds other agents.
+Update the current summary with the new conversation entries.
+Keep everything that can be needed later: agent name, requirements, decisions, APIs and keys the user mentioned, 
+generated versions and open questions. Drop greetings, repetitions and full code or plans, only mention what they changed.
+Keep the summary under {max_words} words, shorten the older parts of the current summary if needed.
+
+The current summary is:
+<digest>
+{digest}
+</digest>
+
+The new conversation entries are:
+<entries>
+{entries}
+</entries>
+
+Reply with the updated summary only.
+"""
+
 framework_prompt: str = """
     
 Available libraries:
@@ -113,8 +140,18 @@ Here are some examples of how to use the framework:
 </examples>
     """
 
+# Shared beginning of every code generation prompt, it never changes so providers can reuse its cached prefix
+code_builder_prompt: str = f"""You are an agent that builds other AI agents.
+{framework_prompt}
+"""
+
+_reply_with_code: str = "Reply with the code only, nothing else. No formatting, comments, etc., your entire response should be valid Python code. It should be fully working out of the box, so don't add any placeholders or APIs that need API keys."
+
 def regenerate_code_prompt(generated_code: str, agent_change_technical_plan: str):
-    return f"""You are an agent that builds other AI agents.
+    return f"""{code_builder_prompt}
+You need to re-write `agent.py` that implements the agent with the set of changes.
+{_reply_with_code}
+
 You are given a code that you previously generated:
 <code>
 {generated_code}
@@ -124,26 +161,77 @@ You are given a description of what should be changed in the code:
 <description>
 {agent_change_technical_plan}
 </description>
+"""
 
-You need to re-write `agent.py` that implements the agent with the set of changes.
-
-{framework_prompt}
-
-Reply with the code only, nothing else. No formatting, comments, etc., your entire response should be valid Python code. It should be fully working out of the box, so don't add any placeholders or APIs that need API keys.
+def edit_code_prompt(generated_code: str, agent_change_technical_plan: str):
+    return f"""{code_builder_prompt}
+You need to change `agent.py` that you previously generated.
+Do not rewrite the whole file. Reply only with the edits, as one or more blocks in this exact format:
+<<<<<<< SEARCH
+lines copied exactly from the current code
+=======
+lines that replace them
+>>>>>>> REPLACE
+
+Every SEARCH part must match the current code exactly, including indentation, and must be unique in the file, 
+so include a few surrounding lines if needed. To add new code, search for the lines next to the place where it goes 
+and repeat them in the replacement. Blocks are applied in order. Nothing else should be in the response.
+
+The current code of `agent.py` is:
+<code>
+{generated_code}
+</code>
 
+You are given a description of what should be changed in the code:
+<description>
+{agent_change_technical_plan}
+</description>
 """
 
+def code_problems_prompt(problems: list):
+    problems_list = "\n".join(f"- {problem}" for problem in problems)
+    return f"""The code was checked before the upload and it has these problems:
+{problems_list}
+Fix only these problems, keep everything else as it is."""
+
 def generate_code_prompt(agent_technical_plan: str):
-    return f"""
-You are an agent that builds other AI agents.
+    return f"""{code_builder_prompt}
+You need to write `agent.py` that implements the agent.
+{_reply_with_code}
+
 You are given a description of the agent you need to build:
 <description>
 {agent_technical_plan}
 </description>
+"""
 
-You need to write `agent.py` that implements the agent.
-
-{framework_prompt}
-
-Reply with the code only, nothing else. No formatting, comments, etc., your entire response should be valid Python code. It should be fully working out of the box, so don't add any placeholders or APIs that need API keys.
-                """
\ No newline at end of file
+builder_prompt: str = ("You are an agent that builds other agents. "
+                       "Before running `generate` tool, ask if user confirms your plan"
+                       "Use `generate` tool when the user asks to build an agent."
+                       "Use `update_agent` tool when user wants to make any improvements in the code you generated"
+                       "Use `restore_version` tool when user wants to go back to the code of a version uploaded before"
+                       "Use `create_secret` tool when user wants to save any secret of api-key into the secure agent's vault"
+                       "Use `create_secrets` tool instead when user provides several secrets at once"
+                       "Use `start_login_flow` tool when user wants to login"
+                       "Use `finish_login_flow` tool when user message starts with `nearai login save`"
+                       "When the user only asks questions, respond only with a short text answer, without invoking any tools."
+                       "IMPORTANT: generate the code without asking user for API KEYS!")
+
+ask_for_secrets_prompt: str = ("User can provide you with instructions or keys which can be useful to make private API calls. "
+                               "In that case you should save secrets into the secret vault using `create_secret` tool, "
+                               "or `create_secrets` tool to save all of them in one call."
+                               "You must generate agent first and only after you can ask for the api keys.")
+
+agent_built_prompt: str = ("You already built the agent, further you should only use `update_agent` tool, "
+                           "and never `generate` tool, "
+                           "unless user explicitly asks you to create new agent from scratch.")
+
+agent_not_built_prompt: str = ("The agent wasn't built yet, in case if you think that such agent exists just ignore it"
+                               "and generate the new one")
+
+def pending_secrets_prompt(keys: str):
+    return (f"Current code expectes next environment variables: {keys}"
+            f"So make sure that you save secrets with the correct keys from the provided list.")
+
+def agent_code_prompt(agent_py: str):
+    return f"Current code of agent is:\n{agent_py}"
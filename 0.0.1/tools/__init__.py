@@ -1,8 +1,50 @@
-from .generate import  generate
-from .upload import upload
-from .update import update_agent
-from .secrets import create_secret
-from .login import start_login_flow, finish_login_flow
+import importlib
+import time
+from typing import Callable, Dict
 
+from utils import Context
+from tools.definitions import TOOL_MODULES, load_tool_specs, tool_signature
 
-__all__ = ["generate", "upload", "update_agent", "create_secret", "start_login_flow", "finish_login_flow"]
\ No newline at end of file
+
+# Tools are stand-ins built from `tool_definitions.json`, their modules are imported only when one of them is called.
+# Most turns are conversational and don't need the registry, secrets and login clients.
+_stubs: Dict[str, Callable] = {}
+_loaded: Dict[str, Callable] = {}
+
+
+def _load(name: str) -> Callable:
+    tool = _loaded.get(name, None)
+    if tool is None:
+        module = f"{__name__}.{TOOL_MODULES[name]}"
+        started = time.perf_counter()
+        tool = getattr(importlib.import_module(module), name)
+        # Importing a submodule binds it on the package over the stub of the same name
+        globals().update(_stubs)
+        Context().metrics.record("import", module, started, time.perf_counter() - started)
+        _loaded[name] = tool
+    return tool
+
+
+def _lazy_tool(spec: Dict) -> Callable:
+    """Stand-in for a tool with the name, docstring and signature the tool registry reads,
+    the real tool is imported on the first call"""
+    name = spec["name"]
+
+    def tool(*args, **kwargs):
+        return _load(name)(*args, **kwargs)
+
+    signature = tool_signature(spec)
+    tool.__name__ = tool.__qualname__ = name
+    tool.__module__ = f"{__name__}.{spec['module']}"
+    tool.__doc__ = spec["docstring"]
+    tool.__signature__ = signature
+    tool.__annotations__ = {parameter.name: parameter.annotation for parameter in signature.parameters.values()
+                            if parameter.annotation is not parameter.empty}
+    return tool
+
+
+_stubs.update({spec["name"]: _lazy_tool(spec) for spec in load_tool_specs()})
+globals().update(_stubs)
+
+
+__all__ = ["generate", "upload", "update_agent", "restore_version", "create_secret", "create_secrets", "start_login_flow", "finish_login_flow"]
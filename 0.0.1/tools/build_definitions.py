@@ -0,0 +1,44 @@
+"""Regenerates `tool_definitions.json` after a tool or its docstring is changed, run from the agent directory:
+
+    python -m tools.build_definitions          # writes tools/tool_definitions.json
+    python -m tools.build_definitions --check  # fails if the file doesn't match the tools, run it before uploading
+"""
+import json
+import sys
+from typing import Dict, List
+
+from tools.definitions import DEFINITIONS_PATH, TOOL_MODULES, build_tool_specs
+
+
+def _dumps(specs: List[Dict]) -> str:
+    return json.dumps({"tools": specs}, indent=2) + "\n"
+
+
+def main(argv: List[str]) -> int:
+    expected = _dumps(build_tool_specs())
+
+    if "--check" in argv:
+        try:
+            with open(DEFINITIONS_PATH, "r") as f:
+                current = json.load(f)["tools"]
+        except Exception as e:
+            print(f"Cannot read {DEFINITIONS_PATH}: {e}")
+            return 1
+        current_by_name = {spec["name"]: spec for spec in current}
+        changed = [spec["name"] for spec in json.loads(expected)["tools"] if current_by_name.get(spec["name"]) != spec]
+        removed = [name for name in current_by_name if name not in TOOL_MODULES]
+        if changed or removed or _dumps(current) != expected:
+            print(f"{DEFINITIONS_PATH} is out of date, changed tools: {changed}, removed tools: {removed}. "
+                  f"Run `python -m tools.build_definitions` to regenerate it.")
+            return 1
+        print(f"{DEFINITIONS_PATH} is up to date")
+        return 0
+
+    with open(DEFINITIONS_PATH, "w") as f:
+        f.write(expected)
+    print(f"Wrote {DEFINITIONS_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,93 @@
+"""Tool definitions are generated from the tools once and shipped in `tool_definitions.json`,
+so a turn neither imports the tool modules nor introspects them. See `tools/build_definitions.py`."""
+import importlib
+import inspect
+import json
+import os
+from typing import Callable, Dict, List, Optional
+
+
+# Tool -> module of the tools package that implements it, in the order the tools are offered to the model
+TOOL_MODULES = {
+    "generate": "generate",
+    "upload": "upload",
+    "update_agent": "update",
+    "restore_version": "update",
+    "create_secret": "secrets",
+    "create_secrets": "secrets",
+    "start_login_flow": "login",
+    "finish_login_flow": "login",
+}
+DEFINITIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tool_definitions.json")
+
+# Annotations the tool registry maps to JSON types, anything else is described as a string
+_ANNOTATIONS = {"str": str, "int": int, "float": float, "bool": bool}
+
+_specs: Optional[List[Dict]] = None
+
+
+def _tool_spec(name: str, tool: Callable) -> Dict:
+    """Everything a stand-in of the tool needs: the docstring and the signature the registry reads,
+    and the definition the registry builds from them"""
+    from typing import get_type_hints
+    from nearai.agents.tool_registry import ToolRegistry
+
+    type_hints = get_type_hints(tool)
+    parameters = []
+    for parameter in inspect.signature(tool).parameters.values():
+        annotation = type_hints.get(parameter.name, None)
+        spec = {
+            "name": parameter.name,
+            "annotation": None if annotation is None else getattr(annotation, "__name__", "str"),
+        }
+        if parameter.default is not inspect.Parameter.empty:
+            spec["default"] = parameter.default
+        parameters.append(spec)
+
+    registry = ToolRegistry()
+    registry.register_tool(tool)
+    return {
+        "name": name,
+        "module": TOOL_MODULES[name],
+        "docstring": tool.__doc__,
+        "parameters": parameters,
+        "definition": registry.get_tool_definition(name),
+    }
+
+
+def build_tool_specs() -> List[Dict]:
+    """Imports every tool and describes it, used to generate and check `tool_definitions.json`"""
+    return [
+        _tool_spec(name, getattr(importlib.import_module(f"tools.{module}"), name))
+        for name, module in TOOL_MODULES.items()
+    ]
+
+
+def load_tool_specs() -> List[Dict]:
+    """Tools described in `tool_definitions.json`, or described from the imported tools if the file is missing"""
+    global _specs
+    if _specs is None:
+        try:
+            with open(DEFINITIONS_PATH, "r") as f:
+                _specs = json.load(f)["tools"]
+        except FileNotFoundError:
+            _specs = build_tool_specs()
+    return _specs
+
+
+def tool_definitions() -> List[Dict]:
+    """Definitions of all the tools for `completions_and_run_tools`, byte-for-byte the same every turn"""
+    return [spec["definition"] for spec in load_tool_specs()]
+
+
+def tool_signature(spec: Dict) -> inspect.Signature:
+    return inspect.Signature([
+        inspect.Parameter(
+            parameter["name"],
+            inspect.Parameter.POSITIONAL_OR_KEYWORD,
+            default=parameter.get("default", inspect.Parameter.empty),
+            annotation=(inspect.Parameter.empty if parameter["annotation"] is None
+                        else _ANNOTATIONS.get(parameter["annotation"], str))
+        )
+        for parameter in spec["parameters"]
+    ])
@@ -1,23 +1,34 @@
 import logging
 from datetime import datetime
 
-from utils import Context, PendingSecrets
+from utils import Context, PendingSecrets, AgentMetadata
 from prompts import generate_code_prompt
 from traceback import print_exc, format_stack, format_exc
 from tools.upload import upload
+from utils.streaming import stream_completion, last_function_name
+from utils.validation import validate_agent_code
+from utils.code_analysis import find_secret_keys, score_agent_code
+from utils.pipeline import Pipeline
+from utils.concurrency import ContextThreadPoolExecutor
+from typing import Dict, List
 import json
 
 
+# Upper bound of GENERATION_CANDIDATES, the number of drafts sampled concurrently, the best scored one is reviewed
+GENERATION_MAX_CANDIDATES = 5
+# Temperature of the additional drafts, the first one uses the defaults of the builder
+GENERATION_CANDIDATE_TEMPERATURE = 0.8
+
+
 def create_metadata(agent_name: str, agent_description: str):
-    env = Context().env
-    env.add_system_log("Writing metadata.json...")
-    metadata_json = json.dumps({
-        "name": agent_name,
-        "version": "",
-        "description": agent_description,
-        "category": "agent",
-        "tags": ["generated"],
-        "details": {
+    Context().env.add_system_log("Writing metadata.json...")
+    Context().set_metadata(AgentMetadata(
+        name=agent_name,
+        version="",
+        description=agent_description,
+        category="agent",
+        tags=["generated"],
+        details={
             "agent": {
                 "defaults": {
                     "model": "deepseek-3",
@@ -26,9 +37,61 @@ def create_metadata(agent_name: str, agent_description: str):
                 "framework": "web-agent"
             }
         },
-        "show_entry": True
-    }, indent=2)
-    env.write_file("metadata.json", metadata_json)
+        show_entry=True
+    ))
+
+
+def _report_draft_progress(agent_py: str):
+    lines = agent_py.count("\n")
+    function_name = last_function_name(agent_py)
+    Context().env.add_reply(
+        f"Writing agent.py: {lines} lines so far"
+        + (f", working on `{function_name}`..." if function_name else "...")
+    )
+
+
+def _generation_candidates() -> int:
+    """Opt-in best-of-N generation, set by the GENERATION_CANDIDATES environment variable"""
+    try:
+        candidates = int(Context().env.env_vars.get("GENERATION_CANDIDATES", 1))
+    except Exception:
+        return 1
+    return min(max(candidates, 1), GENERATION_MAX_CANDIDATES)
+
+
+def _draft_agent_code(conversation: list, candidates: int) -> str:
+    """Samples the drafts concurrently and returns the best scored one, only the first draft reports progress"""
+    env = Context().env
+
+    def draft(index: int) -> str:
+        if index == 0:
+            text = stream_completion(env, conversation, "draft of agent.py", on_progress=_report_draft_progress,
+                                     metrics=Context().metrics)
+        else:
+            text = stream_completion(env, conversation, f"draft {index + 1} of agent.py", metrics=Context().metrics,
+                                     temperature=GENERATION_CANDIDATE_TEMPERATURE)
+        return text.strip("```python").strip("```")
+
+    if candidates == 1:
+        return draft(0)
+
+    with ContextThreadPoolExecutor(max_workers=candidates) as executor:
+        futures = [executor.submit(draft, index) for index in range(candidates)]
+
+    scored = []
+    for index, future in enumerate(futures):
+        try:
+            agent_py = future.result()
+            scored.append((score_agent_code(agent_py), -index, agent_py))
+        except Exception:
+            env.add_system_log(f"Draft {index + 1} of agent.py failed, error:\n{format_exc()}")
+    if not scored:
+        futures[0].result()
+
+    score, index, agent_py = max(scored)
+    env.add_system_log(f"Scores of the drafts of agent.py: {[round(draft[0], 2) for draft in scored]}, "
+                       f"picked draft {1 - index} ({score:.2f})")
+    return agent_py
 
 
 def _generate_agent_code(conversation:list, agent_technical_plan: str, use_mock: bool = False):
@@ -46,11 +109,14 @@ def _generate_agent_code(conversation:list, agent_technical_plan: str, use_mock:
         with open("agent_py", "r") as f:
             agent_py = f.read()
     else:
-        agent_py = env.completion(conversation)
-        agent_py = agent_py.strip("```python").strip("```")
+        candidates = _generation_candidates()
+        agent_py = _draft_agent_code(conversation, candidates)
 
+        lines = agent_py.count("\n")
+        env.add_reply(f"The draft is ready ({lines} lines" + (f", the best of {candidates}" if candidates > 1 else "")
+                      + "), checking it against the guidelines...")
         conversation.append({"role": "assistant", "content": agent_py})
-        agent_py = env.completion(conversation + [{
+        review_messages = conversation + [{
             "role": "user",
             "content": f"""
 Make sure the code follows these guidelines and best practices:
@@ -63,55 +129,60 @@ Make sure the code follows these guidelines and best practices:
 
 Respond with the improved code only, nothing else, no comments, no formatting.
             """
-        }])
+        }]
+        agent_py = Context().completion_cache.completion(
+            review_messages,
+            lambda: stream_completion(env, review_messages, "review of agent.py", metrics=Context().metrics)
+        )
         agent_py = agent_py.strip("```python").strip("```")
         conversation.pop()
 
     conversation.append({"role": "assistant", "content": agent_py})
-    env.add_reply(f"I have generated code for you: \n```python\n{agent_py}```")
     return agent_py
 
 
-def _check_if_code_has_authentication(agent_py: str):
-
-    message = Context().env.completion([
+def _describe_secret_keys(agent_py: str, keys: List[str]) -> Dict[str, str]:
+    message = Context().completion_cache.completion([
         {
             "role": "system",
-            "content": "Check if the code has any API key placeholders, "
-                       "or uses APIs that require auth but don't have it supplied in the code. "
+            "content": "The code below needs the following API keys or secrets from the user: "
+                       f"{', '.join(keys)}. "
+                       "For each of them explain in one sentence what it is needed for and which service issues it. "
                        "Reply with json with format:"
                        "<response_format>"
                        "{ "
-                       "     \"use_secrets\": true, # if code uses env variables or not" 
-                       "     \"keys\": { "
-                       "         \"key_1\": \"Description on why this key is needed\", "
-                       "         \"key_2\": \"Description on why this key is needed\"  "
-                       "     } "
+                       "     \"key_1\": \"Description on why this key is needed\", "
+                       "     \"key_2\": \"Description on why this key is needed\"  "
                        "} "
                        "</response_format>"
                        "Reply only with json"
-
         },
         {"role": "user", "content": agent_py}
     ])
 
-    Context().env.add_system_log("Figured out if agent uses private APIs \n" + message)
-
     try:
-        result = json.loads(message.strip("```json").strip("```"))
-        pending_secrets = PendingSecrets.model_validate(result)
-        return pending_secrets
+        descriptions = json.loads(message.strip().strip("```json").strip("```"))
+        return {key: str(descriptions.get(key, "")) for key in keys}
     except Exception as e:
-        Context().env.add_system_log(f"Cannot figure out what env variables are used, skipping this step. Error:\n{format_exc()}")
-    return PendingSecrets().model_validate({
-        "use_secrets": False,
-        "keys": [],
-        "values": []
-    })
+        Context().env.add_system_log(f"Cannot parse descriptions of the secrets, using the default ones. Error:\n{format_exc()}")
+        return {}
 
-def _provide_instructions_on_authentication(secrets: PendingSecrets, agent_py: str):
-    env = Context().env
-    message = env.completion([
+
+def _check_if_code_has_authentication(agent_py: str):
+    keys = find_secret_keys(agent_py)
+    Context().env.add_system_log(f"Figured out if agent uses private APIs, secrets found in the code: {keys}")
+    if not keys:
+        return PendingSecrets(use_secrets=False, keys={})
+
+    descriptions = _describe_secret_keys(agent_py, keys)
+    return PendingSecrets(
+        use_secrets=True,
+        keys={key: descriptions.get(key) or f"{key} used by the agent" for key in keys}
+    )
+
+def _provide_instructions_on_authentication(secrets: PendingSecrets, agent_py: str) -> str:
+    """Message with the instructions on getting the secrets, the caller replies with it"""
+    return Context().completion_cache.completion([
         {
             "role": "system",
             "content": "Write message to the user that he should provide you with the API Key and give him the format and instructions of how he should provide this key."
@@ -128,29 +199,12 @@ def _provide_instructions_on_authentication(secrets: PendingSecrets, agent_py: s
         {"role": "user", "content": "Code of the agent: \n" + agent_py},
         {"role": "user", "content": "List of environment variables or secrets that user should provide \n" + secrets.model_dump_json()}
     ])
-    env.add_reply(message)
 
 
 # TODO: this method would generate the template to save secrets
 # Don't use as for now
 def _generate_secrets_form(agent_py: str):
-    env = Context().env
-    message = env.completion([
-        {
-            "role": "system",
-            "content": "Identify all environment variables accessed in the provided source code."
-                        "Environment variables are accessed via env.env_vars."
-                        "Return a JSON list of the accessed environment variables."
-                        "Return JSON only"
-        },
-        {"role": "user", "content": agent_py}
-    ])
-
-    try:
-        secrets = json.loads(message.strip("```json").strip("```"))
-
-    except Exception as e:
-        Context().env.add_system_log(f"Cannot identify environment variables in the code. Error:\n{format_exc()}")
+    return find_secret_keys(agent_py)
 
 def generate(agent_name: str, agent_description: str, agent_technical_plan: str):
     """Generate a new NEAR AI agent and upload a test version to NEAR AI Hub.
@@ -165,44 +219,72 @@ def generate(agent_name: str, agent_description: str, agent_technical_plan: str)
     env = context.env
 
 
-    new_technical_plan = env.completion([
-        {
-            "role": "assistant",
-            "content": "You're very good software architect. "
-                       "You should analyze user's message and if it has additional requirements or details "
-                       "you must include them into the current technical plan. "
-                       "If there is no requiremnts then just leave plan as is."
-        },
-        {
-            "role": "assistant",
-            "content": f"Current technical plan is: {agent_technical_plan}"
-        },
-        env.get_last_message()
-    ])
-
-    agent_technical_plan = new_technical_plan
-
-    env.add_system_log("Generating agent...")
-    try:
-        create_metadata(agent_name, agent_description)
-        conversation = []
-        agent_py = _generate_agent_code(conversation, agent_technical_plan)
-        secrets = _check_if_code_has_authentication(agent_py)
+    def refine_plan():
+        return env.completion([
+            {
+                "role": "assistant",
+                "content": "You're very good software architect. "
+                           "You should analyze user's message and if it has additional requirements or details "
+                           "you must include them into the current technical plan. "
+                           "If there is no requiremnts then just leave plan as is."
+            },
+            {
+                "role": "assistant",
+                "content": f"Current technical plan is: {agent_technical_plan}"
+            },
+            env.get_last_message()
+        ])
+
+    def validate(draft):
+        code = validate_agent_code(draft)
+        env.add_reply(f"I have generated code for you: \n```python\n{code}```")
+        return code
+
+    def check_secrets(code):
+        secrets = _check_if_code_has_authentication(code)
         if secrets.use_secrets:
             Context().state.pending_secrets = secrets
-            _provide_instructions_on_authentication(secrets, agent_py)
+        return secrets
 
-        env.write_file("agent.py", agent_py)
+    def provide_instructions(code, secrets):
+        if secrets.use_secrets:
+            return _provide_instructions_on_authentication(secrets, code)
+        return None
+
+    def reply_instructions(instructions):
+        if instructions:
+            env.add_reply(instructions)
+
+    def write_agent(code):
+        Context().files.write_file("agent.py", code)
         env.add_system_log("Agent generated successfully.")
 
         version = f"gen-{datetime.now().strftime('%Y%m%d%H%M%S')}"
         Context().state.last_version = version
-        Context().state.agent_py = agent_py
-        Context().dump_state()
+        Context().state.agent_py = code
+        Context().checkpoint("agent.py generated, uploading")
+        return version
+
+    # Metadata doesn't need the refined plan. Instructions on secrets are written while the agent is uploaded,
+    # and sent after the replies of the upload, so the replies don't interleave
+    pipeline = Pipeline(env, "generate")
+    pipeline.stage("plan", refine_plan)
+    pipeline.stage("metadata", lambda: create_metadata(agent_name, agent_description))
+    pipeline.stage("draft", lambda plan: _generate_agent_code([], plan), depends_on=["plan"])
+    pipeline.stage("code", validate, depends_on=["draft"])
+    pipeline.stage("secrets", check_secrets, depends_on=["code"])
+    pipeline.stage("instructions", provide_instructions, depends_on=["code", "secrets"])
+    pipeline.stage("write_agent", write_agent, depends_on=["code"])
+    pipeline.stage("upload", lambda write_agent, metadata: upload(write_agent), depends_on=["write_agent", "metadata"])
+    # Depends on the upload for the order of the replies only, its result isn't used
+    pipeline.stage("reply_instructions", lambda instructions, **_: reply_instructions(instructions),
+                   depends_on=["instructions", "upload"])
 
-        upload(version)
+    env.add_system_log("Generating agent...")
+    try:
+        pipeline.run()
     except Exception as e:
         env.add_system_log(str(e))
         return {"error": print_exc()}
     finally:
-        env.mark_done()
\ No newline at end of file
+        env.mark_done()
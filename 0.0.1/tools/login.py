@@ -3,11 +3,11 @@ import time
 import urllib.parse as urlparse
 import shlex
 import re
-import nearai
 from nearai.login import MESSAGE, RECIPIENT, update_auth_config
 from nearai.shared.auth_data import AuthData
 
 from utils import Context
+from utils.clients import current_auth, invalidate_clients
 from traceback import format_exc
 from tools.secrets import _create_secret_unsafe
 
@@ -37,12 +37,13 @@ def save_auth_as_secret(key: str, value: str, namespace: str):
     Context().env.add_system_log("Saving auth secret")
 
     try:
-        plain_metadata = Context().env.read_file("metadata.json")
-        plain_metadata = json.loads(plain_metadata)
+        metadata = Context().get_metadata()
+        if metadata is None:
+            raise Exception("The agent has no metadata.json yet")
 
-        name = plain_metadata.pop("name")
+        name = metadata.name
         version = ""
-        description = plain_metadata.pop("description")
+        description = metadata.description
         # namespace = nearai.CONFIG.auth.namespace
         _create_secret_unsafe(key, value, namespace, name, version, description, "agent")
     except Exception as e:
@@ -85,7 +86,7 @@ def finish_login_flow(login_command: str):
         callback_url = kwargs.get("callbackUrl")
         nonce = kwargs.get("nonce")
 
-        current_auth_data:AuthData = nearai.CONFIG.get("auth", None)
+        current_auth_data:AuthData = current_auth()
         namespace = None
         if current_auth_data is not None:
             namespace = current_auth_data.account_id if current_auth_data.account_id != account_id else None
@@ -103,9 +104,11 @@ def finish_login_flow(login_command: str):
             success = update_auth_config(account_id, signature, public_key, callback_url, nonce)
             Context().env.add_reply(f"Login {'successful' if success else 'failed. Please try again.' }")
 
-            nearai.CONFIG = nearai.CONFIG.update_with({
-                "auth": auth_config
-            })
+            # Only this conversation switches to the new account, see `utils.clients.current_auth`
+            previous_auth = Context().auth
+            Context().auth = AuthData(**auth_config)
+            if previous_auth is not None and previous_auth != Context().auth:
+                invalidate_clients(previous_auth)
 
             if success:
                 save_auth_as_secret("NEARAI_CONFIG", json.dumps(auth_config), namespace)
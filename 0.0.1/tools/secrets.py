@@ -1,27 +1,49 @@
 import json
 import logging
-import nearai
+from typing import Dict, List, Optional
 from nearai.openapi_client.models import CreateHubSecretRequest, RemoveHubSecretRequest
-from nearai.openapi_client.api import HubSecretsApi
 from utils import Context
+from utils.clients import get_hub_secrets, current_auth
+from utils.concurrency import ContextThreadPoolExecutor
 from traceback import format_exc
 
 
-def _get_secrets():
+# Number of secrets saved concurrently by `_upsert_secrets_unsafe`
+SECRETS_MAX_WORKERS = 4
+# Number of secrets fetched per request, the listing is paged
+SECRETS_PAGE_SIZE = 100
+
+
+def _get_secrets() -> Optional[List]:
+    """All the secrets of the user, page by page. None if any page cannot be fetched"""
+    secrets = []
     try:
-        hub_secrets = HubSecretsApi()
-        hub_secrets.api_client.configuration.access_token = f"Bearer {nearai.CONFIG.auth.model_dump_json()}"
-        result = hub_secrets.get_user_secrets_v1_get_user_secrets_get()
-        return result
+        while True:
+            with Context().metrics.measure("secrets", "get", offset=len(secrets)):
+                page = get_hub_secrets().get_user_secrets_v1_get_user_secrets_get(limit=SECRETS_PAGE_SIZE, offset=len(secrets))
+            # The response is untyped, anything but a list leaves the existing secrets unknown
+            if not isinstance(page, list):
+                raise Exception(f"Unexpected response: {page!r}")
+            secrets.extend(page)
+            if len(page) < SECRETS_PAGE_SIZE:
+                return secrets
     except Exception as e:
         Context().env.add_system_log(f"Secrets were not fetched because of error:\n {format_exc()}")
-        return []
+        return None
+
+
+def _find_secret_value(secrets: List, key: str, namespace: str, name: str, version: str, category: str) -> Optional[str]:
+    for secret in secrets:
+        if not isinstance(secret, dict):
+            secret = secret.to_dict() if hasattr(secret, "to_dict") else vars(secret)
+        if (secret.get("key") == key and secret.get("namespace") == namespace and secret.get("name") == name
+                and (secret.get("version") or "") == version and secret.get("category", category) == category):
+            return secret.get("value")
+    return None
 
 
 def _delete_secret_unsafe(key: str, namespace: str, name: str, version: str, category: str = "agent"):
     try:
-        hub_secrets = HubSecretsApi()
-        hub_secrets.api_client.configuration.access_token = f"Bearer {nearai.CONFIG.auth.model_dump_json()}"
         request = RemoveHubSecretRequest.model_validate(
             dict(
                 namespace=namespace,
@@ -31,7 +53,8 @@ def _delete_secret_unsafe(key: str, namespace: str, name: str, version: str, cat
                 category=category
             )
         )
-        result = hub_secrets.remove_hub_secret_v1_remove_hub_secret_post(request)
+        with Context().metrics.measure("secrets", "delete", key=key):
+            result = get_hub_secrets().remove_hub_secret_v1_remove_hub_secret_post(request)
         Context().env.add_system_log(f"Secret {key} was deleted: {result}")
     except Exception as e:
         Context().env.add_system_log(f"Secret {key} was not deleted.", logging.DEBUG)
@@ -40,9 +63,7 @@ def _delete_secret_unsafe(key: str, namespace: str, name: str, version: str, cat
     return True
 
 
-def _create_secret_unsafe(key: str, value: str, namespace: str, name: str, version: str, description: str, category: str = "agent"):
-    _delete_secret_unsafe(key, namespace, name, version, category)
-
+def _create_hub_secret_unsafe(key: str, value: str, namespace: str, name: str, version: str, description: str, category: str = "agent"):
     try:
         hub_secret_request = CreateHubSecretRequest.model_validate(
             dict(
@@ -56,10 +77,8 @@ def _create_secret_unsafe(key: str, value: str, namespace: str, name: str, versi
             )
         )
 
-        hub_secrets = HubSecretsApi()
-        Context().env.add_system_log(f"Saving secret with Bearer: {nearai.CONFIG.auth.model_dump_json()}")
-        hub_secrets.api_client.configuration.access_token = f"Bearer {nearai.CONFIG.auth.model_dump_json()}"
-        result = hub_secrets.create_hub_secret_v1_create_hub_secret_post(hub_secret_request)
+        with Context().metrics.measure("secrets", "create", key=key):
+            result = get_hub_secrets().create_hub_secret_v1_create_hub_secret_post(hub_secret_request)
         Context().env.add_system_log(f"Secret was saved successfully: {str(result)}")
     except Exception:
         Context().env.add_system_log(f"Secret was not saved because of error:\n {format_exc()}")
@@ -68,6 +87,54 @@ def _create_secret_unsafe(key: str, value: str, namespace: str, name: str, versi
     return True
 
 
+def _upsert_secrets_unsafe(secrets: Dict[str, str], namespace: str, name: str, version: str, description: str, category: str = "agent") -> Dict[str, bool]:
+    """Saves all the secrets with a single lookup of the existing ones, returns whether each key was saved"""
+    existing = _get_secrets()
+
+    def upsert(key: str, value: str) -> bool:
+        # Only a listed equal value is skipped. A key listed without its value, or not listed at all, may still exist,
+        # so the old value is removed before the new one is created
+        if existing is not None and _find_secret_value(existing, key, namespace, name, version, category) == value:
+            Context().env.add_system_log(f"Secret {key} is up to date, skipping")
+            return True
+
+        _delete_secret_unsafe(key, namespace, name, version, category)
+        return _create_hub_secret_unsafe(key, value, namespace, name, version, description, category)
+
+    with ContextThreadPoolExecutor(max_workers=SECRETS_MAX_WORKERS) as executor:
+        futures = {key: executor.submit(upsert, key, value) for key, value in secrets.items()}
+
+    return {key: future.result() for key, future in futures.items()}
+
+
+def _create_secret_unsafe(key: str, value: str, namespace: str, name: str, version: str, description: str, category: str = "agent"):
+    return _upsert_secrets_unsafe({key: value}, namespace, name, version, description, category)[key]
+
+
+def _save_agent_secrets(secrets: Dict[str, str]):
+    namespace = current_auth().namespace
+    try:
+        metadata = Context().get_metadata()
+    except Exception:
+        Context().env.add_system_log(f"Cannot parse the metadata of the agent:\n{format_exc()}")
+        metadata = None
+    if metadata is None:
+        Context().env.add_reply("I cannot create secret for you because I should create an agent first.")
+        return
+
+    name = metadata.name
+    version = ""
+    description = metadata.description
+    saved = _upsert_secrets_unsafe(secrets, namespace, name, version, description, "agent")
+
+    saved_keys = [key for key, success in saved.items() if success]
+    failed_keys = [key for key, success in saved.items() if not success]
+    if saved_keys:
+        Context().env.add_reply(f"I've saved {', '.join(saved_keys)} for you.")
+    if failed_keys:
+        Context().env.add_reply(f"I couldn't save {', '.join(failed_keys)}, please try again.")
+
+
 def create_secret(key: str, value: str):
     """
     Saves key-value pair (secret) in the agent's secure storage
@@ -75,21 +142,21 @@ def create_secret(key: str, value: str):
     value (str): The value of the secret
     """
 
-    namespace = nearai.CONFIG.auth.namespace
-    plain_metadata = Context().state.metadata
-    if plain_metadata is None or len(plain_metadata) == 0:
-        Context().env.add_reply("I cannot create secret for you because I should create an agent first.")
-        return
+    _save_agent_secrets({key: value})
+
+
+def create_secrets(secrets: str):
+    """
+    Saves several key-value pairs (secrets) in the agent's secure storage at once, use it when user provides more than one secret
+    secrets (str): JSON object that maps the name of each secret to its value, e.g. {"API_KEY": "value", "API_SECRET": "value"}
+    """
 
     try:
-        plain_metadata = json.loads(plain_metadata)
+        secrets = json.loads(secrets)
+        assert isinstance(secrets, dict) and len(secrets) > 0
     except Exception:
-        Context().env.add_reply("I cannot create secret for you because I should create an agent first.")
+        Context().env.add_system_log(f"Cannot parse secrets:\n{format_exc()}")
+        Context().env.add_reply("I cannot save the secrets, please provide them as key-value pairs.")
         return
 
-    name = plain_metadata.pop("name")
-    version = ""
-    description = plain_metadata.pop("description")
-    _create_secret_unsafe(key, value, namespace, name, version, description, "agent")
-
-    Context().env.add_reply(f"I've saved {key} for you.")
\ No newline at end of file
+    _save_agent_secrets({str(key): str(value) for key, value in secrets.items()})
@@ -1,9 +1,9 @@
 import logging
 from datetime import datetime
 from utils import Context
-from prompts import regenerate_code_prompt
 from tools.upload import upload
 from traceback import format_exc
+from utils.validation import edit_agent_code, rewrite_agent_code, validate_agent_code
 
 
 def update_agent(update_plan: str):
@@ -21,22 +21,18 @@ def update_agent(update_plan: str):
 
         # env.add_system_log(f"Current code of the agent is: \n```python\n{agent_py}```")
 
-        conversation = []
-        conversation.append({
-            'role': 'system',
-            'content': regenerate_code_prompt(agent_py, update_plan)
-        })
-
-        agent_py = env.completion(conversation)
-        agent_py = agent_py.strip("```python").strip("```")
+        updated_agent_py = None
+        if agent_py:
+            updated_agent_py = edit_agent_code(agent_py, update_plan)
+        if updated_agent_py is None:
+            updated_agent_py = rewrite_agent_code(agent_py, update_plan)
+        agent_py = validate_agent_code(updated_agent_py)
 
         env.add_reply(f"I have generated the updated code for you: \n```python\n{agent_py}```")
 
-        env.add_system_log("Writing updated metadata.json...")
-        env.write_file("metadata.json", Context().state.metadata)
-
+        # metadata.json is written by `upload` with the new version
         env.add_system_log("Writing updated agent.py...")
-        env.write_file("agent.py", agent_py)
+        Context().files.write_file("agent.py", agent_py)
 
         Context().state.agent_py = agent_py
 
@@ -44,4 +40,24 @@ def update_agent(update_plan: str):
         upload(f"gen-{datetime.now().strftime('%Y%m%d%H%M%S')}")
     except Exception as e:
         env.add_system_log(f"Error when updating agent, error:\n{format_exc()}", logging.DEBUG)
-        return {"error": f"Error when updating agent, error: \n{format_exc()}"}
\ No newline at end of file
+        return {"error": f"Error when updating agent, error: \n{format_exc()}"}
+
+def restore_version(version: str):
+    """Roll the agent back to the code of a version that was uploaded before. Call this only when the user asks to go back to an earlier version.
+
+    version (str): The version number of the agent to restore, as it was uploaded."""
+
+    env = Context().env
+    try:
+        if not Context().restore_version(version):
+            versions = ", ".join(Context().state.code_versions) or "none"
+            # The reply is the whole answer, an error would make the caller report a failure as well
+            env.add_reply(f"I don't have the code of version {version}, the versions I can restore are: {versions}")
+            return
+
+        Context().files.write_file("agent.py", Context().state.agent_py)
+        env.add_reply(f"Restored the code of version {version}:\n```python\n{Context().state.agent_py}```\n"
+                      f"Ask me to upload it with a new version to release it again.")
+    except Exception as e:
+        env.add_system_log(f"Error when restoring version {version}, error:\n{format_exc()}", logging.DEBUG)
+        return {"error": f"Error when restoring version {version}, error: \n{format_exc()}"}
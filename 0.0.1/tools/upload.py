@@ -1,22 +1,119 @@
+import hashlib
 import nearai
-import json
-from typing import Dict
-from utils import Context
+import time
+import urllib3
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Any, Dict, Callable, Iterable, Iterator, Tuple
+from utils import Context, is_internal_file, METADATA_PATH
+from utils.clients import get_registry, current_auth, CONNECTION_POOL_SIZE
+from utils.concurrency import ContextThreadPoolExecutor
 from nearai.registry import Registry
 from nearai.agents.environment import Environment
 from traceback import format_exc
 from openai.types import FileObject
 
 
-def _upload(registry: Registry, env: Environment) -> nearai.EntryLocation:
-    metadata_path = "metadata.json"
+# Number of files uploaded concurrently, the registry client keeps the same number of pooled connections
+UPLOAD_MAX_WORKERS = CONNECTION_POOL_SIZE
+# How many times a single file is sent before the upload is considered failed
+UPLOAD_MAX_ATTEMPTS = 3
+UPLOAD_RETRY_DELAY = 0.5
+# Responses of the registry that may succeed when sent again: rate limiting and server errors
+UPLOAD_RETRY_STATUSES = {429} | set(range(500, 600))
+# Errors of the connection to the registry, the request may not have reached it
+UPLOAD_RETRY_ERRORS = (urllib3.exceptions.MaxRetryError, urllib3.exceptions.ProtocolError, urllib3.exceptions.TimeoutError,
+                       ConnectionError, TimeoutError)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether another attempt may succeed, rejected requests and local errors fail the same way again"""
+    if isinstance(error, nearai.openapi_client.exceptions.ApiException):
+        return error.status in UPLOAD_RETRY_STATUSES
+    return isinstance(error, UPLOAD_RETRY_ERRORS)
+
+
+def _upload_file(registry: Registry, entry_location: nearai.EntryLocation, path: str, content: bytes):
+    for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+        try:
+            with Context().metrics.measure("registry", "upload_file", path=path, bytes=len(content), attempt=attempt):
+                registry.api.upload_file_v1_registry_upload_file_post(
+                    path=path,
+                    file=content,
+                    namespace=entry_location.namespace,
+                    name=entry_location.name,
+                    version=entry_location.version,
+                )
+            return
+        except nearai.openapi_client.exceptions.BadRequestException as e:
+            if isinstance(e.body, str) and "already exists" in e.body:
+                raise Exception(f"File already exists at version {entry_location.version}, {e.body}")
+
+            raise e
+        except Exception as e:
+            if attempt == UPLOAD_MAX_ATTEMPTS or not _is_retryable(e):
+                raise
+            Context().env.add_system_log(f"Cannot upload {path} (attempt {attempt}/{UPLOAD_MAX_ATTEMPTS}), retrying:\n{format_exc()}")
+            time.sleep(UPLOAD_RETRY_DELAY * attempt)
+
+
+def _read_thread_file(filename: str) -> bytes:
+    """Content of a file of the thread as it is stored, binary files included"""
+    content = Context().files.read_bytes(filename)
+    if content is None:
+        raise Exception(f"Cannot read {filename} from the thread")
+    return content
+
+
+def _map_bounded(executor: ThreadPoolExecutor, func: Callable, items: Iterable, window: int) -> Iterator[Tuple[Any, Future]]:
+    """Like `executor.map`, but takes the next item only when fewer than `window` calls are unfinished,
+    and yields every item with its future, in order"""
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+def _verify_manifest(registry: Registry, entry_location: nearai.EntryLocation, paths: Iterable[str]):
+    """Checks that the registry entry lists every uploaded path"""
+    try:
+        with Context().metrics.measure("registry", "list_files"):
+            listed = set(registry.list_files(entry_location))
+    except Exception:
+        Context().env.add_system_log(f"Cannot list the files of {entry_location.version} to verify the upload, error:\n{format_exc()}")
+        return
+
+    missing = [path for path in paths if path not in listed]
+    if missing:
+        # Not in the registry after all, a retry sends them again
+        state = Context().state
+        state.uploaded_files = {path: digest for path, digest in state.uploaded_files.items() if path not in missing}
+        raise Exception(f"Version {entry_location.version} in the registry is missing uploaded files: {missing}")
+    Context().env.add_system_log(f"Verified {len(listed)} files of {entry_location.version} in the registry")
 
-    plain_metadata = json.loads(env.read_file(metadata_path))
 
-    Context().state.metadata = json.dumps(plain_metadata)
-    Context().dump_state()
+def _log_upload_summary(version: str, results: Dict[str, Tuple[str, int, bool]], previous_files: Dict[str, str]):
+    uploaded = [size for _, size, sent in results.values() if sent]
+    skipped = [size for _, size, sent in results.values() if not sent]
+    changed = [path for path, (digest, _, _) in results.items() if previous_files.get(path) != digest]
 
-    namespace = nearai.CONFIG.auth.namespace
+    Context().env.add_system_log(
+        f"Upload of {version}: {len(uploaded)} files ({sum(uploaded)} bytes) uploaded, "
+        f"{len(skipped)} files ({sum(skipped)} bytes) skipped as already uploaded. "
+        f"Changed since the previous upload: {changed}"
+    )
+
+
+def _upload(registry: Registry, env: Environment) -> nearai.EntryLocation:
+    metadata = Context().get_metadata()
+    if metadata is None:
+        raise Exception("The agent has no metadata.json, generate it first")
+    plain_metadata = metadata.model_dump()
+
+    namespace = current_auth().namespace
     name = plain_metadata.pop("name")
 
     entry_location = nearai.EntryLocation.model_validate(
@@ -34,20 +131,21 @@ def _upload(registry: Registry, env: Environment) -> nearai.EntryLocation:
         print(f"Only default source is allowed, found: {source}. Remove details._source from metadata.")
         raise Exception("Only default source is allowed, found: {source}. Remove details._source from metadata.")
 
-    registry.update(entry_location, entry_metadata)
+    with Context().metrics.measure("registry", "update_metadata"):
+        registry.update(entry_location, entry_metadata)
 
     all_files: Dict[str, FileObject] = {}
 
     # Traverse all files in the directory `path`
-    files_in_thread = env.list_files_from_thread()
+    files_in_thread = Context().files.list_files_from_thread()
     env.add_system_log(f"Traverse all files in the directory `path`: {files_in_thread}")
 
     for file in files_in_thread:
-        # Don't upload state.json file
-        if file.filename.find("state.json") >= 0:
+        # Don't upload state.json file and other files of the builder
+        if is_internal_file(file.filename):
             continue
         # Don't upload metadata file.
-        if file.filename == metadata_path:
+        if file.filename == METADATA_PATH:
             continue
 
         saved_file = all_files.get(file.filename, None)
@@ -59,34 +157,52 @@ def _upload(registry: Registry, env: Environment) -> nearai.EntryLocation:
 
     env.add_system_log(f"Files to upload: {all_files.values()}")
 
-    if "agent.py" not in all_files:
-        # TODO: Dirty hack
-        try:
-            registry.api.upload_file_v1_registry_upload_file_post(
-                path="agent.py",
-                file=Context().state.agent_py.encode('utf-8'),
-                namespace=entry_location.namespace,
-                name=entry_location.name,
-                version=entry_location.version,
-            )
-        except Exception as e:
-            Context().env.add_system_log(f"Cannot upload dirty python.py, {format_exc()}")
-
-    for file in all_files.values():
-        try:
-            registry.api.upload_file_v1_registry_upload_file_post(
-                path=file.filename,
-                file=env.read_file(file.filename).encode('utf-8'),
-                namespace=entry_location.namespace,
-                name=entry_location.name,
-                version=entry_location.version,
-            )
-        except nearai.openapi_client.exceptions.BadRequestException as e:
-            if isinstance(e.body, str) and "already exists" in e.body:
-                raise Exception(f"File already exists at version {entry_location.version}, {e.body}")
-
-            raise e
-
+    state = Context().state
+    previous_files = state.uploaded_files
+    # Registry versions are immutable and the registry cannot copy files from another version, so only files of the
+    # same version can be skipped: this speeds up the retry of a failed upload, a new version sends every file again.
+    # The manifest of the previous version is still used to log which files changed.
+    uploaded_files = previous_files if state.uploaded_version == entry_location.version else {}
+
+    sources: Dict[str, Callable[[], bytes]] = {
+        filename: lambda filename=filename: _read_thread_file(filename) for filename in all_files
+    }
+    if "agent.py" not in sources and state.agent_py:
+        # The code is in the state even if agent.py wasn't written to the thread
+        env.add_system_log("agent.py is not in the thread, taking it from the state")
+        sources["agent.py"] = lambda: state.agent_py.encode("utf-8")
+
+    errors = []
+    results: Dict[str, Tuple[str, int, bool]] = {}
+
+    def upload_source(path: str) -> Tuple[str, int, bool]:
+        content = sources[path]()
+        digest = hashlib.sha256(content).hexdigest()
+        if digest == uploaded_files.get(path):
+            return digest, len(content), False
+        _upload_file(registry, entry_location, path, content)
+        return digest, len(content), True
+
+    # The registry takes one file per request: files are read and sent concurrently, at most UPLOAD_MAX_WORKERS
+    # of them are held in memory at a time
+    with ContextThreadPoolExecutor(max_workers=UPLOAD_MAX_WORKERS) as executor:
+        for path, future in _map_bounded(executor, upload_source, list(sources), UPLOAD_MAX_WORKERS):
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                env.add_system_log(f"Cannot upload {path}, error:\n{format_exc()}")
+                errors.append(e)
+
+    # Remember what is stored in the registry even if some of the files failed, so a retry sends only the rest
+    state.uploaded_version = entry_location.version
+    state.uploaded_files = {**uploaded_files, **{path: digest for path, (digest, _, _) in results.items()}}
+    _log_upload_summary(entry_location.version, results, previous_files)
+
+    # Raise the first error in the order files were listed, after every upload has finished
+    if errors:
+        raise errors[0]
+
+    _verify_manifest(registry, entry_location, list(sources))
     return entry_location
 
 
@@ -101,14 +217,15 @@ def upload(version: str):
     env.add_system_log("Uploading agent...")
     try:
         env.add_system_log("Updating metadata.json version...")
-        metadata = json.loads(env.read_file('metadata.json'))
-        metadata['version'] = version
-        env.write_file('metadata.json', json.dumps(metadata, indent=2))
+        metadata = Context().get_metadata()
+        if metadata is None:
+            raise Exception("The agent has no metadata.json, generate it first")
+        Context().set_metadata(metadata.model_copy(update={"version": version}))
 
         env.add_system_log("Uploading files...")
-        registry = Registry()
-        registry.api.api_client.configuration.access_token = f"Bearer {nearai.CONFIG.auth.model_dump_json()}"
+        registry = get_registry()
         agent_id = _upload(registry, env)
+        Context().record_version(version)
 
         env.add_reply(
             f"Agent uploaded successfully.\n"
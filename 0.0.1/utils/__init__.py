@@ -1,9 +1,38 @@
+import contextvars
 import json
+import threading
+import time
+from collections import OrderedDict
 from traceback import format_exc
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, Set, Tuple, TYPE_CHECKING
 from nearai.agents.environment import Environment
-from pydantic import BaseModel
-from litellm import Message
+from pydantic import BaseModel, ConfigDict, PrivateAttr
+from utils.blobs import BlobStore, blob_digest, BLOB_MARKER
+from utils.scratchpad import compact_scratchpad, get_token_budget, needs_compaction
+from utils.completion_cache import CompletionCache
+from utils.metrics import TurnMetrics
+from utils.state_backends import StateBackend, create_state_backend
+from utils.files import TurnFileCache
+
+if TYPE_CHECKING:
+    from nearai.shared.auth_data import AuthData
+
+
+# Large fields of the state that are kept in blobs and loaded only when accessed
+BLOB_FIELDS = ("metadata", "agent_py")
+
+
+METADATA_PATH = "metadata.json"
+COMPLETION_CACHE_SUFFIX = "_completion_cache.json"
+# Also matches the _metrics.jsonl files of the older versions, so they are never uploaded
+METRICS_SUFFIX = "_metrics.json"
+# Idle conversations a long-lived worker keeps in memory, the least recently used ones are dropped first
+CONTEXT_CACHE_SIZE = 32
+
+
+def is_internal_file(filename: str) -> bool:
+    """Files the builder keeps in the thread for itself, they are never uploaded with the agent"""
+    return any(filename.find(marker) >= 0 for marker in ("state.json", BLOB_MARKER, COMPLETION_CACHE_SUFFIX, METRICS_SUFFIX))
 
 
 class PendingSecrets(BaseModel):
@@ -12,54 +41,379 @@ class PendingSecrets(BaseModel):
     values: Optional[Dict[str, str]] = None
 
 
+class AgentMetadata(BaseModel):
+    """metadata.json of the generated agent, fields the builder doesn't know are kept as they are"""
+    model_config = ConfigDict(extra="allow")
+
+    name: str
+    version: str = ""
+    description: str = ""
+    category: str = "agent"
+    tags: List[str] = []
+    details: Dict[str, Any] = {}
+    show_entry: bool = True
+
+    def to_json(self) -> str:
+        return json.dumps(self.model_dump(), indent=2)
+
+
 class AgentState(BaseModel):
-    metadata: str       = ""
-    agent_py: str       = ""
     agent_name: str     = ""
     agent_description: str = ""
     last_version: str   = ""
     pending_secrets: Optional[PendingSecrets] = None
     scratchpad: str     = ""
+    # Summary of the scratchpad entries that were compacted away
+    scratchpad_digest: str = ""
+    # sha256 of every file uploaded to the registry for `uploaded_version`
+    uploaded_version: str = ""
+    uploaded_files: Dict[str, str] = {}
+    # Content hashes of BLOB_FIELDS, the content itself is in the blob store
+    blobs: Dict[str, str] = {}
+    # Uploaded version -> content hash of its agent.py
+    code_versions: Dict[str, str] = {}
+    # Route of `utils.router` -> number of turns it handled, turns answered by the model are counted as "llm"
+    router_hits: Dict[str, int] = {}
+    # Incremented by every save, a context kept in memory reloads the state when the saved one is newer
+    revision: int = 0
+
+    _blob_store: Optional[BlobStore] = PrivateAttr(default=None)
+    _blob_values: Dict[str, str] = PrivateAttr(default_factory=dict)
+
+    # Fields assigned a new value since the last save. Only assignments are tracked,
+    # so reassign fields instead of mutating dicts or nested models in place.
+    _dirty_fields: Set[str] = PrivateAttr(default_factory=set)
+    # Held by assignments and by `snapshot`, stages of a pipeline change the state while it is saved
+    _lock: threading.RLock = PrivateAttr(default_factory=threading.RLock)
+
+    def __setattr__(self, name: str, value: Any):
+        if name not in type(self).model_fields:
+            super().__setattr__(name, value)
+            return
+        with self._lock:
+            if getattr(self, name) != value:
+                self._dirty_fields.add(name)
+            super().__setattr__(name, value)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self._dirty_fields)
+
+    @property
+    def dirty_fields(self) -> Set[str]:
+        return set(self._dirty_fields)
+
+    def snapshot(self) -> Tuple[Dict[str, Any], Set[str]]:
+        """Stores the blobs and returns the fields to save with the fields changed since the last snapshot,
+        which are no longer dirty. Fields changed after the snapshot stay dirty for the next save."""
+        with self._lock:
+            self.store_blobs()
+            self.revision += 1
+            changed = set(self._dirty_fields)
+            self._dirty_fields -= changed
+            return self.model_dump(mode="json"), changed
+
+    def mark_dirty(self, fields: Set[str]):
+        """Fields of a snapshot that couldn't be saved"""
+        with self._lock:
+            self._dirty_fields |= fields
+
+    @classmethod
+    def columns(cls) -> Dict[str, bool]:
+        """Fields as stored by the state backends, with whether their values are not plain strings"""
+        return {name: field.annotation is not str for name, field in cls.model_fields.items()}
+
+    def _get_blob(self, field: str) -> str:
+        if field not in self._blob_values:
+            digest = self.blobs.get(field, None)
+            self._blob_values[field] = "" if digest is None else self._blob_store.get(digest)
+        return self._blob_values[field]
+
+    def _set_blob(self, field: str, value: str):
+        with self._lock:
+            if blob_digest(value) != self.blobs.get(field, blob_digest("")):
+                self._dirty_fields.add(field)
+            self._blob_values[field] = value
+
+    metadata = property(lambda self: self._get_blob("metadata"), lambda self, value: self._set_blob("metadata", value))
+    agent_py = property(lambda self: self._get_blob("agent_py"), lambda self, value: self._set_blob("agent_py", value))
+
+    def bind_blob_store(self, blob_store: BlobStore):
+        self._blob_store = blob_store
+
+    def store_blobs(self):
+        """Moves the values set since the state was loaded into the blob store, keeping only their hashes"""
+        blobs = dict(self.blobs)
+        for field, value in self._blob_values.items():
+            if value == "":
+                blobs.pop(field, None)
+            else:
+                blobs[field] = self._blob_store.put(value)
+        self.blobs = blobs
+
+
+class ContextRegistry:
+    """Contexts of the conversations served by this process, keyed by thread id.
+    A context stays in memory between the turns of its conversation until it's idle for too long."""
+
+    def __init__(self, max_idle: int = CONTEXT_CACHE_SIZE):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._contexts: "OrderedDict[str, Context]" = OrderedDict()
+        self._active: Dict[str, int] = {}
+
+    def acquire(self, env: Environment) -> "Context":
+        """The context of the thread of `env`, bound to `env` for the turn"""
+        thread_id = env.get_thread().id
+        with self._lock:
+            context = self._contexts.pop(thread_id, None)
+            if context is None:
+                context = object.__new__(Context)
+                context.thread_id = thread_id
+                context._state = AgentState()
+                context._dump_lock = threading.Lock()
+                context._init_lock = threading.RLock()
+            self._contexts[thread_id] = context
+            self._active[thread_id] = self._active.get(thread_id, 0) + 1
+        context._bind(env)
+        return context
+
+    def release(self, context: "Context"):
+        """Marks the turn of the context as finished and drops the least recently used idle contexts"""
+        with self._lock:
+            active = self._active.pop(context.thread_id, 1) - 1
+            if active > 0:
+                self._active[context.thread_id] = active
+            idle = [thread_id for thread_id in self._contexts if thread_id not in self._active]
+            for thread_id in idle[:max(0, len(idle) - self.max_idle)]:
+                del self._contexts[thread_id]
+
+    def __len__(self) -> int:
+        return len(self._contexts)
+
+    def clear(self):
+        with self._lock:
+            self._contexts.clear()
+            self._active.clear()
+
+
+# Context of the conversation the running code works for, copied to worker threads by `utils.concurrency`
+_current: contextvars.ContextVar[Optional["Context"]] = contextvars.ContextVar("context", default=None)
 
 
 class Context:
-    _instance: Optional["Context"] = None
+    """State, storage and auth of one conversation. `Context(env)` starts a turn and makes the context
+    of the thread of `env` current, `Context()` returns the current one."""
+    registry = ContextRegistry()
+
+    thread_id: str
+    env: Environment
+    auth: Optional["AuthData"] = None
     _state: AgentState = None
+    _loaded: bool = False
+    _state_filename: Optional[str] = None
+    _state_backend: Optional[StateBackend] = None
+    _blob_store: Optional[BlobStore] = None
+    _completion_cache: Optional[CompletionCache] = None
+    _metrics: Optional[TurnMetrics] = None
+    _files: Optional[TurnFileCache] = None
+    _metadata: Optional[AgentMetadata] = None
+    # The scratchpad is compacted at most once per turn, it may stay over the budget until the next turn
+    _scratchpad_compacted: bool = False
+    # Saves of the state one at a time, so an older snapshot is never written after a newer one
+    _dump_lock: threading.Lock
+    # Creates the caches below once, workers of `utils.pipeline` and `utils.tool_executor` may reach them first
+    # at the same time, and a second cache would lose the writes of the first one
+    _init_lock: threading.RLock
 
     def __new__(cls, env: Environment = None):
-        if cls._instance is None:
-            assert env is not None
-            cls._instance = super().__new__(cls)
-            cls._instance.env = env  # Initialize env only once
-            cls._instance._state = AgentState()
-        return cls._instance
+        if env is not None:
+            context = cls.registry.acquire(env)
+            _current.set(context)
+            return context
+        context = _current.get()
+        if context is None:
+            raise Exception("No conversation is active, create the context with `Context(env)` first")
+        return context
+
+    @classmethod
+    def current(cls) -> Optional["Context"]:
+        return _current.get()
+
+    def _bind(self, env: Environment):
+        """Points the context to the environment of a new turn, the state and the login of the previous turns are kept"""
+        self.env = env
+        # Metrics and thread files are per turn and go through the methods of `env`
+        self._metrics = None
+        self._files = None
+        self._metadata = None
+        self._scratchpad_compacted = False
+        if self._state_backend is not None:
+            self._state_backend.env = env
+        if self._completion_cache is not None:
+            self._completion_cache.env = env
+
+    def release(self):
+        """Ends the turn, the context stays in memory for the next message of the conversation"""
+        Context.registry.release(self)
+
+    @property
+    def state_filename(self) -> str:
+        if self._state_filename is None:
+            self._state_filename = f"{self.env.get_thread().id}_state.json"
+        return self._state_filename
+
+    @property
+    def state_backend(self) -> StateBackend:
+        """Selected by the STATE_BACKEND environment variable, see `utils.state_backends`"""
+        if self._state_backend is None:
+            with self._init_lock:
+                if self._state_backend is None:
+                    self._state_backend = create_state_backend(self.env, self.thread_id, AgentState.columns())
+        return self._state_backend
+
+    @property
+    def blob_store(self) -> BlobStore:
+        if self._blob_store is None:
+            with self._init_lock:
+                if self._blob_store is None:
+                    self._blob_store = BlobStore(self.state_backend)
+        return self._blob_store
+
+    @property
+    def metrics(self) -> TurnMetrics:
+        if self._metrics is None:
+            with self._init_lock:
+                if self._metrics is None:
+                    metrics = TurnMetrics(self.env, self.state_filename.replace("_state.json", METRICS_SUFFIX))
+                    metrics.instrument_env()
+                    self._metrics = metrics
+        return self._metrics
+
+    @property
+    def files(self) -> TurnFileCache:
+        """Thread files of the turn, written to the storage by `flush_files` at the end of the turn"""
+        if self._files is None:
+            with self._init_lock:
+                if self._files is None:
+                    self._files = TurnFileCache(self.env)
+        return self._files
+
+    def flush_files(self):
+        """Writes the thread files changed during the turn, a failed write is logged by the cache.
+        Runs after the metrics of the turn are added to the files, so its duration is only logged."""
+        if self._files is None:
+            return
+        started = time.perf_counter()
+        try:
+            self._files.flush()
+        except Exception:
+            return
+        self.env.add_system_log(f"{self._files.summary()}, flushed in {time.perf_counter() - started:.3f}s")
+
+    def get_metadata(self) -> Optional[AgentMetadata]:
+        """Metadata of the agent, from the state or metadata.json, parsed once per turn.
+        Don't change the returned object, pass a changed copy to `set_metadata`."""
+        if self._metadata is None:
+            content = self.state.metadata or self.files.read_file(METADATA_PATH)
+            if content:
+                self._metadata = AgentMetadata.model_validate_json(content)
+        return self._metadata
+
+    def set_metadata(self, metadata: AgentMetadata):
+        content = metadata.to_json()
+        self._metadata = metadata
+        self.files.write_file(METADATA_PATH, content)
+        self.state.metadata = content
+
+    @property
+    def completion_cache(self) -> CompletionCache:
+        if self._completion_cache is None:
+            with self._init_lock:
+                if self._completion_cache is None:
+                    self._completion_cache = CompletionCache(
+                        self.env, self.state_filename.replace("_state.json", COMPLETION_CACHE_SUFFIX)
+                    )
+        return self._completion_cache
 
     def load_state(self):
+        if self._loaded and not self._state.dirty:
+            try:
+                with self.metrics.measure("state", "revision", backend=self.state_backend.name):
+                    revision = self.state_backend.revision()
+            except Exception:
+                revision = None
+                self.env.add_system_log(f"Cannot read the revision of the state, reloading it, error:\n{format_exc()}")
+            if revision == self._state.revision:
+                self.env.add_system_log("Using the state kept in memory since the previous turn")
+                return
+            # Saved by another process, or the save of the previous turn failed
+            self.env.add_system_log(f"State in memory is at revision {self._state.revision}, saved one at {revision}, reloading")
         try:
-            filename = f"{Context().env.get_thread().id}_state.json"
+            backend = self.state_backend
 
-            state_json = self.env.read_file(filename)
-            if state_json is None:
+            with self.metrics.measure("state", "load", backend=backend.name):
+                plain_state = backend.load()
+            if plain_state is None:
                 state = AgentState()
+                state.bind_blob_store(self.blob_store)
             else:
-                state = AgentState.model_validate_json(state_json)
-                self.env.add_system_log(f"Successfully loaded {filename}")
+                # States saved before blobs were introduced keep the large fields inline
+                inline_fields = {field: plain_state.pop(field) for field in BLOB_FIELDS if field in plain_state}
+                state = AgentState.model_validate(plain_state)
+                state.bind_blob_store(self.blob_store)
+                for field, value in inline_fields.items():
+                    setattr(state, field, value)
+                self.env.add_system_log(f"Successfully loaded the state from {backend.name}")
             self._state = state
+            self._loaded = True
         except Exception as e:
             self._state = AgentState()
-            self.env.add_system_log(f"Cannot load state.json, error:\n{format_exc()}")
+            self._state.bind_blob_store(self.blob_store)
+            self.env.add_system_log(f"Cannot load the state, error:\n{format_exc()}")
 
     def dump_state(self):
-        filename = f"{Context().env.get_thread().id}_state.json"
-        try:
-            self.env.write_file(filename, self._state.model_dump_json())
-        except Exception as e:
-            self.env.add_system_log(f"Cannot save {filename}, error:\n{format_exc()}")
+        """Writes the changed fields of the state to the backend, called once at the end of the turn"""
+        if not self._state.dirty:
+            self.env.add_system_log("State wasn't changed, skipping save")
+            return
+
+        backend = self.state_backend
+        with self._dump_lock:
+            state = self._state
+            fields, changed = state.snapshot()
+            try:
+                with self.metrics.measure("state", "dump", backend=backend.name) as record:
+                    saved = changed & set(AgentState.model_fields)
+                    record["bytes"] = backend.save(fields, saved)
+                    record["fields"] = sorted(saved)
+            except Exception as e:
+                state.mark_dirty(changed)
+                self.env.add_system_log(f"Cannot save the state to {backend.name}, error:\n{format_exc()}")
+
+    def record_version(self, version: str):
+        """Remembers the current agent.py as the code of the uploaded `version`"""
+        self.state.last_version = version
+        self.state.code_versions = {**self.state.code_versions, version: self.blob_store.put(self.state.agent_py)}
+
+    def restore_version(self, version: str) -> bool:
+        """Makes the code of a previously uploaded `version` current again"""
+        digest = self.state.code_versions.get(version, None)
+        if digest is None:
+            return False
+        self.state.agent_py = self.blob_store.get(digest)
+        self.state.last_version = version
+        return True
+
+    def checkpoint(self, reason: str):
+        """Saves the state right away, for the points where losing the changes made so far is expensive"""
+        self.env.add_system_log(f"Checkpoint of the state: {reason}")
+        self.dump_state()
 
     def write_message_to_scratchpad(self, message: Any):
         if isinstance(message, str):
             text = message
-        elif isinstance(message, Message):
+        elif hasattr(message, "model_dump_json"):
             text = message.model_dump_json()
         else:
             try:
@@ -70,6 +424,21 @@ class Context:
         if text is not None:
             self.state.scratchpad += f"\n{text}"
             self.env.add_system_log(f"+++++++\nWriting to scratchpad:\n{text}\n+++++++")
+            self.compact_scratchpad()
+
+    def compact_scratchpad(self):
+        budget = get_token_budget(self.env)
+        if self._scratchpad_compacted or not needs_compaction(self.state.scratchpad_digest, self.state.scratchpad, budget):
+            return
+        self._scratchpad_compacted = True
+        digest, scratchpad = compact_scratchpad(
+            self.env,
+            self.state.scratchpad_digest,
+            self.state.scratchpad,
+            budget
+        )
+        self.state.scratchpad_digest = digest
+        self.state.scratchpad = scratchpad
 
     @property
     def state(self) -> AgentState:
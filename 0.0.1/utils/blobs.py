@@ -0,0 +1,46 @@
+import base64
+import hashlib
+import zlib
+from typing import Dict, Set, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.state_backends import StateBackend
+
+
+BLOB_MARKER = "_blob_"
+
+
+def blob_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class BlobStore:
+    """Compressed, content-addressed text blobs kept by the state backend.
+    Blobs are never rewritten: the same content always maps to the same blob."""
+
+    def __init__(self, backend: "StateBackend"):
+        self.backend = backend
+        self._cache: Dict[str, str] = {}
+        self._written: Set[str] = set()
+
+    def put(self, text: str) -> str:
+        digest = blob_digest(text)
+        if digest not in self._written and digest not in self._cache:
+            # Base64 keeps the blob a plain text file for env.read_file
+            content = base64.b64encode(zlib.compress(text.encode("utf-8"))).decode("ascii")
+            self.backend.write_blob(digest, content)
+            self.backend.env.add_system_log(f"Saved blob {digest[:12]}: {len(text)} -> {len(content)} bytes")
+            self._written.add(digest)
+        self._cache[digest] = text
+        return digest
+
+    def get(self, digest: str) -> str:
+        if digest not in self._cache:
+            content = self.backend.read_blob(digest)
+            if content is None:
+                raise Exception(f"Blob {digest} is missing in the {self.backend.name} storage")
+            text = zlib.decompress(base64.b64decode(content)).decode("utf-8")
+            if blob_digest(text) != digest:
+                raise Exception(f"Blob {digest} is corrupted")
+            self._cache[digest] = text
+        return self._cache[digest]
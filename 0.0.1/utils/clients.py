@@ -0,0 +1,111 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, TYPE_CHECKING
+import nearai
+
+# The registry and the OpenAPI clients are heavy to import, they are loaded with the first client
+if TYPE_CHECKING:
+    from nearai.registry import Registry
+    from nearai.openapi_client.api import HubSecretsApi
+    from nearai.shared.auth_data import AuthData
+
+
+# Keep-alive connections shared by all the clients of one auth, matches the number of parallel uploads
+CONNECTION_POOL_SIZE = 8
+# Number of auths whose clients are kept, the least recently used are closed. As many as the conversations
+# kept in memory, see `utils.CONTEXT_CACHE_SIZE`
+CLIENTS_CACHE_SIZE = 32
+
+
+class _Clients:
+    def __init__(self, auth):
+        from nearai.registry import Registry
+        from nearai.openapi_client import ApiClient, Configuration
+        from nearai.openapi_client.api import HubSecretsApi
+        from nearai.openapi_client.api.registry_api import RegistryApi
+
+        configuration = Configuration(
+            host=nearai.CONFIG.api_url,
+            access_token=f"Bearer {auth.model_dump_json()}"
+        )
+        configuration.connection_pool_maxsize = CONNECTION_POOL_SIZE
+
+        self.api_client = ApiClient(configuration)
+
+        self.registry = Registry()
+        self.registry.api = RegistryApi(self.api_client)
+
+        self.hub_secrets = HubSecretsApi(self.api_client)
+
+    def close(self):
+        self.api_client.rest_client.pool_manager.clear()
+
+
+_lock = threading.Lock()
+_clients: "OrderedDict[str, _Clients]" = OrderedDict()
+# The auth object the last lookup was made for and its key, so the same auth isn't serialized on every call
+_last: Optional[Tuple[object, str, _Clients]] = None
+
+
+def _auth_key(auth: "AuthData") -> str:
+    return hashlib.sha256(auth.model_dump_json().encode("utf-8")).hexdigest()
+
+
+def current_auth() -> Optional["AuthData"]:
+    """Auth of the conversation of the current `utils.Context`, `nearai.CONFIG.auth` if it has none"""
+    from utils import Context
+
+    context = Context.current()
+    if context is not None and context.auth is not None:
+        return context.auth
+    return nearai.CONFIG.auth
+
+
+def _get_clients() -> _Clients:
+    global _last
+
+    auth = current_auth()
+    last = _last
+    if last is not None and last[0] is auth:
+        with _lock:
+            if _clients.get(last[1], None) is last[2]:
+                _clients.move_to_end(last[1])
+                return last[2]
+
+    key = _auth_key(auth)
+    with _lock:
+        clients = _clients.get(key, None)
+        if clients is None:
+            clients = _Clients(auth)
+            _clients[key] = clients
+            while len(_clients) > CLIENTS_CACHE_SIZE:
+                _, evicted = _clients.popitem(last=False)
+                evicted.close()
+        _clients.move_to_end(key)
+        _last = (auth, key, clients)
+    return clients
+
+
+def get_registry() -> "Registry":
+    """Registry client authenticated with the auth of the current conversation"""
+    return _get_clients().registry
+
+
+def get_hub_secrets() -> "HubSecretsApi":
+    """Secrets API client authenticated with the auth of the current conversation"""
+    return _get_clients().hub_secrets
+
+
+def invalidate_clients(auth: Optional["AuthData"] = None):
+    """Drops the cached clients of `auth`, or all of them, and closes their connections.
+    Called when a conversation logs in with another account, its old clients are unlikely to be used again."""
+    global _last
+
+    with _lock:
+        keys = list(_clients) if auth is None else [_auth_key(auth)]
+        for key in keys:
+            clients = _clients.pop(key, None)
+            if clients is not None:
+                clients.close()
+        _last = None
@@ -0,0 +1,245 @@
+import ast
+import re
+import sys
+from typing import Dict, List, Optional, Set
+
+
+# Names that usually hold credentials, used for variables, dict keys and headers
+_SECRET_NAME = re.compile(
+    r"(api[_-]?key|apikey|token|secret|password|passwd|auth|bearer|credential|(?:^|[_\- ])key(?:$|[_\- ]))",
+    re.IGNORECASE
+)
+# Values that are obviously left for the user to fill in
+_PLACEHOLDER = re.compile(
+    r"^(bearer\s+)?(<[^>]+>|\{[^}]*\}|\[[^\]]*\]|your[_\- ].*|.*[_\- ]here|insert[_\- ].*|replace[_\- ].*|x{4,}|\*{3,}|\.{3}|todo|changeme)$",
+    re.IGNORECASE
+)
+# Settings and keyword arguments of common libraries that look like credentials but aren't
+_NOT_SECRET_NAME = re.compile(
+    r"((?:max|min|num|total)[_\-]?(?:new[_\-]?)?tokens?|tokens?[_\-]?(?:limit|count|usage)|tokeni[sz]er"
+    r"|(?:sort|primary|cache|partition)[_\-]?key|key[_\-]?(?:func|fn|name|id|path)|^author(?:[_\-]?name)?$)",
+    re.IGNORECASE
+)
+_ENV_VARS_FALLBACK = re.compile(r"env\.env_vars(?:\.get\(|\[)\s*[\"']([^\"']+)[\"']")
+
+
+def is_secret_name(name: str) -> bool:
+    """Whether a variable, key or header with this name usually holds a credential"""
+    return _SECRET_NAME.search(name) is not None and _NOT_SECRET_NAME.search(name) is None
+
+
+def _is_env_vars(node: ast.AST) -> bool:
+    """`env.env_vars`, `os.environ`"""
+    return (isinstance(node, ast.Attribute)
+            and ((node.attr == "env_vars" and isinstance(node.value, ast.Name) and node.value.id == "env")
+                 or (node.attr == "environ" and isinstance(node.value, ast.Name) and node.value.id == "os")))
+
+
+def _key_from_placeholder(value: str, fallback: str) -> str:
+    name = re.sub(r"^(bearer\s+)?(your[_\- ])?", "", value.strip("<>{}[] "), flags=re.IGNORECASE)
+    name = re.sub(r"[_\- ]here$", "", name, flags=re.IGNORECASE)
+    name = re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_").upper()
+    if not name or not is_secret_name(name):
+        name = re.sub(r"[^A-Za-z0-9]+", "_", fallback).strip("_").upper()
+    return name
+
+
+class _SecretsVisitor(ast.NodeVisitor):
+    def __init__(self):
+        self.keys: List[str] = []
+        self.constants = {}
+
+    def _add(self, key: Optional[str]):
+        if key and key not in self.keys:
+            self.keys.append(key)
+
+    def _add_env_var(self, key: Optional[str]):
+        # Settings like DEBUG or MODEL are read from the environment too, only credentials are asked for
+        if key and is_secret_name(key):
+            self._add(key)
+
+    def _string(self, node: ast.AST) -> Optional[str]:
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self.constants.get(node.id, None)
+        return None
+
+    def _check_credential(self, name: str, value_node: ast.AST):
+        value = self._string(value_node)
+        if value is not None and is_secret_name(name) and _PLACEHOLDER.match(value.strip()):
+            self._add(_key_from_placeholder(value, name))
+
+    def visit_Assign(self, node: ast.Assign):
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                value = self._string(node.value)
+                if value is not None and target.id.isupper():
+                    self.constants[target.id] = value
+                self._check_credential(target.id, node.value)
+        self.generic_visit(node)
+
+    def visit_Call(self, node: ast.Call):
+        # env.env_vars.get("KEY"), os.environ.get("KEY")
+        if isinstance(node.func, ast.Attribute) and node.func.attr == "get" and _is_env_vars(node.func.value) and node.args:
+            self._add_env_var(self._string(node.args[0]))
+        # os.getenv("KEY")
+        if (isinstance(node.func, ast.Attribute) and node.func.attr == "getenv"
+                and isinstance(node.func.value, ast.Name) and node.func.value.id == "os" and node.args):
+            self._add_env_var(self._string(node.args[0]))
+        for keyword in node.keywords:
+            if keyword.arg:
+                self._check_credential(keyword.arg, keyword.value)
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node: ast.Subscript):
+        # env.env_vars["KEY"]
+        if _is_env_vars(node.value):
+            self._add_env_var(self._string(node.slice))
+        self.generic_visit(node)
+
+    def visit_Dict(self, node: ast.Dict):
+        # {"Authorization": "Bearer YOUR_TOKEN"}, {"api_key": "<API_KEY>"}
+        for key, value in zip(node.keys, node.values):
+            name = self._string(key) if key is not None else None
+            if name is not None:
+                self._check_credential(name, value)
+        self.generic_visit(node)
+
+
+def find_secret_keys(code: str) -> List[str]:
+    """Names of the credentials the code expects the user to provide: `env.env_vars` and `os.environ` lookups
+    of credential-like names, and placeholder values of credentials and auth headers."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return [key for key in dict.fromkeys(_ENV_VARS_FALLBACK.findall(code)) if is_secret_name(key)]
+
+    visitor = _SecretsVisitor()
+    visitor.visit(tree)
+    return visitor.keys
+
+
+# Import names of the libraries listed in `framework_prompt` that differ from their package names
+_IMPORT_NAMES = {
+    "pynacl": "nacl",
+    "python_dateutil": "dateutil",
+    "py-near": "py_near",
+    "py-multibase": "multibase",
+    "py-multicodec": "multicodec",
+    "googlesearch-python": "googlesearch",
+}
+# Importable in the runtime of the agents without being listed, they are dependencies of the framework
+_FRAMEWORK_IMPORTS = {"nearai", "requests", "httpx", "botocore", "pkg_resources"}
+# The framework doesn't let agents use these directly
+_BANNED_IMPORTS = {
+    "os": "`os` can't be used directly, use `env.env_vars` for the environment and `env.read_file`/`env.write_file` for files",
+    "asyncio": "async code is not supported by the framework",
+}
+
+_allowed_imports: Optional[Set[str]] = None
+
+
+def allowed_imports() -> Set[str]:
+    """Top-level modules a generated agent can import: the standard library, the libraries listed in
+    `framework_prompt` and the framework itself. Empty if the standard library isn't known to this Python."""
+    global _allowed_imports
+    if _allowed_imports is None:
+        stdlib = getattr(sys, "stdlib_module_names", None)
+        _allowed_imports = set() if stdlib is None else (
+            set(stdlib) | _FRAMEWORK_IMPORTS | {library_import_name(name) for name in framework_libraries()}
+        )
+    return _allowed_imports
+
+
+def framework_libraries() -> List[str]:
+    """Package names of the libraries listed in `framework_prompt`"""
+    from prompts import framework_prompt
+
+    libraries = re.search(r"<libraries>(.*?)</libraries>", framework_prompt, re.DOTALL)
+    return [re.split(r"[\s=<>!~;,\[]", line.strip())[0] for line in libraries.group(1).splitlines() if line.strip()]
+
+
+def library_import_name(package: str) -> str:
+    return _IMPORT_NAMES.get(package, package.replace("-", "_"))
+
+
+def _imports(tree: ast.AST) -> Dict[str, int]:
+    """Top-level module of every import -> line of its first import"""
+    modules: Dict[str, int] = {}
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                modules.setdefault(alias.name.split(".")[0], node.lineno)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.setdefault(node.module.split(".")[0], node.lineno)
+    return modules
+
+
+def _registered_tools(tree: ast.AST) -> List[str]:
+    """Names of the functions passed to `register_tool`"""
+    return [
+        node.args[0].id for node in ast.walk(tree)
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == "register_tool"
+        and node.args and isinstance(node.args[0], ast.Name)
+    ]
+
+
+def find_code_problems(code: str) -> List[str]:
+    """Problems that would break a generated agent.py on the hub: syntax errors, imports that are not available
+    or not allowed, async code and tools the tool registry cannot describe. Empty if none were found."""
+    try:
+        tree = ast.parse(code)
+        compile(tree, "agent.py", "exec")
+    except SyntaxError as e:
+        return [f"The code doesn't compile: {e.msg} at line {e.lineno}"]
+
+    problems = []
+    allowed = allowed_imports()
+    for module, line in _imports(tree).items():
+        if module in _BANNED_IMPORTS:
+            problems.append(f"Line {line}: {_BANNED_IMPORTS[module]}")
+        elif allowed and module not in allowed:
+            problems.append(f"Line {line}: `{module}` is not one of the available libraries")
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.AsyncFunctionDef, ast.Await, ast.AsyncFor, ast.AsyncWith)):
+            problems.append(f"Line {node.lineno}: {_BANNED_IMPORTS['asyncio']}")
+            break
+
+    functions = {node.name: node for node in ast.walk(tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    for name in dict.fromkeys(_registered_tools(tree)):
+        function = functions.get(name, None)
+        if function is None:
+            continue
+        docstring = ast.get_docstring(function)
+        if not docstring:
+            problems.append(f"Tool `{name}` has no docstring, the tool registry needs it to describe the tool")
+            continue
+        # The registry takes the first docstring line starting with the parameter name and splits it on ":"
+        lines = [line.strip() for line in docstring.split("\n")[1:]]
+        for argument in function.args.args:
+            line = next((line for line in lines if line.startswith(argument.arg)), None)
+            if line is not None and ":" not in line:
+                problems.append(f"Docstring of tool `{name}` describes `{argument.arg}` without a colon, "
+                                f"use `{argument.arg} (type): description`")
+    return problems
+
+
+# Drafts shorter than this are most likely cut off or stubs
+_MIN_AGENT_LINES = 15
+
+
+def score_agent_code(code: str) -> float:
+    """Ranks candidate drafts of agent.py, higher is better: code that doesn't compile scores 0,
+    every problem of `find_code_problems` costs 10 points, suspiciously short drafts 20,
+    and among equal drafts the shorter one wins"""
+    problems = find_code_problems(code)
+    if problems and problems[0].startswith("The code doesn't compile"):
+        return 0.0
+
+    lines = code.count("\n") + 1
+    score = 100.0 - 10 * len(problems) - lines / 1000
+    if lines < _MIN_AGENT_LINES:
+        score -= 20
+    return max(score, 1.0)
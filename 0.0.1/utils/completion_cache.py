@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from traceback import format_exc
+from typing import Callable, Dict, List, Optional
+from nearai.agents.environment import Environment
+from utils.files import TurnFileCache
+
+
+COMPLETION_CACHE_MAX_ENTRIES = 64
+COMPLETION_CACHE_MAX_BYTES = 2 * 1024 * 1024
+COMPLETION_CACHE_TTL = 7 * 24 * 60 * 60
+
+_METADATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "metadata.json")
+_defaults: Optional[Dict] = None
+
+
+def builder_defaults() -> Dict:
+    """Inference defaults of the builder itself, from its metadata.json"""
+    global _defaults
+    if _defaults is None:
+        try:
+            with open(_METADATA_PATH, "r") as f:
+                _defaults = json.load(f)["details"]["agent"]["defaults"]
+        except Exception:
+            _defaults = {}
+    return _defaults
+
+
+class CompletionCache:
+    """Memoizes completions that are deterministic (temperature 0) in a JSON file of the thread storage,
+    with LRU eviction bounded by entries and bytes, and a TTL. Changes are saved by `flush`."""
+
+    def __init__(self, env: Environment, filename: str):
+        self.env = env
+        self.filename = filename
+        self.hits = 0
+        self.misses = 0
+        self._entries: Optional[OrderedDict] = None
+        self._changed = False
+        self._lock = threading.RLock()
+
+    def _load(self) -> OrderedDict:
+        if self._entries is None:
+            entries = OrderedDict()
+            try:
+                content = self.env.read_file(self.filename)
+                if content:
+                    entries = OrderedDict(json.loads(content))
+            except Exception:
+                self.env.add_system_log(f"Cannot load completion cache, starting an empty one. Error:\n{format_exc()}")
+            self._entries = entries
+        return self._entries
+
+    @staticmethod
+    def _params(kwargs: Dict) -> Dict:
+        defaults = builder_defaults()
+        params = {
+            "model": kwargs.get("model") or defaults.get("model", ""),
+            "temperature": kwargs.get("temperature", defaults.get("model_temperature", None)),
+        }
+        params.update({key: value for key, value in kwargs.items() if key not in params})
+        return params
+
+    @staticmethod
+    def key(messages: List, params: Dict) -> str:
+        payload = json.dumps({"params": params, "messages": messages}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def completion(self, messages: List, generate: Optional[Callable[[], str]] = None, **kwargs) -> str:
+        """Returns the cached response for the same model, parameters and messages,
+        otherwise calls `generate` (`env.completion` by default) and caches its result"""
+        if generate is None:
+            generate = lambda: self.env.completion(messages, **kwargs)
+
+        params = self._params(kwargs)
+        if params["temperature"] != 0:
+            return generate()
+
+        key = self.key(messages, params)
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(key, None)
+            if entry is not None and time.time() - entry["created_at"] < COMPLETION_CACHE_TTL:
+                entries.move_to_end(key)
+                self.hits += 1
+                return entry["response"]
+            self.misses += 1
+
+        response = generate()
+
+        with self._lock:
+            entries[key] = {"created_at": time.time(), "response": response}
+            self._evict(entries)
+            self._changed = True
+        return response
+
+    def _evict(self, entries: OrderedDict):
+        now = time.time()
+        for key in [key for key, entry in entries.items() if now - entry["created_at"] >= COMPLETION_CACHE_TTL]:
+            del entries[key]
+
+        size = sum(len(entry["response"]) for entry in entries.values())
+        while entries and (len(entries) > COMPLETION_CACHE_MAX_ENTRIES or size > COMPLETION_CACHE_MAX_BYTES):
+            _, entry = entries.popitem(last=False)
+            size -= len(entry["response"])
+
+    def flush(self, files: TurnFileCache):
+        """Saves the changed entries, written to the storage with the other files of the turn"""
+        with self._lock:
+            if self.hits or self.misses:
+                self.env.add_system_log(f"Completion cache: {self.hits} hits, {self.misses} misses")
+            if not self._changed:
+                return
+            try:
+                files.write_file(self.filename, json.dumps(self._entries))
+                self._changed = False
+            except Exception:
+                self.env.add_system_log(f"Cannot save completion cache, error:\n{format_exc()}")
@@ -0,0 +1,11 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Callable
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """Runs every task in a copy of the submitter's contextvars, so workers see the `utils.Context`
+    of the conversation that started them and the reply ordering of `utils.tool_executor`"""
+
+    def submit(self, fn: Callable, /, *args, **kwargs) -> Future:
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
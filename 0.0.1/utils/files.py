@@ -0,0 +1,99 @@
+import threading
+from traceback import format_exc
+from typing import Any, Dict, List, Optional, Tuple, Union
+from nearai.agents.environment import Environment
+
+
+# Files larger than this are read through without being kept, an upload would otherwise hold every file of the agent
+TURN_FILE_CACHE_MAX_FILE_BYTES = 1024 * 1024
+
+
+class TurnFileCache:
+    """Thread files read and written during one turn. Reads are served from memory after the first one,
+    writes are kept in memory and only the last content of every file is written, by `flush` at the end of the turn.
+    Listing the files flushes first, so the listing includes the files written during the turn."""
+
+    def __init__(self, env: Environment):
+        self.env = env
+        self.reads = 0
+        self.hits = 0
+        self.writes = 0
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._contents: Dict[str, Optional[bytes]] = {}
+        # Filename -> content and keyword arguments of `env.write_file`, in the order the files were first written
+        self._pending: Dict[str, Tuple[Union[str, bytes], Dict[str, Any]]] = {}
+        self._listings: Dict[str, List] = {}
+
+    def _fetch(self, filename: str) -> Optional[bytes]:
+        try:
+            content = self.env.read_file(filename, decode=None)
+        except TypeError:
+            # Environments without `decode` return text only
+            content = self.env.read_file(filename)
+        return content.encode("utf-8") if isinstance(content, str) else content
+
+    def read_bytes(self, filename: str) -> Optional[bytes]:
+        """Content of the file as it is stored, None if there is no such file"""
+        with self._lock:
+            if filename in self._contents:
+                self.hits += 1
+                return self._contents[filename]
+        # Read outside of the lock, files of an upload are read concurrently
+        content = self._fetch(filename)
+        with self._lock:
+            self.reads += 1
+            if filename in self._contents:
+                # Written while it was being read
+                return self._contents[filename]
+            if content is None or len(content) <= TURN_FILE_CACHE_MAX_FILE_BYTES:
+                self._contents[filename] = content
+        return content
+
+    def read_file(self, filename: str, decode: Optional[str] = "utf-8") -> Optional[Union[str, bytes]]:
+        content = self.read_bytes(filename)
+        if content is None or not decode:
+            return content
+        return content.decode(decode)
+
+    def write_file(self, filename: str, content: Union[str, bytes], **kwargs):
+        with self._lock:
+            encoding = kwargs.get("encoding", "utf-8")
+            self._contents[filename] = content if isinstance(content, bytes) else content.encode(encoding)
+            # Written again, goes to the storage once with the last content
+            self._pending.pop(filename, None)
+            self._pending[filename] = (content, kwargs)
+            self._listings.clear()
+
+    def list_files_from_thread(self, order: str = "desc", thread_id: Optional[str] = None) -> List:
+        if thread_id is not None:
+            return self.env.list_files_from_thread(order=order, thread_id=thread_id)
+        self.flush()
+        with self._lock:
+            if order not in self._listings:
+                self._listings[order] = self.env.list_files_from_thread(order=order)
+            return list(self._listings[order])
+
+    def flush(self):
+        """Writes the files changed since the last flush to the thread storage"""
+        # One flush at a time, so an older content is never written after a newer one
+        with self._flush_lock:
+            with self._lock:
+                pending = list(self._pending.items())
+                self._pending.clear()
+                if pending:
+                    self._listings.clear()
+            for index, (filename, (content, kwargs)) in enumerate(pending):
+                try:
+                    self.env.write_file(filename, content, **kwargs)
+                    self.writes += 1
+                except Exception:
+                    self.env.add_system_log(f"Cannot write {filename}, error:\n{format_exc()}")
+                    with self._lock:
+                        # Kept for the next flush unless the file was written again meanwhile
+                        for filename, write in pending[index:]:
+                            self._pending.setdefault(filename, write)
+                    raise
+
+    def summary(self) -> str:
+        return f"Thread files: {self.reads} reads from the storage, {self.hits} from memory, {self.writes} writes"
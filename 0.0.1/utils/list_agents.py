@@ -0,0 +1,37 @@
+"""Lists the agents built in all the conversations of a self-hosted builder that keeps its state in sqlite
+(STATE_BACKEND=sqlite), run from the agent directory:
+
+    python -m utils.list_agents                    # the database at the default STATE_DB_PATH
+    python -m utils.list_agents --db PATH --json   # another database, one JSON object per line
+"""
+import json
+import sys
+from datetime import datetime
+from typing import List
+
+from utils import AgentState
+from utils.state_backends import DEFAULT_STATE_DB_PATH, list_agents
+
+
+def main(argv: List[str]) -> int:
+    path = argv[argv.index("--db") + 1] if "--db" in argv[:-1] else DEFAULT_STATE_DB_PATH
+    try:
+        agents = list_agents(path, AgentState.columns())
+    except Exception as e:
+        print(f"Cannot list the agents: {e}")
+        return 1
+
+    for agent in agents:
+        if "--json" in argv:
+            print(json.dumps(agent))
+        else:
+            updated_at = datetime.fromtimestamp(agent["updated_at"]).strftime("%Y-%m-%d %H:%M")
+            print(f"{updated_at}  {agent['agent_name']} {agent['last_version'] or '(not uploaded)'}  "
+                  f"thread {agent['thread_id']}: {agent['agent_description']}")
+    if not agents and "--json" not in argv:
+        print(f"No agents in {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,136 @@
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from traceback import format_exc
+from typing import Any, Dict, List
+from nearai.agents.environment import Environment
+from utils.files import TurnFileCache
+from utils.tokens import estimate_tokens
+
+
+# Turns kept with all their records in the metrics file, older turns are only counted in the totals
+METRICS_RECENT_TURNS = 20
+
+
+# Set while `env.completion` runs: nearai's `completion` calls `completions`, the inner call is part of its record
+_measuring: contextvars.ContextVar[bool] = contextvars.ContextVar("measuring_completion", default=False)
+
+
+def _messages_tokens(messages) -> int:
+    if isinstance(messages, str):
+        return estimate_tokens(messages)
+    return sum(estimate_tokens(str(message.get("content", "") or "")) for message in messages if isinstance(message, dict))
+
+
+class TurnMetrics:
+    """Collects wall time, tokens, bytes and outcome of the slow operations of one turn and adds them
+    to the metrics file of the thread: totals of all the turns and the records of the latest ones."""
+
+    def __init__(self, env: Environment, filename: str):
+        self.env = env
+        self.filename = filename
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._records: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, kind: str, name: str, **fields):
+        """Records the duration of the block, the block can add fields to the yielded record"""
+        record: Dict[str, Any] = dict(fields)
+        started = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield record
+        except BaseException as e:
+            outcome = f"error: {type(e).__name__}"
+            raise
+        finally:
+            self.record(kind, name, started, time.perf_counter() - started, outcome, **record)
+
+    def record(self, kind: str, name: str, started: float, duration: float, outcome: str = "ok", **fields):
+        """Adds an operation that was timed by the caller, `started` is a `time.perf_counter()` value"""
+        record = {
+            "kind": kind,
+            "name": name,
+            **fields,
+            "at": round(started - self._started, 4),
+            "duration": round(duration, 4),
+            "outcome": outcome,
+        }
+        with self._lock:
+            self._records.append(record)
+
+    def instrument_env(self):
+        """Wraps the completion methods of the environment to measure every call once"""
+        completion = self.env.completion
+        completions = self.env.completions
+        completions_and_run_tools = self.env.completions_and_run_tools
+
+        def measured_completion(messages, *args, **kwargs):
+            if _measuring.get():
+                return completion(messages, *args, **kwargs)
+            token = _measuring.set(True)
+            try:
+                with self.measure("completion", "completion", prompt_tokens=_messages_tokens(messages)) as record:
+                    response = completion(messages, *args, **kwargs)
+                    record["completion_tokens"] = estimate_tokens(response)
+                    return response
+            finally:
+                _measuring.reset(token)
+
+        def measured(name, method):
+            def measured_completions(messages, *args, **kwargs):
+                if _measuring.get():
+                    return method(messages, *args, **kwargs)
+                with self.measure("completion", name, prompt_tokens=_messages_tokens(messages)) as record:
+                    response = method(messages, *args, **kwargs)
+                    usage = getattr(response, "usage", None)
+                    if usage is not None and getattr(usage, "prompt_tokens", 0):
+                        record["prompt_tokens"] = usage.prompt_tokens
+                        record["completion_tokens"] = usage.completion_tokens
+                    return response
+            return measured_completions
+
+        self.env.completion = measured_completion
+        self.env.completions = measured("completions", completions)
+        self.env.completions_and_run_tools = measured("completions_and_run_tools", completions_and_run_tools)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        summary: Dict[str, Dict[str, Any]] = {}
+        for record in self._records:
+            kind = summary.setdefault(record["kind"], {"count": 0, "duration": 0.0, "errors": 0})
+            kind["count"] += 1
+            kind["duration"] = round(kind["duration"] + record["duration"], 4)
+            kind["errors"] += record["outcome"] != "ok"
+            for field in ("prompt_tokens", "completion_tokens", "bytes"):
+                if field in record:
+                    kind[field] = kind.get(field, 0) + record[field]
+        return summary
+
+    def flush(self, files: TurnFileCache):
+        """Adds the turn to the metrics file, written to the storage with the other files of the turn"""
+        with self._lock:
+            turn = {
+                "started_at": self.started_at,
+                "duration": round(time.perf_counter() - self._started, 4),
+                "summary": self.summary(),
+                "records": self._records,
+            }
+        if self.env.env_vars.get("METRICS_SUMMARY", False):
+            self.env.add_system_log(f"Turn metrics: {json.dumps({'duration': turn['duration'], **turn['summary']})}")
+
+        try:
+            content = files.read_file(self.filename)
+            metrics = json.loads(content) if content else {"turns": 0, "totals": {}, "recent": []}
+            metrics["turns"] += 1
+            for kind, summary in turn["summary"].items():
+                totals = metrics["totals"].setdefault(kind, {})
+                for field, value in summary.items():
+                    totals[field] = round(totals.get(field, 0) + value, 4)
+            metrics["recent"] = metrics["recent"][-(METRICS_RECENT_TURNS - 1):] + [turn]
+            files.write_file(self.filename, json.dumps(metrics, separators=(",", ":")))
+        except Exception:
+            self.env.add_system_log(f"Cannot save turn metrics, error:\n{format_exc()}")
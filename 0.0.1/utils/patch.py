@@ -0,0 +1,61 @@
+import re
+from typing import List, Tuple
+
+
+_EDIT_BLOCK = re.compile(
+    r"<{7} SEARCH\n(?P<search>.*?)\n?={7}\n(?P<replace>.*?)\n?>{7} REPLACE",
+    re.DOTALL
+)
+
+
+class PatchError(Exception):
+    pass
+
+
+def parse_edit_blocks(text: str) -> List[Tuple[str, str]]:
+    # The markers end with "\n", a response with Windows line ends wouldn't match them
+    text = text.replace("\r\n", "\n")
+    blocks = [(match.group("search"), match.group("replace")) for match in _EDIT_BLOCK.finditer(text)]
+    if not blocks:
+        raise PatchError("No SEARCH/REPLACE blocks found in the response")
+    return blocks
+
+
+def _find_unique(code: str, search: str) -> Tuple[int, int]:
+    count = code.count(search)
+    if count == 1:
+        start = code.index(search)
+        return start, start + len(search)
+    if count > 1:
+        raise PatchError(f"SEARCH block matches {count} places:\n{search}")
+
+    # The model often gets trailing whitespace wrong, retry matching whole lines without it
+    code_lines = code.split("\n")
+    search_lines = [line.rstrip() for line in search.split("\n")]
+    matches = [
+        i for i in range(len(code_lines) - len(search_lines) + 1)
+        if [line.rstrip() for line in code_lines[i:i + len(search_lines)]] == search_lines
+    ]
+    if len(matches) != 1:
+        raise PatchError(f"SEARCH block matches {len(matches)} places:\n{search}")
+
+    matched = code_lines[matches[0]:matches[0] + len(search_lines)]
+    start = sum(len(line) + 1 for line in code_lines[:matches[0]])
+    # The trailing whitespace of the last line, "\r" of Windows line ends included, stays in the code
+    end = start + len("\n".join(matched)) - (len(matched[-1]) - len(matched[-1].rstrip()))
+    return start, end
+
+
+def apply_edit_blocks(code: str, blocks: List[Tuple[str, str]]) -> str:
+    """Applies SEARCH/REPLACE blocks one after another and checks that the result is valid Python"""
+    for search, replace in blocks:
+        if not search.strip():
+            raise PatchError("Empty SEARCH block")
+        start, end = _find_unique(code, search)
+        code = code[:start] + replace + code[end:]
+
+    try:
+        compile(code, "agent.py", "exec")
+    except SyntaxError as e:
+        raise PatchError(f"Patched code doesn't compile: {e}")
+    return code
@@ -0,0 +1,80 @@
+import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+from nearai.agents.environment import Environment
+from utils.concurrency import ContextThreadPoolExecutor
+
+
+class Pipeline:
+    """Runs stages as soon as the stages they depend on are finished, independent stages run concurrently.
+    Each stage function gets the results of its dependencies as keyword arguments."""
+
+    def __init__(self, env: Environment, name: str, max_workers: int = 4):
+        self.env = env
+        self.name = name
+        self.max_workers = max_workers
+        self._stages: Dict[str, Tuple[Callable[..., Any], Tuple[str, ...]]] = {}
+        self.timings: Dict[str, Tuple[float, float]] = {}
+
+    def stage(self, name: str, func: Callable[..., Any], depends_on: Sequence[str] = ()):
+        """Adds a stage, it can only depend on the stages added before it, so the stages never form a cycle"""
+        if name in self._stages:
+            raise Exception(f"Stage {name} is already added")
+        for dependency in depends_on:
+            if dependency not in self._stages:
+                raise Exception(f"Stage {name} depends on unknown stage {dependency}")
+        self._stages[name] = (func, tuple(depends_on))
+
+    def _run_stage(self, name: str, results: Dict[str, Any]) -> Any:
+        func, depends_on = self._stages[name]
+        started_at = time.perf_counter()
+        try:
+            return func(**{dependency: results[dependency] for dependency in depends_on})
+        finally:
+            self.timings[name] = (started_at, time.perf_counter())
+
+    def run(self) -> Dict[str, Any]:
+        """Runs all the stages and returns their results, raises the error of the first failed stage"""
+        started_at = time.perf_counter()
+        results: Dict[str, Any] = {}
+        pending = dict(self._stages)
+        running: Dict[Future, str] = {}
+        error = None
+
+        with ContextThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if error is None:
+                    ready = [name for name, (_, depends_on) in pending.items()
+                             if all(dependency in results for dependency in depends_on)]
+                    for name in ready:
+                        del pending[name]
+                        running[executor.submit(self._run_stage, name, results)] = name
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        # Let the running stages finish, but don't start new ones
+                        error = error or e
+
+        self._log_timings(time.perf_counter() - started_at, skipped=list(pending))
+        if error is not None:
+            raise error
+        return results
+
+    def _log_timings(self, total: float, skipped: List[str]):
+        origin = min((start for start, _ in self.timings.values()), default=0)
+        stages = ", ".join(
+            f"{name} {end - start:.2f}s (at {start - origin:.2f}s)"
+            for name, (start, end) in sorted(self.timings.items(), key=lambda item: item[1][0])
+        )
+        sequential = sum(end - start for start, end in self.timings.values())
+        self.env.add_system_log(
+            f"Pipeline {self.name} took {total:.2f}s, {sequential:.2f}s if run sequentially. Stages: {stages}"
+            + (f". Skipped after an error: {skipped}" if skipped else "")
+        )
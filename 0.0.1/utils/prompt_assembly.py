@@ -0,0 +1,36 @@
+from typing import Dict, List, Tuple
+from nearai.agents.environment import Environment
+from utils.tokens import estimate_tokens
+
+
+# How often a segment changes, segments are ordered from the most static to the most volatile
+# so that consecutive turns and threads share the longest possible prompt prefix
+STATIC = 0      # same for every thread, e.g. instructions
+SESSION = 1     # changes a few times per thread, e.g. the generated code
+TURN = 2        # changes every turn, e.g. the scratchpad
+
+
+class PromptAssembler:
+    def __init__(self):
+        self._segments: List[Tuple[int, str, str]] = []
+
+    def add(self, name: str, content: str, stability: int):
+        if content:
+            self._segments.append((stability, name, content))
+
+    def _ordered(self) -> List[Tuple[int, str, str]]:
+        return sorted(self._segments, key=lambda segment: segment[0])
+
+    def messages(self) -> List[Dict[str, str]]:
+        """System messages: all static segments joined into the first one, then one message per other segment"""
+        ordered = self._ordered()
+        static = "\n\n".join(content for stability, _, content in ordered if stability == STATIC)
+        messages = [{"role": "system", "content": static}] if static else []
+        messages += [{"role": "system", "content": content} for stability, _, content in ordered if stability != STATIC]
+        return messages
+
+    def report(self, env: Environment):
+        ordered = self._ordered()
+        prefix = sum(estimate_tokens(content) for stability, _, content in ordered if stability == STATIC)
+        segments = ", ".join(f"{name} ~{estimate_tokens(content)}" for _, name, content in ordered)
+        env.add_system_log(f"Prompt segments (tokens): {segments}. Static prefix ~{prefix} tokens")
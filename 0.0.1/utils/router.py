@@ -0,0 +1,110 @@
+import json
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from utils.code_analysis import is_secret_name
+
+
+_LOGIN = re.compile(r"^\s*/?(?:please\s+)?(?:log\s?in|sign\s?in)(?:\s+(?:me|please))?\s*[.!]?\s*$", re.IGNORECASE)
+_UPLOAD = re.compile(
+    r"^\s*(?:please\s+)?(?:upload|release|publish|deploy)(?:\s+(?:it|the\s+agent|my\s+agent|agent))?"
+    r"(?:\s+(?:as|with|to))?(?:\s+version)?\s+v?(?P<version>\d+(?:\.\d+){1,3}(?:[-+][\w.]+)?)\s*[.!]?\s*$",
+    re.IGNORECASE
+)
+_RESTORE = re.compile(
+    r"^\s*(?:please\s+)?(?:roll\s?back|revert|restore|go\s+back)(?:\s+(?:it|the\s+agent|my\s+agent|agent))?"
+    r"(?:\s+to)?(?:\s+version)?\s+v?(?P<version>\d+(?:\.\d+){1,3}(?:[-+][\w.]+)?)\s*[.!]?\s*$",
+    re.IGNORECASE
+)
+# `API_KEY=value`, `API_KEY: value`
+_SECRET_ASSIGNMENT = re.compile(r"""^\s*(?P<key>[A-Za-z_][A-Za-z0-9_]*)\s*[=:]\s*["'`]?(?P<value>[^\s"'`]+)["'`]?\s*$""")
+# `save API_KEY value`, `set API_KEY to value`
+_SECRET_COMMAND = re.compile(
+    r"""^\s*(?:set|save|store)\s+(?P<key>[A-Za-z_][A-Za-z0-9_]*)(?:\s*[=:]\s*|\s+(?:to\s+|as\s+)?)["'`]?(?P<value>[^\s"'`]+)["'`]?\s*$""",
+    re.IGNORECASE
+)
+
+
+class Route:
+    """Sends the messages that `parse` recognizes to `tool` with the parsed arguments.
+    Messages of private routes contain credentials and are not written to the scratchpad."""
+
+    def __init__(self, name: str, tool: str, parse: Callable[[str, object], Optional[Dict[str, str]]], private: bool = False):
+        self.name = name
+        self.tool = tool
+        self.parse = parse
+        self.private = private
+
+
+def _parse_login_save(message: str, state) -> Optional[Dict[str, str]]:
+    if message.find("nearai login save") == 0:
+        return {"login_command": message}
+    return None
+
+
+def _parse_login(message: str, state) -> Optional[Dict[str, str]]:
+    return {} if _LOGIN.match(message) else None
+
+
+def _parse_upload(message: str, state) -> Optional[Dict[str, str]]:
+    match = _UPLOAD.match(message)
+    return {"version": match.group("version")} if match else None
+
+
+def _parse_restore(message: str, state) -> Optional[Dict[str, str]]:
+    match = _RESTORE.match(message)
+    return {"version": match.group("version")} if match else None
+
+
+def _parse_secrets(message: str, state) -> Optional[Dict[str, str]]:
+    """Every line must set one secret, and every key must be expected by the agent or look like a credential"""
+    matches = []
+    for line in message.strip().splitlines():
+        if not line.strip():
+            continue
+        match = _SECRET_ASSIGNMENT.match(line) or _SECRET_COMMAND.match(line)
+        if match is None:
+            return None
+        matches.append(match)
+    # Only messages that look like secrets load the metadata of the agent from the state
+    if not matches or not state.metadata:
+        return None
+
+    expected_keys = {key.upper(): key for key in (state.pending_secrets.keys or {})} if state.pending_secrets else {}
+    secrets = {}
+    for match in matches:
+        key = match.group("key")
+        if key.upper() in expected_keys:
+            key = expected_keys[key.upper()]
+        elif not (key.isupper() and is_secret_name(key)):
+            return None
+        secrets[key] = match.group("value")
+    return {"secrets": json.dumps(secrets)}
+
+
+# Checked in order, the first match wins. Anything that needs the conversation to be understood,
+# like confirming a plan before `generate`, is left to the model.
+ROUTES: List[Route] = [
+    Route("login_save", "finish_login_flow", _parse_login_save, private=True),
+    Route("login", "start_login_flow", _parse_login),
+    Route("upload", "upload", _parse_upload),
+    Route("restore", "restore_version", _parse_restore),
+    Route("secrets", "create_secrets", _parse_secrets, private=True),
+]
+
+
+def route(message: str, state) -> Optional[Tuple[Route, Dict[str, str]]]:
+    """The route and the tool arguments for a command message, None if the message should go to the model"""
+    for candidate in ROUTES:
+        arguments = candidate.parse(message, state)
+        if arguments is not None:
+            return candidate, arguments
+    return None
+
+
+def record_route(state, name: str) -> str:
+    """Counts the turn for the route, or for the model if `name` is "llm", and describes the hit rate"""
+    hits = {**state.router_hits, name: state.router_hits.get(name, 0) + 1}
+    state.router_hits = hits
+    turns = sum(hits.values())
+    routed = turns - hits.get("llm", 0)
+    return f"Router: {name}, {routed}/{turns} turns routed ({routed / turns:.0%}), hits: {json.dumps(hits, sort_keys=True)}"
@@ -0,0 +1,78 @@
+import re
+from traceback import format_exc
+from typing import List, Tuple
+from nearai.agents.environment import Environment
+from prompts import scratchpad_digest_prompt
+from utils.tokens import estimate_tokens, CHARS_PER_TOKEN
+
+
+# Scratchpad size (digest included) above which older entries are summarized
+SCRATCHPAD_TOKEN_BUDGET = 4000
+# Number of the latest entries that are always kept verbatim
+SCRATCHPAD_RECENT_ENTRIES = 10
+# Share of the budget the digest may take, the rest is left for the entries
+SCRATCHPAD_DIGEST_SHARE = 0.5
+
+_ENTRY_START = re.compile(r"\n(?=(?:User|Assistant): )")
+
+
+def split_entries(scratchpad: str) -> List[str]:
+    return [entry for entry in _ENTRY_START.split(scratchpad) if entry.strip()]
+
+
+def get_token_budget(env: Environment) -> int:
+    try:
+        return int(env.env_vars.get("SCRATCHPAD_TOKEN_BUDGET", SCRATCHPAD_TOKEN_BUDGET))
+    except Exception:
+        return SCRATCHPAD_TOKEN_BUDGET
+
+
+def needs_compaction(digest: str, scratchpad: str, token_budget: int) -> bool:
+    return estimate_tokens(digest) + estimate_tokens(scratchpad) > token_budget
+
+
+def _truncate_digest(digest: str, max_tokens: int) -> str:
+    """The beginning of the digest within `max_tokens`, cut at a line end when there is one"""
+    if estimate_tokens(digest) <= max_tokens:
+        return digest
+    truncated = digest[:max_tokens * CHARS_PER_TOKEN]
+    line_end = truncated.rfind("\n")
+    return truncated[:line_end] if line_end > 0 else truncated
+
+
+def compact_scratchpad(env: Environment, digest: str, scratchpad: str, token_budget: int,
+                       recent_entries: int = SCRATCHPAD_RECENT_ENTRIES) -> Tuple[str, str]:
+    """Folds the oldest scratchpad entries into the digest once digest and scratchpad exceed the budget,
+    the digest is kept within SCRATCHPAD_DIGEST_SHARE of the budget.
+    Returns the new digest and scratchpad, or the old ones if nothing had to be done."""
+    if not needs_compaction(digest, scratchpad, token_budget):
+        return digest, scratchpad
+    digest_budget = int(token_budget * SCRATCHPAD_DIGEST_SHARE)
+
+    entries = split_entries(scratchpad)
+    keep = min(recent_entries, len(entries) - 1)
+    # Recent entries may be large by themselves (e.g. a full technical plan), keep fewer of them then
+    while keep > 1 and sum(estimate_tokens(entry) for entry in entries[-keep:]) > token_budget // 2:
+        keep -= 1
+    if keep < 1:
+        # A single entry, only the digest can be shortened
+        return _truncate_digest(digest, digest_budget), scratchpad
+
+    old_entries, recent = entries[:-keep], entries[-keep:]
+    try:
+        new_digest = env.completion([
+            {"role": "system", "content": scratchpad_digest_prompt(digest, "\n".join(old_entries), max_words=digest_budget * 3 // 4)}
+        ])
+        # The model may not keep to the length it was asked for
+        new_digest = _truncate_digest(new_digest, digest_budget)
+    except Exception:
+        env.add_system_log(f"Cannot compact scratchpad, keeping it as is. Error:\n{format_exc()}")
+        return _truncate_digest(digest, digest_budget), scratchpad
+
+    new_scratchpad = "".join(f"\n{entry}" for entry in recent)
+    env.add_system_log(
+        f"Compacted scratchpad: {len(old_entries)} entries summarized, "
+        f"{estimate_tokens(digest) + estimate_tokens(scratchpad)} -> "
+        f"{estimate_tokens(new_digest) + estimate_tokens(new_scratchpad)} tokens"
+    )
+    return new_digest, new_scratchpad
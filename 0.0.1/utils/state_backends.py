@@ -0,0 +1,261 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterable, List, Optional
+from nearai.agents.environment import Environment
+from utils.blobs import BLOB_MARKER
+
+
+# Backend of the state when STATE_BACKEND is not set
+DEFAULT_STATE_BACKEND = "thread_file"
+# Database of the sqlite backend when STATE_DB_PATH is not set
+DEFAULT_STATE_DB_PATH = os.path.join(os.path.expanduser("~"), ".nearai", "agents_builder_state.sqlite3")
+# Seconds a writer waits for another writer of the database before failing
+SQLITE_BUSY_TIMEOUT = 10
+
+
+class StateBackend(ABC):
+    """Where the state of one conversation is kept: its fields and the blobs of its large fields.
+    `env` is the environment of the current turn, `utils.Context` rebinds it on every turn."""
+    name = ""
+
+    def __init__(self, env: Environment, thread_id: str):
+        self.env = env
+        self.thread_id = thread_id
+
+    @abstractmethod
+    def load(self) -> Optional[Dict[str, Any]]:
+        """Fields of the saved state, None if the conversation has no state yet"""
+
+    @abstractmethod
+    def save(self, fields: Dict[str, Any], changed: Iterable[str]) -> int:
+        """Saves the state, at least the `changed` fields, and returns the number of bytes written"""
+
+    @abstractmethod
+    def revision(self) -> Optional[int]:
+        """Revision of the saved state, None if the conversation has no state yet.
+        Checked on every turn of a context kept in memory, so it must be much cheaper than `load`."""
+
+    @abstractmethod
+    def read_blob(self, digest: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def write_blob(self, digest: str, content: str):
+        pass
+
+
+class ThreadFileStateBackend(StateBackend):
+    """The whole state in `{thread_id}_state.json` and every blob in its own file of the thread storage.
+    The revision is also written to a small file of its own, so checking it doesn't read the whole state."""
+    name = "thread_file"
+
+    @property
+    def filename(self) -> str:
+        return f"{self.thread_id}_state.json"
+
+    @property
+    def revision_filename(self) -> str:
+        # Contains "state.json", so it's never uploaded, see `utils.is_internal_file`
+        return f"{self.filename}.revision"
+
+    def blob_filename(self, digest: str) -> str:
+        return f"{self.thread_id}{BLOB_MARKER}{digest}.z"
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        state_json = self.env.read_file(self.filename)
+        return None if state_json is None else json.loads(state_json)
+
+    def save(self, fields: Dict[str, Any], changed: Iterable[str]) -> int:
+        state_json = json.dumps(fields, separators=(",", ":"))
+        self.env.write_file(self.filename, state_json)
+        # After the state, a process that sees the new revision finds the new state
+        revision = str(fields.get("revision", 0))
+        self.env.write_file(self.revision_filename, revision)
+        return len(state_json) + len(revision)
+
+    def revision(self) -> Optional[int]:
+        revision = self.env.read_file(self.revision_filename)
+        if revision:
+            return int(revision)
+        # Saved before the revision had a file of its own, or not saved at all
+        fields = self.load()
+        return None if fields is None else fields.get("revision", 0)
+
+    def read_blob(self, digest: str) -> Optional[str]:
+        return self.env.read_file(self.blob_filename(digest))
+
+    def write_blob(self, digest: str, content: str):
+        self.env.write_file(self.blob_filename(digest), content)
+
+
+class _Database:
+    """One SQLite file in WAL mode, with a connection per OS thread: readers are not blocked by a writer"""
+
+    def __init__(self, path: str, columns: Dict[str, bool]):
+        self.path = path
+        # Column -> whether it holds JSON, plain strings are stored as they are so they can be queried
+        self.columns = columns
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        connection = self.connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        with self._write_lock, connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS states (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+            existing = {row[1] for row in connection.execute("PRAGMA table_info(states)")}
+            # Fields added to the state later become new columns, missing values are loaded as the defaults
+            for column in columns:
+                if column not in existing:
+                    connection.execute(f'ALTER TABLE states ADD COLUMN "{column}" TEXT')
+            connection.execute("CREATE INDEX IF NOT EXISTS states_updated_at ON states (updated_at)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (thread_id TEXT NOT NULL, digest TEXT NOT NULL, content TEXT NOT NULL, "
+                "PRIMARY KEY (thread_id, digest)) WITHOUT ROWID"
+            )
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def load(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        columns = list(self.columns)
+        quoted = ", ".join(f'"{column}"' for column in columns)
+        row = self.connection().execute(f"SELECT {quoted} FROM states WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            column: json.loads(value) if self.columns[column] else value
+            for column, value in zip(columns, row) if value is not None
+        }
+
+    def save(self, thread_id: str, fields: Dict[str, Any]) -> int:
+        values = {
+            column: json.dumps(value) if self.columns[column] else value
+            for column, value in fields.items() if column in self.columns
+        }
+        names = ["thread_id", "updated_at", *values]
+        quoted = ", ".join(f'"{name}"' for name in names)
+        updates = ", ".join(f'"{name}" = excluded."{name}"' for name in names[1:])
+        with self._write_lock, self.connection() as connection:
+            connection.execute(
+                f"INSERT INTO states ({quoted}) VALUES ({', '.join('?' for _ in names)}) "
+                f"ON CONFLICT (thread_id) DO UPDATE SET {updates}",
+                (thread_id, time.time(), *values.values())
+            )
+        return sum(len(value or "") for value in values.values())
+
+    def revision(self, thread_id: str) -> Optional[int]:
+        row = self.connection().execute("SELECT revision FROM states WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return None
+        return 0 if row[0] is None else json.loads(row[0])
+
+    def read_blob(self, thread_id: str, digest: str) -> Optional[str]:
+        row = self.connection().execute(
+            "SELECT content FROM blobs WHERE thread_id = ? AND digest = ?", (thread_id, digest)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def write_blob(self, thread_id: str, digest: str, content: str):
+        with self._write_lock, self.connection() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO blobs (thread_id, digest, content) VALUES (?, ?, ?)", (thread_id, digest, content)
+            )
+
+    def list_agents(self) -> List[Dict[str, Any]]:
+        rows = self.connection().execute(
+            "SELECT thread_id, agent_name, agent_description, last_version, updated_at FROM states "
+            "WHERE agent_name IS NOT NULL AND agent_name != '' ORDER BY updated_at DESC"
+        )
+        keys = ("thread_id", "agent_name", "agent_description", "last_version", "updated_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+_databases_lock = threading.Lock()
+_databases: Dict[str, _Database] = {}
+
+
+def _database(path: str, columns: Dict[str, bool]) -> _Database:
+    with _databases_lock:
+        database = _databases.get(path, None)
+        if database is None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            database = _Database(path, columns)
+            _databases[path] = database
+        return database
+
+
+class SQLiteStateBackend(StateBackend):
+    """Every field of the state in its own column of a row per thread, only the changed fields are written.
+    Conversations that have no row yet are read from the thread storage once, so they carry on after a switch."""
+    name = "sqlite"
+
+    def __init__(self, env: Environment, thread_id: str, path: str, columns: Dict[str, bool]):
+        super().__init__(env, thread_id)
+        self.database = _database(path, columns)
+        self._fallback = ThreadFileStateBackend(env, thread_id)
+        self._migrated = False
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        fields = self.database.load(self.thread_id)
+        if fields is None:
+            self._fallback.env = self.env
+            fields = self._fallback.load()
+            # The first save has to write every field, the row doesn't exist yet
+            self._migrated = fields is not None
+        return fields
+
+    def save(self, fields: Dict[str, Any], changed: Iterable[str]) -> int:
+        if self._migrated:
+            changed = fields
+            self._migrated = False
+        return self.database.save(self.thread_id, {field: fields[field] for field in changed if field in fields})
+
+    def revision(self) -> Optional[int]:
+        revision = self.database.revision(self.thread_id)
+        if revision is None:
+            # Not migrated yet
+            self._fallback.env = self.env
+            return self._fallback.revision()
+        return revision
+
+    def read_blob(self, digest: str) -> Optional[str]:
+        content = self.database.read_blob(self.thread_id, digest)
+        if content is None:
+            self._fallback.env = self.env
+            content = self._fallback.read_blob(digest)
+            if content is not None:
+                self.database.write_blob(self.thread_id, digest, content)
+        return content
+
+    def write_blob(self, digest: str, content: str):
+        self.database.write_blob(self.thread_id, digest, content)
+
+
+def list_agents(path: str, columns: Dict[str, bool]) -> List[Dict[str, Any]]:
+    """Agents built in all the conversations saved in the sqlite database at `path`, the latest first,
+    see `utils/list_agents.py`"""
+    if not os.path.exists(path):
+        raise Exception(f"There is no state database at {path}")
+    return _database(path, columns).list_agents()
+
+
+def create_state_backend(env: Environment, thread_id: str, columns: Dict[str, bool]) -> StateBackend:
+    """The backend selected by the STATE_BACKEND environment variable, `columns` are the fields of the state
+    and whether their values are stored as JSON"""
+    name = env.env_vars.get("STATE_BACKEND", DEFAULT_STATE_BACKEND)
+    if name == ThreadFileStateBackend.name:
+        return ThreadFileStateBackend(env, thread_id)
+    if name == SQLiteStateBackend.name:
+        return SQLiteStateBackend(env, thread_id, env.env_vars.get("STATE_DB_PATH", DEFAULT_STATE_DB_PATH), columns)
+    raise Exception(f"Unknown STATE_BACKEND {name}, expected {ThreadFileStateBackend.name} or {SQLiteStateBackend.name}")
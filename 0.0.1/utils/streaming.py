@@ -0,0 +1,100 @@
+import importlib.metadata
+import logging
+import re
+import time
+from traceback import format_exc
+from typing import Callable, Optional
+from nearai.agents.environment import Environment
+from utils.metrics import TurnMetrics
+from utils.tokens import estimate_tokens
+
+
+# Progress is reported every time this many new lines were streamed
+PROGRESS_EVERY_LINES = 60
+# nearai has no public way to read a completion as it is generated, `env.completions(stream=True)` returns it
+# once it's finished. Streaming uses `env._run_inference_completions(messages, model, stream, **kwargs)`,
+# which has this signature in the versions below, any other version is reported when a completion is streamed.
+STREAMING_NEARAI_VERSIONS = ("0.1.19",)
+
+_FUNCTION_DEF = re.compile(r"^def (\w+)\(", re.MULTILINE)
+
+
+def last_function_name(code: str) -> Optional[str]:
+    names = _FUNCTION_DEF.findall(code)
+    return names[-1] if names else None
+
+
+def _nearai_version() -> str:
+    try:
+        return importlib.metadata.version("nearai")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def stream_completion(env: Environment, messages: list, label: str,
+                      on_progress: Optional[Callable[[str], None]] = None, metrics: Optional[TurnMetrics] = None,
+                      **kwargs) -> str:
+    """Same as `env.completion`, but reads the response as it is generated, calls `on_progress`
+    with the text received so far every PROGRESS_EVERY_LINES lines and logs time to first token and speed.
+    Streamed completions are added to `metrics`, the fallback to `env.completion` is measured by the environment."""
+    run_inference = getattr(env, "_run_inference_completions", None)
+    started_at = time.perf_counter()
+    first_token_at = None
+    parts = []
+
+    version = _nearai_version()
+    if version not in STREAMING_NEARAI_VERSIONS:
+        env.add_system_log(f"Streaming of {label} relies on a private method of nearai {', '.join(STREAMING_NEARAI_VERSIONS)}, "
+                           f"nearai {version} is installed", logging.WARNING)
+    if run_inference is None:
+        env.add_system_log(f"Cannot stream {label}, nearai {version} has no `_run_inference_completions`, "
+                           f"falling back to a regular completion", logging.WARNING)
+    else:
+        try:
+            lines = 0
+            reported_lines = 0
+            for chunk in run_inference(messages, "", True, **kwargs):
+                if not getattr(chunk, "choices", None):
+                    continue
+                delta = getattr(chunk.choices[0].delta, "content", None)
+                if not delta:
+                    continue
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(delta)
+
+                lines += delta.count("\n")
+                if on_progress is not None and lines - reported_lines >= PROGRESS_EVERY_LINES:
+                    reported_lines = lines
+                    on_progress("".join(parts))
+        except Exception:
+            if parts:
+                raise
+            env.add_system_log(f"Cannot stream {label} with nearai {version}, falling back to a regular completion. "
+                               f"Error:\n{format_exc()}", logging.WARNING)
+
+    streamed = first_token_at is not None
+    if not streamed:
+        if metrics is not None:
+            metrics.record("streaming", "fallback", started_at, time.perf_counter() - started_at, label=label,
+                           nearai_version=version)
+        text = env.completion(messages, **kwargs)
+        first_token_at = time.perf_counter()
+    else:
+        text = "".join(parts)
+
+    finished_at = time.perf_counter()
+    tokens = estimate_tokens(text)
+    if streamed and metrics is not None:
+        metrics.record(
+            "completion", label, started_at, finished_at - started_at,
+            time_to_first_token=round(first_token_at - started_at, 4),
+            prompt_tokens=sum(estimate_tokens(str(message.get("content", ""))) for message in messages),
+            completion_tokens=tokens
+        )
+    generation_time = max(finished_at - first_token_at, 1e-6)
+    env.add_system_log(
+        f"Completion {label}: time to first token {first_token_at - started_at:.2f}s, "
+        f"total {finished_at - started_at:.2f}s, ~{tokens} tokens, ~{tokens / generation_time:.1f} tokens/s"
+    )
+    return text
@@ -0,0 +1,11 @@
+import math
+
+
+# Rough number of characters per token for English text and code, good enough for budgeting prompts
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
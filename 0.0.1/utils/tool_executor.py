@@ -0,0 +1,170 @@
+import contextvars
+import json
+import logging
+import threading
+from traceback import format_exc
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from nearai.agents.environment import Environment
+from nearai.agents import tool_json_helper
+from utils.pipeline import Pipeline
+
+
+# Number of tool calls of one response that can run at the same time
+TOOL_EXECUTOR_MAX_WORKERS = 4
+
+
+def _secret_keys(arguments: Dict[str, Any]) -> Set[str]:
+    if "key" in arguments:
+        return {f"secret:{arguments['key']}"}
+    try:
+        return {f"secret:{key}" for key in json.loads(arguments.get("secrets", "{}"))}
+    except Exception:
+        return {"secrets"}
+
+
+# What every tool reads and writes, as functions of the call arguments. Calls run concurrently unless one writes
+# what the other reads or writes, then they run in the order the model made them. "agent" is the code and metadata
+# of the agent, "auth" the login of the user. Tools that are not listed conflict with every other call.
+TOOL_RESOURCES: Dict[str, Callable[[Dict[str, Any]], Tuple[Set[str], Set[str]]]] = {
+    "generate": lambda arguments: (set(), {"agent", "registry"}),
+    "update_agent": lambda arguments: ({"agent"}, {"agent", "registry"}),
+    "upload": lambda arguments: ({"agent", "auth"}, {"registry"}),
+    "restore_version": lambda arguments: ({"agent"}, {"agent"}),
+    "create_secret": lambda arguments: ({"agent", "auth"}, _secret_keys(arguments)),
+    "create_secrets": lambda arguments: ({"agent", "auth"}, _secret_keys(arguments)),
+    "start_login_flow": lambda arguments: (set(), set()),
+    "finish_login_flow": lambda arguments: (set(), {"auth", "secret:NEARAI_CONFIG"}),
+}
+
+# Index of the tool call the current thread works on, replies of the calls are kept in the order of the calls
+_current_call: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("current_call", default=None)
+
+
+class ToolCall:
+    def __init__(self, index: int, tool_call: Any):
+        self.index = index
+        self.id = getattr(tool_call, "id", None)
+        self.name = tool_call.function.name
+        self.raw_arguments = tool_call.function.arguments
+        self.arguments: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+
+    def conflicts_with(self, other: "ToolCall") -> bool:
+        if self.name not in TOOL_RESOURCES or other.name not in TOOL_RESOURCES:
+            return True
+        reads, writes = TOOL_RESOURCES[self.name](self.arguments)
+        other_reads, other_writes = TOOL_RESOURCES[other.name](other.arguments)
+        return bool(writes & (other_reads | other_writes) or other_writes & reads)
+
+
+class ToolExecutor:
+    """Runs the tool calls of a completion: calls that don't conflict run concurrently, the others in order.
+    Replies the tools add are passed on in the order of the calls, tool results are added to the thread
+    the way `env.completions_and_run_tools` does it, including the llama tool syntax of nearai."""
+
+    def __init__(self, env: Environment, tools: Dict[str, Callable], definitions: Dict[str, Dict]):
+        self.env = env
+        self.tools = tools
+        self.definitions = definitions
+        self._lock = threading.Lock()
+        self._buffers: Dict[int, List[Tuple[tuple, dict]]] = {}
+        self._finished: Set[int] = set()
+        self._head = 0
+        self._add_reply = None
+
+    def completions(self, messages: List[Dict[str, Any]], model: str = "", **kwargs) -> Any:
+        """`env.completions` with the tool definitions, llama models get them as a prompt and answer
+        with `<function=...>` calls in the text, `run` parses them like `env.completions_and_run_tools`"""
+        tools = list(self.definitions.values())
+        if Environment._use_llama_tool_syntax(model, tools):
+            messages = messages + [{"role": "system", "content": Environment._llama_tool_prompt(tools)}]
+        return self.env.completions(messages, model, tools=tools, **kwargs)
+
+    def _parse(self, call: ToolCall):
+        definition = self.definitions.get(call.name, None)
+        if definition is None or call.name not in self.tools:
+            raise Exception(f"Tool {call.name} not found")
+        call.arguments = tool_json_helper.parse_json_args(definition, call.raw_arguments) or {}
+
+    def _buffered_add_reply(self, *args, **kwargs):
+        index = _current_call.get()
+        with self._lock:
+            if index is None or index == self._head:
+                self._add_reply(*args, **kwargs)
+            else:
+                self._buffers[index].append((args, kwargs))
+
+    def _finish(self, index: int):
+        """Passes on the replies of the calls that are next in order"""
+        with self._lock:
+            self._finished.add(index)
+            while self._head in self._finished:
+                self._head += 1
+                for args, kwargs in self._buffers.pop(self._head, []):
+                    self._add_reply(*args, **kwargs)
+
+    def _run_call(self, call: ToolCall):
+        _current_call.set(call.index)
+        try:
+            self.env.add_system_log(f"Calling tool {call.name} with args {call.arguments}")
+            call.result = self.tools[call.name](**call.arguments)
+        except Exception as e:
+            call.error = f"Error calling tool {call.name}: {e}"
+            self.env.add_system_log(f"{call.error}\n{format_exc()}", logging.ERROR)
+        finally:
+            self._finish(call.index)
+
+    def run(self, message: Any, tool_role_name: str = "tool") -> List[ToolCall]:
+        # Native tool calls, or the ones written in the llama syntax, without them in the content
+        content, tool_calls = Environment._parse_tool_call(message)
+        if message.content:
+            self.env.add_message("assistant", content)
+
+        calls = [ToolCall(index, tool_call) for index, tool_call in enumerate(tool_calls or [])]
+        runnable = []
+        for call in calls:
+            try:
+                self._parse(call)
+                runnable.append(call)
+            except Exception as e:
+                call.error = f"Error calling tool {call.name}: {e}"
+                self.env.add_system_log(call.error, logging.ERROR)
+
+        if len(runnable) == 1:
+            contextvars.copy_context().run(self._run_call, runnable[0])
+        elif runnable:
+            self._run_concurrently(calls, runnable)
+
+        for call in calls:
+            self._add_result(call, tool_role_name)
+        return calls
+
+    def _run_concurrently(self, calls: List[ToolCall], runnable: List[ToolCall]):
+        self._buffers = {call.index: [] for call in calls}
+        # Calls that couldn't be parsed have nothing to wait for
+        self._finished = {call.index for call in calls if call not in runnable}
+        self._head = 0
+        while self._head in self._finished:
+            self._head += 1
+
+        self._add_reply = self.env.add_reply
+        self.env.add_reply = self._buffered_add_reply
+        try:
+            pipeline = Pipeline(self.env, "tool calls", max_workers=TOOL_EXECUTOR_MAX_WORKERS)
+            for position, call in enumerate(runnable):
+                depends_on = [f"{earlier.index}:{earlier.name}" for earlier in runnable[:position] if call.conflicts_with(earlier)]
+                # Stages run in copies of the context, so every call sees its own index
+                pipeline.stage(f"{call.index}:{call.name}", lambda call=call, **_: self._run_call(call), depends_on=depends_on)
+            pipeline.run()
+        finally:
+            self.env.add_reply = self._add_reply
+
+    def _add_result(self, call: ToolCall, tool_role_name: str):
+        if call.error is not None:
+            self.env.add_message(tool_role_name, call.error, tool_call_id=call.id, name=call.name)
+        elif call.result:
+            try:
+                self.env.add_message(tool_role_name, json.dumps(call.result), tool_call_id=call.id, name=call.name)
+            except Exception as e:
+                self.env.add_system_log(f"Unable to add tool output as a message {call.name}: {e}", logging.INFO)
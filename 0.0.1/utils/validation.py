@@ -0,0 +1,67 @@
+from traceback import format_exc
+from typing import List
+from prompts import regenerate_code_prompt, edit_code_prompt, code_problems_prompt
+from utils import Context
+from utils.code_analysis import find_code_problems
+from utils.patch import parse_edit_blocks, apply_edit_blocks
+
+
+# How many times the model is asked to fix the problems found in agent.py before it is uploaded anyway
+VALIDATION_MAX_REPAIRS = 2
+
+
+def edit_agent_code(agent_py: str, update_plan: str):
+    """Asks the model only for the changed lines, returns None if the edits cannot be applied"""
+    env = Context().env
+    try:
+        response = env.completion([{
+            'role': 'system',
+            'content': edit_code_prompt(agent_py, update_plan)
+        }])
+        blocks = parse_edit_blocks(response)
+        agent_py = apply_edit_blocks(agent_py, blocks)
+        env.add_system_log(f"Applied {len(blocks)} edits to agent.py")
+        return agent_py
+    except Exception:
+        env.add_system_log(f"Cannot apply edits, rewriting the whole agent.py. Error:\n{format_exc()}")
+        return None
+
+
+def rewrite_agent_code(agent_py: str, update_plan: str):
+    conversation = []
+    conversation.append({
+        'role': 'system',
+        'content': regenerate_code_prompt(agent_py, update_plan)
+    })
+
+    agent_py = Context().env.completion(conversation)
+    return agent_py.strip("```python").strip("```")
+
+
+def check_agent_code(agent_py: str) -> List[str]:
+    """Static checks only: the generated code is never run on the builder host, it has no isolation from
+    the other conversations and the credentials of the builder"""
+    with Context().metrics.measure("validation", "static"):
+        return find_code_problems(agent_py)
+
+
+def validate_agent_code(agent_py: str) -> str:
+    """Checks the code before it is uploaded and has the model fix the problems, at most VALIDATION_MAX_REPAIRS times.
+    Returns the last version of the code, the problems that are left are reported to the user."""
+    env = Context().env
+    for repair in range(VALIDATION_MAX_REPAIRS + 1):
+        problems = check_agent_code(agent_py)
+        if not problems:
+            env.add_system_log(f"agent.py passed the checks after {repair} repairs")
+            return agent_py
+
+        env.add_system_log(f"agent.py has problems after {repair} repairs: {problems}")
+        if repair == VALIDATION_MAX_REPAIRS:
+            break
+        env.add_reply(f"agent.py didn't pass the checks ({len(problems)} problems), fixing it...")
+        plan = code_problems_prompt(problems)
+        agent_py = edit_agent_code(agent_py, plan) or rewrite_agent_code(agent_py, plan)
+
+    problems_list = "\n".join(f"- {problem}" for problem in problems)
+    env.add_reply(f"I couldn't fix these problems in agent.py, you may need to ask me to update it:\n{problems_list}")
+    return agent_py
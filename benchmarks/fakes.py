@@ -0,0 +1,225 @@
+"""In-process stand-ins for the NEAR AI hub: Environment, Registry and Secrets API with configurable latency."""
+import json
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import nearai
+from nearai.agents.tool_registry import ToolRegistry
+
+
+FAKE_AUTH = {
+    "account_id": "bench.near",
+    "signature": "signature",
+    "public_key": "ed25519:public_key",
+    "callback_url": "http://localhost",
+    "nonce": "1" * 32,
+    "recipient": "ai.near",
+    "message": "Welcome to NEAR AI",
+}
+
+
+class ScriptedCompletions:
+    """Answers a completion with the response of the first rule whose marker is found in the messages"""
+
+    def __init__(self, rules: Sequence[Tuple[str, str]] = (), default: str = "ok", latency: float = 0.0):
+        self.rules = list(rules)
+        self.default = default
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, messages) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        text = json.dumps(messages, default=str)
+        for marker, response in self.rules:
+            if marker in text:
+                return response
+        return self.default
+
+
+class FakeFile:
+    def __init__(self, filename: str, file_id: str, created_at: int):
+        self.id = file_id
+        self.filename = filename
+        self.created_at = created_at
+        self.bytes = 0
+
+
+class FakeEnvironment:
+    """Implements the part of `nearai.agents.environment.Environment` used by the builder"""
+
+    def __init__(self, completions: Optional[ScriptedCompletions] = None, thread_id: str = "thread_bench",
+                 tool_calls: Sequence[Tuple[str, Dict]] = (), storage_latency: float = 0.0):
+        self.scripted = completions or ScriptedCompletions()
+        self.thread_id = thread_id
+        self.tool_calls = list(tool_calls)
+        self.storage_latency = storage_latency
+        self.env_vars: Dict[str, str] = {}
+        self.messages: List[Dict[str, str]] = []
+        self.replies: List[str] = []
+        self.logs: List[str] = []
+        self.files: Dict[str, bytes] = {}
+        self.file_writes = 0
+        self.file_reads = 0
+        self._tool_registry = ToolRegistry()
+
+    def add_user_message(self, content: str):
+        self.messages.append({"role": "user", "content": content})
+
+    def get_last_message(self, role: str = "user"):
+        for message in reversed(self.messages):
+            if message["role"] == role:
+                return message
+        return None
+
+    def list_messages(self):
+        return list(self.messages)
+
+    def add_reply(self, message: str, **kwargs):
+        self.replies.append(message)
+        self.messages.append({"role": "assistant", "content": message})
+
+    def add_message(self, role: str, message: str, **kwargs):
+        if role == "assistant":
+            self.replies.append(message)
+        self.messages.append({"role": role, "content": message, **kwargs})
+
+    def add_system_log(self, log: str, level: int = 0):
+        self.logs.append(str(log))
+
+    def get_thread(self):
+        return SimpleNamespace(id=self.thread_id)
+
+    def read_file(self, filename: str, decode: Optional[str] = "utf-8"):
+        time.sleep(self.storage_latency)
+        self.file_reads += 1
+        content = self.files.get(filename, None)
+        if content is None or not decode:
+            return content
+        return content.decode(decode)
+
+    def write_file(self, filename: str, content, encoding: str = "utf-8", **kwargs):
+        time.sleep(self.storage_latency)
+        self.file_writes += 1
+        self.files[filename] = content if isinstance(content, bytes) else content.encode(encoding)
+
+    def list_files_from_thread(self, order: str = "desc", thread_id: Optional[str] = None):
+        files = [FakeFile(name, f"file_{i}", i) for i, name in enumerate(self.files)]
+        return files if order == "asc" else list(reversed(files))
+
+    def completion(self, messages, model: str = "", **kwargs) -> str:
+        """Goes through `completions` like nearai's `Environment.completion`"""
+        return self.completions(messages, model, **kwargs).choices[0].message.content
+
+    def _run_inference_completions(self, messages, model, stream: bool, **kwargs):
+        """Streams the scripted completion in chunks shaped like the ones of litellm"""
+        content = self.scripted(messages)
+        for start in range(0, len(content), 64):
+            delta = SimpleNamespace(content=content[start:start + 64])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+    def get_tool_registry(self, new: bool = False) -> ToolRegistry:
+        if new:
+            self._tool_registry = ToolRegistry()
+        return self._tool_registry
+
+    def completions(self, messages, model: str = "", stream: bool = False, tools=None, **kwargs):
+        """Returns the scripted tool calls without running them when tools are given, a scripted completion otherwise"""
+        if not self.tool_calls or tools is None:
+            message = SimpleNamespace(role="assistant", content=self.scripted(messages), tool_calls=None)
+        else:
+            tool_calls = [
+                SimpleNamespace(id=f"call_{index}", function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+                for index, (name, arguments) in enumerate(self.tool_calls)
+            ]
+            message = SimpleNamespace(role="assistant", content=None, tool_calls=tool_calls)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    def completions_and_run_tools(self, messages, model: str = "", tools=None, **kwargs):
+        """Runs the scripted tool calls, or answers with a scripted completion when there are none"""
+        response = self.completions(messages, model, tools=tools)
+        message = response.choices[0].message
+        if message.tool_calls is None:
+            self.add_reply(message.content)
+        for tool_call in message.tool_calls or []:
+            self._tool_registry.call_tool(tool_call.function.name, **json.loads(tool_call.function.arguments))
+        return response
+
+    def request_user_input(self):
+        pass
+
+    def mark_done(self):
+        pass
+
+
+class FakeRegistryApi:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.files: Dict[Tuple[str, str, str, str], bytes] = {}
+        self.calls = 0
+
+    def upload_file_v1_registry_upload_file_post(self, path: str, file: bytes, namespace: str, name: str, version: str):
+        self.calls += 1
+        time.sleep(self.latency)
+        key = (namespace, name, version, path)
+        if key in self.files:
+            raise nearai.openapi_client.exceptions.BadRequestException(status=400, reason="Bad Request",
+                                                                       body=f"File {path} already exists")
+        self.files[key] = file
+
+
+class FakeRegistry:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.api = FakeRegistryApi(latency)
+        self.entries: Dict[Tuple[str, str, str], object] = {}
+
+    def update(self, entry_location, metadata):
+        time.sleep(self.latency)
+        self.entries[(entry_location.namespace, entry_location.name, entry_location.version)] = metadata
+        return {}
+
+    def list_files(self, entry_location) -> List[str]:
+        time.sleep(self.latency)
+        return [path for (namespace, name, version, path) in self.api.files
+                if (namespace, name, version) == (entry_location.namespace, entry_location.name, entry_location.version)]
+
+
+class FakeHubSecretsApi:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.secrets: Dict[Tuple[str, str, str, str, str], str] = {}
+        self.calls = 0
+
+    def get_user_secrets_v1_get_user_secrets_get(self, limit: Optional[int] = None, offset: Optional[int] = None):
+        self.calls += 1
+        time.sleep(self.latency)
+        secrets = [
+            dict(namespace=namespace, name=name, version=version, key=key, category=category, value=value)
+            for (namespace, name, version, key, category), value in self.secrets.items()
+        ]
+        offset = offset or 0
+        return secrets[offset:] if limit is None else secrets[offset:offset + limit]
+
+    def create_hub_secret_v1_create_hub_secret_post(self, request):
+        self.calls += 1
+        time.sleep(self.latency)
+        self.secrets[(request.namespace, request.name, request.version or "", request.key, request.category)] = request.value
+        return True
+
+    def remove_hub_secret_v1_remove_hub_secret_post(self, request):
+        self.calls += 1
+        time.sleep(self.latency)
+        self.secrets.pop((request.namespace, request.name, request.version or "", request.key, request.category), None)
+        return True
+
+
+def install_fake_backends(registry: FakeRegistry, hub_secrets: FakeHubSecretsApi, modules: Dict[str, object]):
+    """Points the builder's clients at the fake backends and logs in with a fake account.
+    Tool modules that are already imported have their own references to the clients and are patched as well."""
+    nearai.CONFIG = nearai.CONFIG.update_with({"auth": FAKE_AUTH})
+    for module in ("utils.clients", "tools.upload", "tools.secrets"):
+        if module in modules:
+            modules[module].get_registry = lambda: registry
+            modules[module].get_hub_secrets = lambda: hub_secrets
@@ -0,0 +1,373 @@
+"""Offline benchmarks of the builder agent: runs `agent.py` and the tools against the fakes from `fakes.py`
+and prints the results as JSON with sorted keys, so two runs can be compared with a plain diff.
+
+    python benchmarks/run.py [--quick] [--repeat 5] [--output results.json]
+"""
+import argparse
+import importlib
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Sequence, Tuple
+
+AGENT_DIR = Path(__file__).resolve().parents[1] / "0.0.1"
+sys.path.insert(0, str(AGENT_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fakes import FakeEnvironment, FakeHubSecretsApi, FakeRegistry, ScriptedCompletions, install_fake_backends
+
+import utils
+import utils.clients
+from utils import Context
+
+
+# Version of the report format, bump it when keys are renamed or their meaning changes
+REPORT_SCHEMA = 1
+# Modules timed by the import benchmark, each in a fresh interpreter that has already imported the environment
+# like the hub runner has
+IMPORTED_MODULES = ("prompts", "utils", "tools")
+
+SAMPLE_AGENT = '''from nearai.agents.environment import Environment
+import requests
+
+
+def get_weather(city: str):
+    """Returns the current weather in the city
+
+    city (str): name of the city
+    """
+    api_key = env.env_vars.get("WEATHER_API_KEY")
+    response = requests.get("https://api.weather.example/current", params={"q": city, "key": api_key})
+    return response.json()
+
+
+def run(env: Environment):
+    tool_registry = env.get_tool_registry()
+    tool_registry.register_tool(get_weather)
+    env.completions_and_run_tools([{"role": "system", "content": "You tell the weather"}] + env.list_messages(),
+                                  tools=tool_registry.get_all_tool_definitions())
+    env.request_user_input()
+
+
+run(env)
+'''
+
+SAMPLE_METADATA = json.dumps({
+    "name": "weather-agent",
+    "version": "0.0.1",
+    "description": "Tells the weather",
+    "category": "agent",
+    "tags": ["generated"],
+    "details": {"agent": {"defaults": {"model": "deepseek-3", "inference_framework": "nearai"}}},
+    "show_entry": True
+}, indent=2)
+
+# The first rule found in the messages answers the completion, markers are taken from prompts.py and tools/
+COMPLETION_RULES = (
+    ("Make sure the code follows", SAMPLE_AGENT),
+    ("You need to write `agent.py`", SAMPLE_AGENT),
+    ("software architect", "- Fetch the current weather for the city from the weather API\n- Reply with a summary"),
+    ("needs the following API keys", json.dumps({"WEATHER_API_KEY": "Key of the weather API"})),
+    ("Write message to the user", "Please send me your WEATHER_API_KEY, you can get it on the weather API website."),
+    ("You maintain a short summary", "The user builds a weather agent."),
+)
+
+with open(AGENT_DIR / "agent.py", "r") as f:
+    AGENT_CODE = compile(f.read(), str(AGENT_DIR / "agent.py"), "exec")
+
+
+def _stats(samples: Sequence[float]) -> Dict[str, float]:
+    return {
+        "median": round(statistics.median(samples), 6),
+        "min": round(min(samples), 6),
+        "max": round(max(samples), 6),
+    }
+
+
+def _reset_context():
+    """Forgets the contexts of the previous runs, as if the agent was started in a new process"""
+    Context.registry.clear()
+
+
+def _new_env(config, **kwargs) -> FakeEnvironment:
+    completions = ScriptedCompletions(COMPLETION_RULES, default="Sure, what agent would you like to build?",
+                                      latency=config.completion_latency)
+    return FakeEnvironment(completions, storage_latency=config.storage_latency, **kwargs)
+
+
+def _seed_files(config, scratchpad: str = "", agent_py: str = "", metadata: str = "") -> Dict[str, bytes]:
+    """Thread files with a saved state, prepared in a separate environment so the measured one is not touched"""
+    env = _new_env(config)
+    _reset_context()
+    context = Context(env)
+    context.load_state()
+    context.state.scratchpad = scratchpad
+    context.state.agent_py = agent_py
+    context.state.metadata = metadata
+    context.dump_state()
+    if metadata:
+        env.files["metadata.json"] = metadata.encode("utf-8")
+    if agent_py:
+        env.files["agent.py"] = agent_py.encode("utf-8")
+    _reset_context()
+    return dict(env.files)
+
+
+def _scratchpad(size: int) -> str:
+    entries = []
+    while sum(len(entry) + 1 for entry in entries) < size:
+        entries.append(f"User: message {len(entries)} about the agent")
+        entries.append(f"Assistant: answer {len(entries)} with the details of the plan")
+    return "\n".join(entries)[:size]
+
+
+def bench_import_time(config) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for module in IMPORTED_MODULES:
+        script = f"import time, nearai.agents.environment; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+        samples = []
+        for _ in range(config.repeat):
+            output = subprocess.run([sys.executable, "-c", script], cwd=AGENT_DIR, capture_output=True, text=True,
+                                    check=True).stdout
+            samples.append(float(output.strip().splitlines()[-1]))
+        results[module] = _stats(samples)
+    return results
+
+
+def _turn_scenarios() -> Dict[str, Tuple[str, List[Tuple[str, Dict]], Callable[[object], Dict[str, bytes]]]]:
+    """Name -> (user message, scripted tool calls, files of the thread before the turn).
+    Commands like `login` are routed without the model, so their scripted tool calls are never used."""
+    return {
+        "chat_new_thread": ("Hi, I want to build an agent", [], lambda config: {}),
+        "login": ("login", [("start_login_flow", {})], lambda config: {}),
+        "chat_built_agent": (
+            "What does my agent do?", [],
+            lambda config: _seed_files(config, _scratchpad(8 * 1024), SAMPLE_AGENT, SAMPLE_METADATA)
+        ),
+        "create_secrets": (
+            'Save WEATHER_API_KEY "abc"', [("create_secrets", {"secrets": json.dumps({"WEATHER_API_KEY": "abc"})})],
+            lambda config: _seed_files(config, _scratchpad(1024), SAMPLE_AGENT, SAMPLE_METADATA)
+        ),
+        "upload": (
+            "Release version 1.0.0", [("upload", {"version": "1.0.0"})],
+            lambda config: _seed_files(config, _scratchpad(1024), SAMPLE_AGENT, SAMPLE_METADATA)
+        ),
+        "parallel_tools": (
+            "Save the keys and release version 1.0.0", [
+                ("create_secret", {"key": "WEATHER_API_KEY", "value": "abc"}),
+                ("create_secret", {"key": "GEOCODING_API_KEY", "value": "def"}),
+                ("upload", {"version": "1.0.0"}),
+            ],
+            lambda config: _seed_files(config, _scratchpad(1024), SAMPLE_AGENT, SAMPLE_METADATA)
+        ),
+        "generate": (
+            "Yes, build it", [("generate", {
+                "agent_name": "weather-agent",
+                "agent_description": "Tells the weather",
+                "agent_technical_plan": "- Fetch the current weather for the city"
+            })],
+            lambda config: {}
+        ),
+    }
+
+
+def run_turn(env: FakeEnvironment, registry: FakeRegistry, hub_secrets: FakeHubSecretsApi):
+    """Runs `agent.py` for one turn the way the hub does, with `env` in its globals"""
+    _reset_context()
+    install_fake_backends(registry, hub_secrets, sys.modules)
+    exec(AGENT_CODE, {"__name__": "agent", "env": env})
+
+
+def bench_turn_latency(config) -> Dict[str, Dict]:
+    results = {}
+    for name, (message, tool_calls, files) in _turn_scenarios().items():
+        samples = []
+        counters = {}
+        for _ in range(config.repeat):
+            env = _new_env(config, tool_calls=tool_calls)
+            env.files.update(files(config))
+            env.add_user_message(message)
+            registry = FakeRegistry(config.registry_latency)
+            hub_secrets = FakeHubSecretsApi(config.registry_latency)
+
+            started = time.perf_counter()
+            run_turn(env, registry, hub_secrets)
+            samples.append(time.perf_counter() - started)
+
+            counters = {
+                "completions": env.scripted.calls,
+                "file_reads": env.file_reads,
+                "file_writes": env.file_writes,
+                "registry_calls": registry.api.calls,
+                "secrets_calls": hub_secrets.calls,
+                "replies": len(env.replies),
+            }
+        results[name] = {"seconds": _stats(samples), **counters}
+    return results
+
+
+def bench_warm_turns(config) -> Dict[str, Dict]:
+    """The same conversation of several messages, every turn in a new process (cold) or all in one worker that
+    keeps the context of the conversation between turns (warm)"""
+    messages = ["What does my agent do?", "Which secrets does it need?", "How do I call it?", "Thanks!"]
+    results = {}
+    for mode in ("cold", "warm"):
+        samples = []
+        file_reads = 0
+        for _ in range(config.repeat):
+            files = _seed_files(config, _scratchpad(8 * 1024), SAMPLE_AGENT, SAMPLE_METADATA)
+            _reset_context()
+            for message in messages:
+                env = _new_env(config)
+                env.files.update(files)
+                env.add_user_message(message)
+                if mode == "cold":
+                    _reset_context()
+
+                started = time.perf_counter()
+                install_fake_backends(FakeRegistry(config.registry_latency), FakeHubSecretsApi(config.registry_latency), sys.modules)
+                exec(AGENT_CODE, {"__name__": "agent", "env": env})
+                samples.append(time.perf_counter() - started)
+                file_reads += env.file_reads
+                files = env.files
+        results[mode] = {"seconds": _stats(samples), "file_reads_per_turn": round(file_reads / len(samples), 2)}
+    return results
+
+
+def bench_upload_throughput(config) -> List[Dict]:
+    results = []
+    for files in config.upload_files:
+        for size in config.upload_sizes:
+            samples = []
+            for _ in range(config.repeat):
+                env = _new_env(config)
+                env.files.update(_seed_files(config, "", SAMPLE_AGENT, SAMPLE_METADATA))
+                for i in range(files):
+                    env.files[f"module_{i}.py"] = (f"# module {i}\n" + "x = 1\n" * (size // 6))[:size].encode("utf-8")
+                registry = FakeRegistry(config.registry_latency)
+
+                _reset_context()
+                Context(env).load_state()
+                install_fake_backends(registry, FakeHubSecretsApi(), sys.modules)
+
+                started = time.perf_counter()
+                error = importlib.import_module("tools.upload").upload("1.0.0")
+                samples.append(time.perf_counter() - started)
+                if error is not None:
+                    raise Exception(f"Upload failed: {error}")
+
+            total_bytes = sum(len(content) for filename, content in env.files.items()
+                              if not utils.is_internal_file(filename) and filename != "metadata.json")
+            median = statistics.median(samples)
+            results.append({
+                "modules": files,
+                "module_bytes": size,
+                "uploaded_files": registry.api.calls,
+                "uploaded_bytes": total_bytes,
+                "seconds": _stats(samples),
+                "files_per_second": round(registry.api.calls / median, 2),
+                "bytes_per_second": round(total_bytes / median, 2),
+            })
+    return results
+
+
+def bench_state(config) -> List[Dict]:
+    results = []
+    for backend in ("thread_file", "sqlite"):
+        for size in config.scratchpad_sizes:
+            files = _seed_files(config, _scratchpad(size), SAMPLE_AGENT, SAMPLE_METADATA)
+            load_samples = []
+            dump_samples = []
+            with tempfile.TemporaryDirectory() as directory:
+                env_vars = {"STATE_BACKEND": backend, "STATE_DB_PATH": str(Path(directory) / "state.sqlite3")}
+                # The first turn of the sqlite backend moves the state from the thread files into the database
+                for turn in range(config.repeat + 1):
+                    env = _new_env(config)
+                    env.env_vars.update(env_vars)
+                    env.files.update(files)
+                    _reset_context()
+                    context = Context(env)
+
+                    started = time.perf_counter()
+                    context.load_state()
+                    load_duration = time.perf_counter() - started
+
+                    context.state.scratchpad += "\nUser: one more message"
+                    started = time.perf_counter()
+                    context.dump_state()
+                    if turn > 0:
+                        load_samples.append(load_duration)
+                        dump_samples.append(time.perf_counter() - started)
+
+            results.append({
+                "backend": backend,
+                "scratchpad_bytes": size,
+                "state_bytes": context.metrics.summary()["state"]["bytes"],
+                "load_seconds": _stats(load_samples),
+                "dump_seconds": _stats(dump_samples),
+            })
+    return results
+
+
+BENCHMARKS = {
+    "import_time": bench_import_time,
+    "turn_latency": bench_turn_latency,
+    "warm_turns": bench_warm_turns,
+    "upload_throughput": bench_upload_throughput,
+    "state": bench_state,
+}
+
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller curves and one repetition, for a smoke check")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions of every measurement")
+    parser.add_argument("--completion-latency", type=float, default=0.05, help="seconds per completion")
+    parser.add_argument("--registry-latency", type=float, default=0.02, help="seconds per registry or secrets call")
+    parser.add_argument("--storage-latency", type=float, default=0.0, help="seconds per thread file read or write")
+    parser.add_argument("--only", choices=sorted(BENCHMARKS), action="append", help="run only these benchmarks")
+    parser.add_argument("--output", help="also write the report to this file")
+    config = parser.parse_args(argv)
+
+    if config.quick:
+        config.repeat = 1
+        config.upload_files = (1, 8)
+        config.upload_sizes = (1024, 64 * 1024)
+        config.scratchpad_sizes = (1024, 64 * 1024)
+    else:
+        config.upload_files = (1, 4, 16, 64)
+        config.upload_sizes = (1024, 32 * 1024, 256 * 1024)
+        config.scratchpad_sizes = (1024, 16 * 1024, 128 * 1024, 1024 * 1024)
+    return config
+
+
+def main(argv=None):
+    config = _parse_args(argv)
+    report = {
+        "schema": REPORT_SCHEMA,
+        "python": platform.python_version(),
+        "config": {
+            "repeat": config.repeat,
+            "completion_latency": config.completion_latency,
+            "registry_latency": config.registry_latency,
+            "storage_latency": config.storage_latency,
+        },
+        "results": {
+            name: benchmark(config) for name, benchmark in BENCHMARKS.items() if not config.only or name in config.only
+        },
+    }
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if config.output:
+        with open(config.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+"""Unit tests of the builder agent, run from the root of the repository:
+
+    python -m unittest discover -s tests -t .
+"""
+import sys
+from pathlib import Path
+
+AGENT_DIR = Path(__file__).resolve().parents[1] / "0.0.1"
+BENCHMARKS_DIR = Path(__file__).resolve().parents[1] / "benchmarks"
+
+# The agent imports its modules as top-level packages, the way the hub runs it; the fakes of the hub are
+# shared with the benchmarks
+for path in (AGENT_DIR, BENCHMARKS_DIR):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
@@ -0,0 +1,60 @@
+import unittest
+from unittest import mock
+
+from nearai.shared.auth_data import AuthData
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FAKE_AUTH, FakeEnvironment
+from utils import Context
+from utils import clients
+
+
+def auth(account_id: str) -> AuthData:
+    return AuthData(**{**FAKE_AUTH, "account_id": account_id})
+
+
+class ClientsCacheTest(unittest.TestCase):
+    def setUp(self):
+        Context.registry.clear()
+        clients.invalidate_clients()
+        self.context = Context(FakeEnvironment(thread_id="thread_clients"))
+
+    def tearDown(self):
+        clients.invalidate_clients()
+        Context.registry.clear()
+
+    def clients_of(self, account_id: str):
+        self.context.auth = auth(account_id)
+        return clients._get_clients()
+
+    def test_clients_are_reused_for_the_same_auth(self):
+        first = self.clients_of("alice.near")
+        self.assertIs(clients._get_clients(), first)
+        # An equal auth of another turn
+        self.assertIs(self.clients_of("alice.near"), first)
+        self.assertIsNot(self.clients_of("bob.near"), first)
+
+    def test_least_recently_used_clients_are_closed(self):
+        with mock.patch.object(clients, "CLIENTS_CACHE_SIZE", 2):
+            alice = self.clients_of("alice.near")
+            bob = self.clients_of("bob.near")
+            self.clients_of("alice.near")
+            with mock.patch.object(type(bob), "close") as close:
+                self.clients_of("carol.near")
+            close.assert_called_once_with()
+            self.assertEqual(len(clients._clients), 2)
+            self.assertIs(self.clients_of("alice.near"), alice)
+            self.assertIsNot(self.clients_of("bob.near"), bob)
+
+    def test_invalidated_clients_are_created_again(self):
+        alice = self.clients_of("alice.near")
+        bob = self.clients_of("bob.near")
+        clients.invalidate_clients(auth("alice.near"))
+        self.assertIs(self.clients_of("bob.near"), bob)
+        self.assertIsNot(self.clients_of("alice.near"), alice)
+        clients.invalidate_clients()
+        self.assertEqual(len(clients._clients), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
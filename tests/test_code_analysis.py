@@ -0,0 +1,97 @@
+import unittest
+
+import tests  # noqa: F401, puts the agent on sys.path
+from utils.code_analysis import allowed_imports, find_code_problems, find_secret_keys, framework_libraries
+
+
+# Every library advertised in `framework_prompt` -> the module its documentation imports
+DOCUMENTED_IMPORTS = {
+    "base58": "base58",
+    "pynacl": "nacl",
+    "pytz": "pytz",
+    "python_dateutil": "dateutil",
+    "setuptools": "setuptools",
+    "urllib3": "urllib3",
+    "pydantic": "pydantic",
+    "typing-extensions": "typing_extensions",
+    "psutil": "psutil",
+    "boto3": "boto3",
+    "litellm": "litellm",
+    "openai": "openai",
+    "chardet": "chardet",
+    "bs4": "bs4",
+    "googlesearch-python": "googlesearch",
+    "PyPDF2": "PyPDF2",
+    "youtube_transcript_api": "youtube_transcript_api",
+    "py-near": "py_near",
+    "loguru": "loguru",
+    "ed25519": "ed25519",
+    "py-multibase": "multibase",
+    "py-multicodec": "multicodec",
+    "aiohttp": "aiohttp",
+    "borsh-construct": "borsh_construct",
+    "tweepy": "tweepy",
+    "tenacity": "tenacity",
+}
+
+
+class AllowedImportsTest(unittest.TestCase):
+    def test_every_advertised_library_is_known(self):
+        self.assertEqual(set(framework_libraries()), set(DOCUMENTED_IMPORTS))
+
+    def test_every_advertised_library_can_be_imported(self):
+        if not allowed_imports():
+            self.skipTest("The standard library isn't known to this Python")
+        for package, module in DOCUMENTED_IMPORTS.items():
+            with self.subTest(package=package):
+                self.assertEqual(find_code_problems(f"import {module}\n"), [])
+
+    def test_googlesearch(self):
+        if not allowed_imports():
+            self.skipTest("The standard library isn't known to this Python")
+        self.assertEqual(find_code_problems("from googlesearch import search\n"), [])
+
+    def test_unknown_and_banned_imports(self):
+        if not allowed_imports():
+            self.skipTest("The standard library isn't known to this Python")
+        problems = find_code_problems("import os\nimport numpy\n")
+        self.assertEqual(len(problems), 2)
+        self.assertIn("`os` can't be used directly", problems[0])
+        self.assertIn("`numpy` is not one of the available libraries", problems[1])
+
+
+AGENT_WITH_SECRETS = '''
+import requests
+from nearai.agents.environment import Environment
+
+DEBUG = env.env_vars.get("DEBUG", False)
+MODEL = env.env_vars["MODEL"]
+WEATHER_API_KEY = env.env_vars.get("WEATHER_API_KEY")
+HEADERS = {"Authorization": "Bearer YOUR_GITHUB_TOKEN"}
+
+
+def summarize(text):
+    return env.completion([{"role": "user", "content": text}], max_tokens="...", author="<your name>")
+
+
+def fetch(city):
+    return requests.get("https://api.example.com", params={"q": city, "api_key": "<OPENWEATHER_API_KEY>"}, headers=HEADERS)
+'''
+
+
+class SecretKeysTest(unittest.TestCase):
+    def test_credentials_are_found(self):
+        self.assertEqual(find_secret_keys(AGENT_WITH_SECRETS), ["WEATHER_API_KEY", "GITHUB_TOKEN", "OPENWEATHER_API_KEY"])
+
+    def test_settings_are_not_secrets(self):
+        keys = find_secret_keys(AGENT_WITH_SECRETS)
+        for name in ("DEBUG", "MODEL", "MAX_TOKENS", "max_tokens", "AUTHOR", "author"):
+            self.assertNotIn(name, keys)
+
+    def test_code_that_does_not_compile(self):
+        code = 'DEBUG = env.env_vars.get("DEBUG")\nKEY = env.env_vars["SERP_API_KEY"]\ndef broken(:\n'
+        self.assertEqual(find_secret_keys(code), ["SERP_API_KEY"])
+
+
+if __name__ == "__main__":
+    unittest.main()
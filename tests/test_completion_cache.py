@@ -0,0 +1,77 @@
+import json
+import unittest
+from unittest import mock
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment
+from utils.completion_cache import CompletionCache
+from utils.files import TurnFileCache
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+FILENAME = "thread_completion_cache.json"
+
+
+class CompletionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.env = FakeEnvironment()
+        self.cache = CompletionCache(self.env, FILENAME)
+        self.generated = 0
+
+    def generate(self) -> str:
+        self.generated += 1
+        return f"response {self.generated}"
+
+    def complete(self, cache: CompletionCache = None, messages=MESSAGES, **kwargs) -> str:
+        kwargs.setdefault("temperature", 0)
+        return (cache or self.cache).completion(messages, self.generate, model="model", **kwargs)
+
+    def test_only_deterministic_completions_are_cached(self):
+        self.assertEqual(self.complete(), "response 1")
+        self.assertEqual(self.complete(), "response 1")
+        self.assertEqual(self.complete(temperature=0.7), "response 2")
+        self.assertEqual(self.complete(temperature=0.7), "response 3")
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_expired_entries_are_generated_again(self):
+        with mock.patch("utils.completion_cache.time.time", return_value=1000.0):
+            self.complete()
+        with mock.patch("utils.completion_cache.time.time", return_value=1000.0 + 10), \
+                mock.patch("utils.completion_cache.COMPLETION_CACHE_TTL", 60):
+            self.assertEqual(self.complete(), "response 1")
+        with mock.patch("utils.completion_cache.time.time", return_value=1000.0 + 60), \
+                mock.patch("utils.completion_cache.COMPLETION_CACHE_TTL", 60):
+            self.assertEqual(self.complete(), "response 2")
+
+    def test_least_recently_used_entries_are_evicted(self):
+        with mock.patch("utils.completion_cache.COMPLETION_CACHE_MAX_ENTRIES", 2):
+            first, second, third = ([{"role": "user", "content": text}] for text in ("one", "two", "three"))
+            self.complete(messages=first)
+            self.complete(messages=second)
+            self.complete(messages=first)
+            self.complete(messages=third)
+            self.assertEqual(self.complete(messages=first), "response 1")
+            self.assertEqual(self.complete(messages=second), "response 4")
+
+    def test_entries_are_saved_with_the_files_of_the_turn(self):
+        self.complete()
+        files = TurnFileCache(self.env)
+        self.cache.flush(files)
+        self.assertNotIn(FILENAME, self.env.files)
+        files.flush()
+        self.assertEqual(len(json.loads(self.env.files[FILENAME])), 1)
+
+        # The next turn of another process loads them
+        cache = CompletionCache(self.env, FILENAME)
+        self.assertEqual(self.complete(cache), "response 1")
+        self.assertEqual(cache.hits, 1)
+
+    def test_unchanged_cache_is_not_written(self):
+        files = TurnFileCache(self.env)
+        self.cache.flush(files)
+        files.flush()
+        self.assertEqual(self.env.file_writes, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import threading
+import unittest
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment
+from utils import Context
+from utils.files import TurnFileCache
+
+
+class TurnFileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.env = FakeEnvironment()
+        self.env.files["agent.py"] = b"print('weather')\n"
+        self.files = TurnFileCache(self.env)
+
+    def test_files_are_read_once(self):
+        self.assertEqual(self.files.read_file("agent.py"), "print('weather')\n")
+        self.assertEqual(self.files.read_bytes("agent.py"), b"print('weather')\n")
+        self.assertIsNone(self.files.read_file("missing.py"))
+        self.assertIsNone(self.files.read_file("missing.py"))
+        self.assertEqual(self.env.file_reads, 2)
+
+    def test_last_content_is_written_at_the_flush(self):
+        self.files.write_file("agent.py", "print('forecast')\n")
+        self.files.write_file("agent.py", "print('climate')\n")
+        self.assertEqual(self.files.read_file("agent.py"), "print('climate')\n")
+        self.assertEqual((self.env.file_writes, self.env.file_reads), (0, 0))
+
+        self.files.flush()
+        self.assertEqual(self.env.files["agent.py"], b"print('climate')\n")
+        self.assertEqual(self.env.file_writes, 1)
+        self.files.flush()
+        self.assertEqual(self.env.file_writes, 1)
+
+    def test_listing_includes_the_files_written_during_the_turn(self):
+        self.assertEqual([file.filename for file in self.files.list_files_from_thread()], ["agent.py"])
+        self.files.write_file("metadata.json", "{}")
+        listed = [file.filename for file in self.files.list_files_from_thread()]
+        self.assertEqual(sorted(listed), ["agent.py", "metadata.json"])
+        self.assertEqual(self.env.file_writes, 1)
+
+    def test_failed_write_is_kept_for_the_next_flush(self):
+        def failed_write(*args, **kwargs):
+            raise IOError("storage is down")
+
+        write_file, self.env.write_file = self.env.write_file, failed_write
+        self.files.write_file("agent.py", "print('forecast')\n")
+        with self.assertRaises(IOError):
+            self.files.flush()
+        self.env.write_file = write_file
+        self.files.flush()
+        self.assertEqual(self.env.files["agent.py"], b"print('forecast')\n")
+
+
+class ContextFilesTest(unittest.TestCase):
+    def setUp(self):
+        Context.registry.clear()
+        self.env = FakeEnvironment(thread_id="thread_files")
+        self.context = Context(self.env)
+
+    def tearDown(self):
+        Context.registry.clear()
+
+    def test_files_are_written_by_flush_files(self):
+        self.context.files.write_file("agent.py", "print('weather')\n")
+        self.assertNotIn("agent.py", self.env.files)
+        self.context.flush_files()
+        self.assertEqual(self.env.files["agent.py"], b"print('weather')\n")
+
+    def test_caches_are_created_once_by_concurrent_workers(self):
+        workers = 8
+        barrier = threading.Barrier(workers, timeout=5)
+        created = []
+
+        def first_access():
+            barrier.wait()
+            created.append((self.context.files, self.context.completion_cache, self.context.metrics))
+
+        threads = [threading.Thread(target=first_access) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(created), workers)
+        for caches in created:
+            for cache, first in zip(caches, created[0]):
+                self.assertIs(cache, first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment
+from utils.files import TurnFileCache
+from utils.metrics import TurnMetrics
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+class InstrumentEnvTest(unittest.TestCase):
+    def setUp(self):
+        self.env = FakeEnvironment()
+        self.metrics = TurnMetrics(self.env, "thread_metrics.json")
+
+    def recorded(self):
+        return [record["name"] for record in self.metrics._records if record["kind"] == "completion"]
+
+    def test_completion_is_recorded_once(self):
+        self.metrics.instrument_env()
+        # `completion` goes through `completions`, as in nearai
+        self.assertEqual(self.env.completion(MESSAGES), "ok")
+        self.assertEqual(self.recorded(), ["completion"])
+        self.assertEqual(self.env.scripted.calls, 1)
+
+    def test_completions_are_recorded(self):
+        self.metrics.instrument_env()
+        self.env.completions(MESSAGES)
+        self.env.completion(MESSAGES)
+        self.assertEqual(self.recorded(), ["completions", "completion"])
+
+    def test_completions_of_tools_are_recorded(self):
+        # A tool run by `completions_and_run_tools` makes completions of its own
+        self.env.completions_and_run_tools = lambda messages, **kwargs: self.env.completion(messages)
+        self.metrics.instrument_env()
+        self.env.completions_and_run_tools(MESSAGES)
+        self.assertEqual(self.recorded(), ["completion", "completions_and_run_tools"])
+
+
+class FlushTest(unittest.TestCase):
+    def turn(self, env: FakeEnvironment):
+        files = TurnFileCache(env)
+        metrics = TurnMetrics(env, "thread_metrics.json")
+        metrics.record("completion", "completion", time.perf_counter(), 0.5, prompt_tokens=10)
+        writes = env.file_writes
+        metrics.flush(files)
+        # Nothing is written before the files of the turn are
+        self.assertEqual(env.file_writes, writes)
+        files.flush()
+
+    def test_turns_are_added_to_the_totals(self):
+        env = FakeEnvironment()
+        self.turn(env)
+        self.turn(env)
+        metrics = json.loads(env.files["thread_metrics.json"])
+        self.assertEqual(metrics["turns"], 2)
+        self.assertEqual(metrics["totals"]["completion"], {"count": 2, "duration": 1.0, "errors": 0, "prompt_tokens": 20})
+
+    def test_only_the_latest_turns_are_kept(self):
+        env = FakeEnvironment()
+        with mock.patch("utils.metrics.METRICS_RECENT_TURNS", 2):
+            for _ in range(3):
+                self.turn(env)
+        metrics = json.loads(env.files["thread_metrics.json"])
+        self.assertEqual(metrics["turns"], 3)
+        self.assertEqual(len(metrics["recent"]), 2)
+        self.assertEqual(metrics["totals"]["completion"]["count"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+import tests  # noqa: F401, puts the agent on sys.path
+from utils.patch import PatchError, apply_edit_blocks, parse_edit_blocks
+
+
+CODE = """def greet(name):
+    return f"Hello, {name}"
+
+
+def run(env):
+    env.add_reply(greet("world"))
+    env.request_user_input()
+"""
+
+
+def block(search: str, replace: str) -> str:
+    return f"<<<<<<< SEARCH\n{search}\n=======\n{replace}\n>>>>>>> REPLACE"
+
+
+class ParseEditBlocksTest(unittest.TestCase):
+    def test_blocks_are_parsed_in_order(self):
+        text = "Changing the greeting:\n" + block("a = 1", "a = 2") + "\nand the name:\n" + block("b = 1", "")
+        self.assertEqual(parse_edit_blocks(text), [("a = 1", "a = 2"), ("b = 1", "")])
+
+    def test_windows_line_ends(self):
+        self.assertEqual(parse_edit_blocks(block("a = 1", "a = 2").replace("\n", "\r\n")), [("a = 1", "a = 2")])
+
+    def test_malformed_markers(self):
+        for text in ("<<<<<<< SEARCH\na = 1\n=======\na = 2\n",
+                     "<<<<<< SEARCH\na = 1\n=======\na = 2\n>>>>>>> REPLACE",
+                     "a = 1\n=======\na = 2\n>>>>>>> REPLACE",
+                     "No changes needed"):
+            with self.assertRaises(PatchError, msg=text):
+                parse_edit_blocks(text)
+
+
+class ApplyEditBlocksTest(unittest.TestCase):
+    def test_unique_match_is_replaced(self):
+        code = apply_edit_blocks(CODE, [('    return f"Hello, {name}"', '    return f"Hi, {name}!"')])
+        self.assertIn('return f"Hi, {name}!"', code)
+        self.assertNotIn("Hello", code)
+
+    def test_no_match(self):
+        with self.assertRaisesRegex(PatchError, "matches 0 places"):
+            apply_edit_blocks(CODE, [("    return 'Hello'", "    return 'Hi'")])
+
+    def test_ambiguous_match(self):
+        with self.assertRaisesRegex(PatchError, "matches 2 places"):
+            apply_edit_blocks(CODE, [("env.", "environment.")])
+
+    def test_blocks_are_applied_in_order(self):
+        # The second block matches only after the first one is applied
+        code = apply_edit_blocks(CODE, [
+            ('greet("world")', 'greet("NEAR")'),
+            ('    env.add_reply(greet("NEAR"))', '    env.add_reply(greet("NEAR"))\n    env.add_reply("Bye")'),
+        ])
+        self.assertIn('    env.add_reply(greet("NEAR"))\n    env.add_reply("Bye")\n', code)
+
+    def test_trailing_whitespace_and_windows_line_ends_are_ignored(self):
+        code = apply_edit_blocks(CODE.replace("\n", "\r\n"), [('def greet(name):  \n    return f"Hello, {name}"', "def greet(name):\n    return name")])
+        self.assertTrue(code.startswith("def greet(name):\n    return name\r\n"))
+
+    def test_different_indentation_does_not_match(self):
+        with self.assertRaisesRegex(PatchError, "matches 0 places"):
+            apply_edit_blocks(CODE, [('return f"Hello, {name}"\nreturn None', "return name")])
+        with self.assertRaisesRegex(PatchError, "matches 0 places"):
+            apply_edit_blocks(CODE, [("  env.request_user_input()\n  pass", "pass")])
+
+    def test_empty_search_block(self):
+        with self.assertRaisesRegex(PatchError, "Empty SEARCH block"):
+            apply_edit_blocks(CODE, [("\n", "import json")])
+
+    def test_result_must_compile(self):
+        with self.assertRaisesRegex(PatchError, "doesn't compile"):
+            apply_edit_blocks(CODE, [("def run(env):", "def run(env)")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import threading
+import time
+import unittest
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment
+from utils.pipeline import Pipeline
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.env = FakeEnvironment()
+        self.pipeline = Pipeline(self.env, "test")
+        self.finished = []
+
+    def step(self, name: str, delay: float = 0.0, result=None):
+        def run(**dependencies):
+            time.sleep(delay)
+            self.finished.append(name)
+            return result if result is not None else dependencies
+        return run
+
+    def test_stages_run_after_their_dependencies(self):
+        self.pipeline.stage("plan", self.step("plan", 0.05, result="plan"))
+        self.pipeline.stage("metadata", self.step("metadata", result="metadata"))
+        self.pipeline.stage("code", self.step("code"), depends_on=["plan", "metadata"])
+        results = self.pipeline.run()
+        self.assertEqual(self.finished[-1], "code")
+        self.assertEqual(results["code"], {"plan": "plan", "metadata": "metadata"})
+        self.assertIn("Pipeline test took", self.env.logs[-1])
+
+    def test_independent_stages_run_concurrently(self):
+        # Each stage waits for the other, run one after the other they would time out
+        barrier = threading.Barrier(2, timeout=5)
+        self.pipeline.stage("first", lambda: barrier.wait())
+        self.pipeline.stage("second", lambda: barrier.wait())
+        self.assertEqual(sorted(self.pipeline.run().values()), [0, 1])
+
+    def test_failure_skips_the_dependent_stages(self):
+        def fail():
+            raise ValueError("no plan")
+
+        self.pipeline.stage("plan", fail)
+        self.pipeline.stage("metadata", self.step("metadata", 0.05))
+        self.pipeline.stage("code", self.step("code"), depends_on=["plan"])
+        with self.assertRaisesRegex(ValueError, "no plan"):
+            self.pipeline.run()
+        # The running stage is finished, the dependent one never starts
+        self.assertEqual(self.finished, ["metadata"])
+        self.assertIn("Skipped after an error: ['code']", self.env.logs[-1])
+
+    def test_unknown_dependency(self):
+        with self.assertRaisesRegex(Exception, "unknown stage plan"):
+            self.pipeline.stage("code", self.step("code"), depends_on=["plan"])
+        # A stage can't depend on itself
+        with self.assertRaisesRegex(Exception, "unknown stage code"):
+            self.pipeline.stage("code", self.step("code"), depends_on=["code"])
+
+    def test_stages_cannot_form_a_cycle(self):
+        self.pipeline.stage("plan", self.step("plan"))
+        self.pipeline.stage("code", self.step("code"), depends_on=["plan"])
+        with self.assertRaisesRegex(Exception, "already added"):
+            self.pipeline.stage("plan", self.step("plan"), depends_on=["code"])
+
+
+if __name__ == "__main__":
+    unittest.main()
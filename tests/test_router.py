@@ -0,0 +1,55 @@
+import json
+import unittest
+
+import tests  # noqa: F401, puts the agent on sys.path
+from utils import AgentState, PendingSecrets
+from utils.router import route
+
+
+class RestoreRouteTest(unittest.TestCase):
+    def parse(self, message: str):
+        found = route(message, AgentState())
+        return None if found is None else (found[0].tool, found[1])
+
+    def test_rollback_commands(self):
+        for message in ("rollback to 1.0.0", "Roll back to version 1.0.0", "revert the agent to v1.0.0",
+                        "please restore version 1.0.0", "go back to 1.0.0"):
+            self.assertEqual(self.parse(message), ("restore_version", {"version": "1.0.0"}), message)
+
+    def test_requests_are_left_to_the_model(self):
+        for message in ("rollback the last change", "restore the weather feature of 1.0.0"):
+            self.assertIsNone(self.parse(message), message)
+
+
+class StateReads(AgentState):
+    """Counts the reads of the fields the secrets route checks"""
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        object.__setattr__(self, "_reads", [])
+
+    def __getattribute__(self, name: str):
+        if name in ("metadata", "pending_secrets"):
+            object.__getattribute__(self, "_reads").append(name)
+        return super().__getattribute__(name)
+
+
+class SecretsRouteTest(unittest.TestCase):
+    def test_messages_are_matched_before_the_state_is_read(self):
+        state = StateReads()
+        self.assertIsNone(route("Make the agent reply in French", state))
+        self.assertEqual(state._reads, [])
+
+    def test_secrets_of_a_built_agent(self):
+        state = AgentState(pending_secrets=PendingSecrets(use_secrets=True, keys={"weather_key": "Key of the weather API"}))
+        state.metadata = '{"name": "weather-agent"}'
+        found = route("WEATHER_KEY=abc\nOPENAI_API_KEY: def", state)
+        self.assertEqual(found[0].tool, "create_secrets")
+        self.assertEqual(json.loads(found[1]["secrets"]), {"weather_key": "abc", "OPENAI_API_KEY": "def"})
+
+    def test_secrets_before_the_agent_is_built(self):
+        self.assertIsNone(route("OPENAI_API_KEY=abc", AgentState()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment, ScriptedCompletions
+from utils import Context
+from utils.scratchpad import compact_scratchpad
+from utils.tokens import estimate_tokens
+
+
+def entries(count: int, size: int = 200) -> str:
+    return "".join(f"\nUser: message {index} " + "x" * size for index in range(count))
+
+
+class CompactScratchpadTest(unittest.TestCase):
+    def test_digest_is_kept_within_its_share(self):
+        # The model doesn't keep to the length it was asked for
+        env = FakeEnvironment(ScriptedCompletions(default="summary line\n" * 400))
+        digest, scratchpad = compact_scratchpad(env, "", entries(20), token_budget=1000)
+        self.assertLessEqual(estimate_tokens(digest), 500)
+        self.assertTrue(digest.startswith("summary line"))
+        self.assertLessEqual(estimate_tokens(digest) + estimate_tokens(scratchpad), 1000)
+
+    def test_digest_over_the_budget_is_shortened(self):
+        env = FakeEnvironment(ScriptedCompletions(default="short summary"))
+        digest, scratchpad = compact_scratchpad(env, "old summary\n" * 500, entries(3), token_budget=1000)
+        self.assertEqual(digest, "short summary")
+        self.assertEqual(env.scripted.calls, 1)
+
+
+class CompactOncePerTurnTest(unittest.TestCase):
+    def setUp(self):
+        Context.registry.clear()
+        self.env = FakeEnvironment(ScriptedCompletions(default="old summary\n" * 1000), thread_id="thread_scratchpad")
+        self.env.env_vars["SCRATCHPAD_TOKEN_BUDGET"] = "1000"
+
+    def tearDown(self):
+        Context.registry.clear()
+
+    def turn(self, messages: int) -> Context:
+        context = Context(self.env)
+        context.load_state()
+        for index in range(messages):
+            context.write_message_to_scratchpad(f"User: message {index} " + "x" * 400)
+        context.release()
+        return context
+
+    def test_compacted_at_most_once_per_turn(self):
+        self.turn(20)
+        self.assertEqual(self.env.scripted.calls, 1)
+        self.turn(20)
+        self.assertEqual(self.env.scripted.calls, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import importlib
+import sys
+import unittest
+from unittest import mock
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment, FakeHubSecretsApi, FakeRegistry, install_fake_backends
+from utils import Context
+
+
+class RecordingHubSecretsApi(FakeHubSecretsApi):
+    """Keeps the requests that change the secrets, in order"""
+
+    def __init__(self):
+        super().__init__()
+        self.changes = []
+
+    def create_hub_secret_v1_create_hub_secret_post(self, request):
+        self.changes.append(("create", request.key, request.value))
+        return super().create_hub_secret_v1_create_hub_secret_post(request)
+
+    def remove_hub_secret_v1_remove_hub_secret_post(self, request):
+        self.changes.append(("remove", request.key))
+        return super().remove_hub_secret_v1_remove_hub_secret_post(request)
+
+
+class UpsertSecretsTest(unittest.TestCase):
+    def setUp(self):
+        Context.registry.clear()
+        Context(FakeEnvironment(thread_id="thread_secrets"))
+        self.module = importlib.import_module("tools.secrets")
+        self.hub_secrets = RecordingHubSecretsApi()
+        install_fake_backends(FakeRegistry(), self.hub_secrets, sys.modules)
+
+    def tearDown(self):
+        Context.registry.clear()
+
+    def existing(self, key: str, value: str):
+        self.hub_secrets.secrets[("user.near", "weather-agent", "", key, "agent")] = value
+
+    def upsert(self, secrets):
+        return self.module._upsert_secrets_unsafe(secrets, "user.near", "weather-agent", "", "Tells the weather")
+
+    def test_new_key_is_created(self):
+        self.assertEqual(self.upsert({"API_KEY": "new"}), {"API_KEY": True})
+        self.assertEqual(self.hub_secrets.changes, [("remove", "API_KEY"), ("create", "API_KEY", "new")])
+
+    def test_same_value_is_skipped(self):
+        self.existing("API_KEY", "old")
+        self.assertEqual(self.upsert({"API_KEY": "old"}), {"API_KEY": True})
+        self.assertEqual(self.hub_secrets.changes, [])
+
+    def test_changed_value_is_deleted_then_created(self):
+        self.existing("API_KEY", "old")
+        self.upsert({"API_KEY": "new"})
+        self.assertEqual(self.hub_secrets.changes, [("remove", "API_KEY"), ("create", "API_KEY", "new")])
+        self.assertEqual(list(self.hub_secrets.secrets.values()), ["new"])
+
+    def test_secrets_listed_without_values_are_replaced(self):
+        self.existing("API_KEY", "old")
+        list_secrets = self.hub_secrets.get_user_secrets_v1_get_user_secrets_get
+        self.hub_secrets.get_user_secrets_v1_get_user_secrets_get = lambda **kwargs: [
+            {key: value for key, value in secret.items() if key != "value"} for secret in list_secrets(**kwargs)
+        ]
+        self.upsert({"API_KEY": "old"})
+        self.assertEqual(self.hub_secrets.changes, [("remove", "API_KEY"), ("create", "API_KEY", "old")])
+
+    def test_secrets_are_listed_page_by_page(self):
+        for index in range(5):
+            self.existing(f"KEY_{index}", "old")
+        with mock.patch.object(self.module, "SECRETS_PAGE_SIZE", 2):
+            self.upsert({"KEY_4": "old"})
+        # Found on the last page
+        self.assertEqual(self.hub_secrets.changes, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import unittest
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment
+from utils import AgentState, Context
+
+
+class DirtyFieldsTest(unittest.TestCase):
+    def test_assignments_are_tracked(self):
+        state = AgentState()
+        state.agent_name = ""
+        self.assertFalse(state.dirty)
+        state.agent_name = "weather"
+        state.router_hits = {"llm": 1}
+        self.assertEqual(state.dirty_fields, {"agent_name", "router_hits"})
+
+    def test_snapshot_clears_only_its_fields(self):
+        state = AgentState()
+        state.agent_name = "weather"
+        fields, changed = state.snapshot()
+        # Changed by another stage while the snapshot is saved
+        state.last_version = "1.0.0"
+        self.assertEqual(changed, {"agent_name", "revision"})
+        self.assertEqual(fields["agent_name"], "weather")
+        self.assertEqual(fields["revision"], 1)
+        self.assertEqual(state.dirty_fields, {"last_version"})
+
+    def test_changed_again_after_the_snapshot_stays_dirty(self):
+        state = AgentState()
+        state.agent_name = "weather"
+        state.snapshot()
+        state.agent_name = "forecast"
+        self.assertEqual(state.dirty_fields, {"agent_name"})
+
+    def test_failed_save_keeps_the_fields_dirty(self):
+        state = AgentState()
+        state.agent_name = "weather"
+        _, changed = state.snapshot()
+        state.mark_dirty(changed)
+        self.assertEqual(state.dirty_fields, {"agent_name", "revision"})
+
+
+class DumpStateTest(unittest.TestCase):
+    def setUp(self):
+        Context.registry.clear()
+        self.env = FakeEnvironment(thread_id="thread_state")
+        self.context = Context(self.env)
+        self.context.load_state()
+
+    def tearDown(self):
+        Context.registry.clear()
+
+    def test_dump_saves_the_blobs_and_clears_the_fields(self):
+        self.context.state.agent_name = "weather"
+        self.context.state.agent_py = "print('weather')"
+        self.context.dump_state()
+        self.context.flush_files()
+        self.assertFalse(self.context.state.dirty)
+        self.assertIn("thread_state_state.json", self.env.files)
+
+    def test_fields_changed_during_the_save_are_saved_next_time(self):
+        backend = self.context.state_backend
+        save = backend.save
+
+        def save_while_changed(fields, changed):
+            self.context.state.last_version = "1.0.0"
+            return save(fields, changed)
+
+        backend.save = save_while_changed
+        self.context.state.agent_name = "weather"
+        self.context.dump_state()
+        self.assertEqual(self.context.state.dirty_fields, {"last_version"})
+
+    def test_failed_save_is_retried(self):
+        def failed_save(fields, changed):
+            raise IOError("storage is down")
+
+        self.context.state_backend.save = failed_save
+        self.context.state.agent_name = "weather"
+        self.context.dump_state()
+        self.assertIn("agent_name", self.context.state.dirty_fields)
+
+
+class ContextRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = type(Context.registry)(max_idle=2)
+
+    def tearDown(self):
+        Context.registry.clear()
+
+    def turn(self, thread_id: str) -> Context:
+        context = self.registry.acquire(FakeEnvironment(thread_id=thread_id))
+        self.registry.release(context)
+        return context
+
+    def test_context_is_kept_between_turns(self):
+        context = self.turn("thread_1")
+        self.assertIs(self.turn("thread_1"), context)
+        self.assertEqual(len(self.registry), 1)
+
+    def test_least_recently_used_contexts_are_dropped(self):
+        first = self.turn("thread_1")
+        self.turn("thread_2")
+        self.turn("thread_1")
+        self.turn("thread_3")
+        self.assertEqual(len(self.registry), 2)
+        self.assertIs(self.turn("thread_1"), first)
+        self.assertEqual(list(self.registry._contexts), ["thread_3", "thread_1"])
+
+    def test_active_contexts_are_kept(self):
+        active = [self.registry.acquire(FakeEnvironment(thread_id=f"thread_{i}")) for i in range(3)]
+        self.turn("thread_3")
+        self.assertEqual(len(self.registry), 4)
+        # Released once per acquire, the context is idle only after its last turn ends
+        second_turn = self.registry.acquire(FakeEnvironment(thread_id="thread_0"))
+        self.registry.release(active[0])
+        self.assertIn("thread_0", self.registry._active)
+        self.registry.release(second_turn)
+        for context in active[1:]:
+            self.registry.release(context)
+        self.assertEqual(len(self.registry), 2)
+        self.assertEqual(self.registry._active, {})
+
+
+class WarmContextTest(unittest.TestCase):
+    """Two processes serving the same conversation, each keeps its context in memory between the turns"""
+
+    def setUp(self):
+        Context.registry.clear()
+        self.env = FakeEnvironment(thread_id="thread_warm")
+        self.other_registry = type(Context.registry)()
+
+    def tearDown(self):
+        Context.registry.clear()
+
+    def turn(self, registry, change=None) -> Context:
+        Context.registry, saved = registry, Context.registry
+        try:
+            context = Context(self.env)
+            context.load_state()
+            if change is not None:
+                change(context.state)
+            context.dump_state()
+            context.release()
+            return context
+        finally:
+            Context.registry = saved
+
+    def test_state_saved_by_another_process_is_reloaded(self):
+        self.turn(Context.registry, lambda state: setattr(state, "agent_name", "weather"))
+        self.turn(self.other_registry, lambda state: setattr(state, "agent_name", "forecast"))
+        self.assertEqual(self.turn(Context.registry).state.agent_name, "forecast")
+
+    def test_unchanged_state_is_not_reloaded(self):
+        context = self.turn(Context.registry, lambda state: setattr(state, "agent_name", "weather"))
+        state = context.state
+        self.turn(Context.registry)
+        self.assertIs(context.state, state)
+
+    def test_login_is_kept_between_turns(self):
+        context = self.turn(Context.registry)
+        context.auth = "auth of the user"
+        self.assertEqual(self.turn(Context.registry).auth, "auth of the user")
+
+
+if __name__ == "__main__":
+    unittest.main()
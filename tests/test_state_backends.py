@@ -0,0 +1,142 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment
+from utils import AgentState, Context
+from utils.list_agents import main as list_agents_main
+from utils.state_backends import (SQLiteStateBackend, StateBackend, ThreadFileStateBackend, create_state_backend,
+                                  list_agents)
+
+
+class ThreadFileStateBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.env = FakeEnvironment(thread_id="thread_file")
+        self.backend = ThreadFileStateBackend(self.env, "thread_file")
+        self.read = []
+        read_file = self.env.read_file
+
+        def recorded_read_file(filename, **kwargs):
+            self.read.append(filename)
+            return read_file(filename, **kwargs)
+
+        self.env.read_file = recorded_read_file
+
+    def test_revision_is_read_without_the_state(self):
+        self.assertIsNone(self.backend.revision())
+        self.backend.save(AgentState(agent_py="print('weather')", revision=7).model_dump(mode="json"), set())
+        self.read.clear()
+        self.assertEqual(self.backend.revision(), 7)
+        self.assertEqual(self.read, ["thread_file_state.json.revision"])
+
+    def test_revision_of_a_state_saved_without_its_file(self):
+        self.env.files["thread_file_state.json"] = AgentState(revision=3).model_dump_json().encode("utf-8")
+        self.assertEqual(self.backend.revision(), 3)
+
+    def test_backends_implement_every_method(self):
+        class IncompleteBackend(StateBackend):
+            def load(self):
+                return None
+
+        with self.assertRaises(TypeError):
+            IncompleteBackend(self.env, "thread_file")
+
+
+class SQLiteStateBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "state.sqlite3")
+        self.env = FakeEnvironment(thread_id="thread_sqlite")
+
+    def tearDown(self):
+        Context.registry.clear()
+        shutil.rmtree(self.directory)
+
+    def backend(self, thread_id: str = "thread_sqlite") -> SQLiteStateBackend:
+        return SQLiteStateBackend(self.env, thread_id, self.path, AgentState.columns())
+
+    def save(self, backend: SQLiteStateBackend, changed=None, **fields) -> AgentState:
+        state = AgentState(**fields)
+        plain_state = state.model_dump(mode="json")
+        backend.save(plain_state, set(plain_state) if changed is None else changed)
+        return state
+
+    def test_fields_are_saved_in_columns(self):
+        backend = self.backend()
+        self.assertIsNone(backend.load())
+        self.save(backend, agent_name="weather", router_hits={"llm": 2}, revision=3)
+        fields = self.backend().load()
+        self.assertEqual(AgentState.model_validate(fields).router_hits, {"llm": 2})
+        self.assertEqual(fields["agent_name"], "weather")
+        self.assertEqual(backend.revision(), 3)
+
+    def test_only_changed_fields_are_updated(self):
+        backend = self.backend()
+        self.save(backend, agent_name="weather", last_version="1.0.0")
+        # Saved by another process meanwhile
+        self.save(self.backend(), changed={"last_version"}, agent_name="weather", last_version="2.0.0")
+        self.save(backend, changed={"agent_name"}, agent_name="forecast", last_version="1.0.0")
+        fields = self.backend().load()
+        self.assertEqual((fields["agent_name"], fields["last_version"]), ("forecast", "2.0.0"))
+
+    def test_state_of_the_thread_file_is_migrated(self):
+        old_state = AgentState(agent_name="weather", scratchpad="User: hi", revision=4)
+        ThreadFileStateBackend(self.env, "thread_sqlite").save(old_state.model_dump(mode="json"), set())
+        ThreadFileStateBackend(self.env, "thread_sqlite").write_blob("digest", "print('weather')")
+
+        backend = self.backend()
+        self.assertEqual(backend.revision(), 4)
+        self.assertEqual(backend.load()["scratchpad"], "User: hi")
+        # The first save writes every field, not only the changed ones
+        self.save(backend, changed={"revision"}, agent_name="weather", scratchpad="User: hi", revision=5)
+        self.assertEqual(backend.database.load("thread_sqlite")["scratchpad"], "User: hi")
+        self.assertEqual(backend.read_blob("digest"), "print('weather')")
+        self.env.files.clear()
+        self.assertEqual(backend.read_blob("digest"), "print('weather')")
+
+    def test_context_saves_to_the_selected_backend(self):
+        self.env.env_vars.update({"STATE_BACKEND": "sqlite", "STATE_DB_PATH": self.path})
+        context = Context(self.env)
+        context.load_state()
+        context.state.agent_name = "weather"
+        context.state.agent_py = "print('weather')"
+        context.dump_state()
+        Context.registry.clear()
+
+        context = Context(self.env)
+        context.load_state()
+        self.assertIsInstance(context.state_backend, SQLiteStateBackend)
+        self.assertEqual(context.state.agent_py, "print('weather')")
+        self.assertNotIn("thread_sqlite_state.json", self.env.files)
+
+    def test_unknown_backend(self):
+        self.env.env_vars["STATE_BACKEND"] = "redis"
+        with self.assertRaises(Exception):
+            create_state_backend(self.env, "thread_sqlite", AgentState.columns())
+
+    def test_agents_of_all_conversations_are_listed(self):
+        self.save(self.backend("thread_1"), agent_name="weather", last_version="1.0.0")
+        self.save(self.backend("thread_2"), agent_name="")
+        self.save(self.backend("thread_3"), agent_name="forecast")
+        agents = list_agents(self.path, AgentState.columns())
+        self.assertEqual([agent["agent_name"] for agent in agents], ["forecast", "weather"])
+        self.assertEqual(agents[1]["thread_id"], "thread_1")
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(list_agents_main(["--db", self.path, "--json"]), 0)
+        self.assertEqual([json.loads(line)["agent_name"] for line in output.getvalue().splitlines()], ["forecast", "weather"])
+
+    def test_missing_database_is_not_created(self):
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(list_agents_main(["--db", os.path.join(self.directory, "missing.sqlite3")]), 1)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "missing.sqlite3")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import logging
+import unittest
+from unittest import mock
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment, ScriptedCompletions
+from utils.metrics import TurnMetrics
+from utils.streaming import stream_completion
+
+
+CODE = "".join(f"def step_{index}(env):\n    pass\n\n" for index in range(40))
+MESSAGES = [{"role": "user", "content": "Write agent.py"}]
+
+
+class LoggedEnvironment(FakeEnvironment):
+    def __init__(self, **kwargs):
+        super().__init__(ScriptedCompletions(default=CODE), **kwargs)
+        self.levels = []
+
+    def add_system_log(self, log: str, level: int = 0):
+        super().add_system_log(log, level)
+        self.levels.append(level)
+
+
+class StreamCompletionTest(unittest.TestCase):
+    def setUp(self):
+        self.env = LoggedEnvironment()
+        self.metrics = TurnMetrics(self.env, "thread_metrics.json")
+
+    def test_progress_is_reported_while_streaming(self):
+        progress = []
+        self.assertEqual(stream_completion(self.env, MESSAGES, "draft", on_progress=progress.append, metrics=self.metrics), CODE)
+        self.assertTrue(progress and all(CODE.startswith(text) for text in progress))
+        self.assertEqual(self.metrics.summary()["completion"]["count"], 1)
+        self.assertNotIn(logging.WARNING, self.env.levels)
+
+    def test_failed_stream_falls_back_with_a_warning(self):
+        def broken_stream(messages, model, stream, **kwargs):
+            raise TypeError("unexpected keyword argument")
+
+        self.env._run_inference_completions = broken_stream
+        self.assertEqual(stream_completion(self.env, MESSAGES, "draft", metrics=self.metrics), CODE)
+        self.assertIn(logging.WARNING, self.env.levels)
+        self.assertEqual(self.metrics.summary()["streaming"]["count"], 1)
+
+    def test_other_nearai_versions_are_reported(self):
+        with mock.patch("utils.streaming._nearai_version", return_value="0.2.0"):
+            stream_completion(self.env, MESSAGES, "draft")
+        self.assertIn("nearai 0.2.0 is installed", self.env.logs[0])
+        self.assertEqual(self.env.levels[0], logging.WARNING)
+
+
+if __name__ == "__main__":
+    unittest.main()
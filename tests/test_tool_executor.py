@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment
+from utils.tool_executor import ToolExecutor
+
+
+def definition(name: str, parameters=("text",)) -> dict:
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": name,
+            "parameters": {
+                "type": "object",
+                "properties": {parameter: {"type": "string"} for parameter in parameters},
+                "required": list(parameters),
+            },
+        },
+    }
+
+
+def tool_call(index: int, name: str, **arguments):
+    return SimpleNamespace(id=f"call_{index}", function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+
+def assistant_message(content=None, tool_calls=None):
+    return SimpleNamespace(role="assistant", content=content, tool_calls=tool_calls)
+
+
+class LlamaToolSyntaxTest(unittest.TestCase):
+    def setUp(self):
+        self.env = FakeEnvironment()
+        self.called = []
+        self.executor = ToolExecutor(self.env, {"echo": self.echo}, {"echo": definition("echo")})
+
+    def echo(self, text: str):
+        self.called.append(text)
+        return text
+
+    def test_llama_models_get_the_tools_as_a_prompt(self):
+        seen = []
+        self.env.completions = lambda messages, model="", **kwargs: seen.append(messages)
+        messages = [{"role": "user", "content": "hi"}]
+        self.executor.completions(messages, "llama-v3p1-70b-instruct")
+        self.executor.completions(messages, "qwen")
+        self.assertEqual(seen[0][-1]["role"], "system")
+        self.assertIn('"name": "echo"', seen[0][-1]["content"])
+        self.assertEqual(seen[1], messages)
+        # The messages of the caller are left as they are
+        self.assertEqual(len(messages), 1)
+
+    def test_tool_calls_in_the_text_are_run(self):
+        calls = self.executor.run(assistant_message('Echoing <function=echo>{"text": "hi"}</function>'))
+        self.assertEqual(self.called, ["hi"])
+        self.assertEqual([call.name for call in calls], ["echo"])
+        self.assertEqual(self.env.messages[0], {"role": "assistant", "content": "Echoing "})
+        self.assertEqual(json.loads(self.env.messages[1]["content"]), "hi")
+
+    def test_native_tool_calls_are_run(self):
+        tool_call = SimpleNamespace(id="call_0", function=SimpleNamespace(name="echo", arguments='{"text": "hi"}'))
+        self.executor.run(assistant_message(None, [tool_call]))
+        self.assertEqual(self.called, ["hi"])
+        self.assertEqual(self.env.messages[0]["tool_call_id"], "call_0")
+
+
+class ConflictOrderTest(unittest.TestCase):
+    def setUp(self):
+        self.env = FakeEnvironment()
+        self.called = []
+        self.delays = {}
+        self.barrier = None
+        tools = {"create_secret": self.create_secret, "update_agent": self.update_agent}
+        definitions = {
+            "create_secret": definition("create_secret", ("key", "value")),
+            "update_agent": definition("update_agent", ("request",)),
+        }
+        self.executor = ToolExecutor(self.env, tools, definitions)
+
+    def create_secret(self, key: str, value: str):
+        if self.barrier is not None:
+            self.barrier.wait()
+        time.sleep(self.delays.get(value, 0))
+        self.called.append(value)
+        self.env.add_reply(f"Saved {value}")
+        return value
+
+    def update_agent(self, request: str):
+        self.called.append(request)
+        return request
+
+    def run_calls(self, *calls):
+        return self.executor.run(assistant_message(None, [tool_call(index, name, **arguments)
+                                                          for index, (name, arguments) in enumerate(calls)]))
+
+    def test_conflicting_calls_run_in_order(self):
+        self.delays["first"] = 0.05
+        self.run_calls(("create_secret", {"key": "API_KEY", "value": "first"}),
+                       ("create_secret", {"key": "API_KEY", "value": "second"}))
+        self.assertEqual(self.called, ["first", "second"])
+
+    def test_unlisted_tools_conflict_with_every_call(self):
+        self.delays["first"] = 0.05
+        self.run_calls(("create_secret", {"key": "API_KEY", "value": "first"}), ("update_agent", {"request": "second"}))
+        self.assertEqual(self.called, ["first", "second"])
+
+    def test_independent_calls_run_concurrently(self):
+        # Each call waits for the other, run one after the other they would time out
+        self.barrier = threading.Barrier(2, timeout=5)
+        calls = self.run_calls(("create_secret", {"key": "API_KEY", "value": "first"}),
+                               ("create_secret", {"key": "TOKEN", "value": "second"}))
+        self.assertEqual([call.error for call in calls], [None, None])
+
+    def test_replies_are_passed_on_in_the_order_of_the_calls(self):
+        self.delays["first"] = 0.05
+        calls = self.run_calls(("create_secret", {"key": "API_KEY", "value": "first"}),
+                               ("create_secret", {"key": "TOKEN", "value": "second"}))
+        self.assertEqual(self.called, ["second", "first"])
+        self.assertEqual(self.env.replies, ["Saved first", "Saved second"])
+        self.assertEqual([message["tool_call_id"] for message in self.env.messages if "tool_call_id" in message],
+                         [call.id for call in calls])
+
+
+if __name__ == "__main__":
+    unittest.main()
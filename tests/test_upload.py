@@ -0,0 +1,162 @@
+import importlib
+import sys
+import unittest
+from unittest import mock
+
+import nearai
+import urllib3
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment, FakeHubSecretsApi, FakeRegistry, install_fake_backends
+from utils import Context, AgentMetadata
+
+
+METADATA = AgentMetadata(name="weather-agent", version="0.0.1", description="Tells the weather")
+
+
+class FailingRegistry(FakeRegistry):
+    """Rejects the uploads of the files in `failing`"""
+
+    def __init__(self, failing=()):
+        super().__init__()
+        self.failing = set(failing)
+        upload_file = self.api.upload_file_v1_registry_upload_file_post
+
+        def upload_file_or_fail(path, **kwargs):
+            if path in self.failing:
+                self.api.calls += 1
+                raise nearai.openapi_client.exceptions.BadRequestException(status=400, reason="Bad Request", body="Rejected")
+            return upload_file(path=path, **kwargs)
+
+        self.api.upload_file_v1_registry_upload_file_post = upload_file_or_fail
+
+
+class AgentTestCase(unittest.TestCase):
+    """A conversation with a generated agent and an icon"""
+
+    def setUp(self):
+        Context.registry.clear()
+        self.env = FakeEnvironment(thread_id="thread_upload")
+        self.env.files.update({
+            "agent.py": b"print('weather')\n",
+            "icon.png": b"\x89PNG\r\n\x1a\n\x00\xff",
+            "metadata.json": METADATA.to_json().encode("utf-8"),
+        })
+        self.context = Context(self.env)
+        self.context.load_state()
+        self.context.state.metadata = METADATA.to_json()
+
+    def tearDown(self):
+        Context.registry.clear()
+
+    def upload(self, registry: FakeRegistry, version: str = "1.0.0"):
+        # `tools` exports the tool functions, the module is imported by name, before it's patched
+        module = importlib.import_module("tools.upload")
+        install_fake_backends(registry, FakeHubSecretsApi(), sys.modules)
+        return module.upload(version)
+
+
+class UploadTest(AgentTestCase):
+    def test_files_are_uploaded_as_stored(self):
+        registry = FakeRegistry()
+        self.assertIsNone(self.upload(registry))
+        uploaded = {path: content for (_, _, _, path), content in registry.api.files.items()}
+        self.assertEqual(uploaded, {"agent.py": b"print('weather')\n", "icon.png": b"\x89PNG\r\n\x1a\n\x00\xff"})
+        self.assertEqual(set(self.context.state.uploaded_files), {"agent.py", "icon.png"})
+
+    def test_files_uploaded_before_a_failure_are_not_sent_again(self):
+        registry = FailingRegistry(failing={"icon.png"})
+        self.assertIn("error", self.upload(registry))
+        self.assertEqual(set(self.context.state.uploaded_files), {"agent.py"})
+
+        registry.failing.clear()
+        registry.api.calls = 0
+        self.assertIsNone(self.upload(registry))
+        self.assertEqual(registry.api.calls, 1)
+        self.assertEqual(set(self.context.state.uploaded_files), {"agent.py", "icon.png"})
+
+    def test_new_version_gets_every_file(self):
+        registry = FakeRegistry()
+        self.assertIsNone(self.upload(registry, "1.0.0"))
+        registry.api.calls = 0
+        # agent.py is unchanged, but the new version has no files in the registry yet
+        self.assertIsNone(self.upload(registry, "1.1.0"))
+        self.assertEqual(registry.api.calls, 2)
+        self.assertEqual(sorted(path for (_, _, version, path) in registry.api.files if version == "1.1.0"),
+                         ["agent.py", "icon.png"])
+        self.assertTrue(any(log.startswith("Upload of 1.1.0") and log.endswith("Changed since the previous upload: []")
+                            for log in self.env.logs))
+
+    def test_files_missing_from_the_registry_fail_the_upload(self):
+        registry = FakeRegistry()
+        list_files = registry.list_files
+        registry.list_files = lambda entry_location: [path for path in list_files(entry_location) if path != "icon.png"]
+        self.assertIn("missing uploaded files: ['icon.png']", self.upload(registry)["error"])
+        # Sent again on the next attempt
+        self.assertEqual(set(self.context.state.uploaded_files), {"agent.py"})
+
+
+class RestoreVersionTest(AgentTestCase):
+    def restore(self, version: str):
+        return importlib.import_module("tools.update").restore_version(version)
+
+    def test_uploaded_version_is_restored(self):
+        self.context.state.agent_py = "print('weather')\n"
+        self.assertIsNone(self.upload(FakeRegistry()))
+        self.context.state.agent_py = "print('forecast')\n"
+        self.context.files.write_file("agent.py", "print('forecast')\n")
+
+        self.assertIsNone(self.restore("1.0.0"))
+        self.assertEqual(self.context.state.agent_py, "print('weather')\n")
+        self.assertEqual(self.context.files.read_file("agent.py"), "print('weather')\n")
+        self.assertEqual(self.context.state.last_version, "1.0.0")
+
+    def test_unknown_version(self):
+        self.assertIsNone(self.restore("2.0.0"))
+        self.assertEqual(len(self.env.replies), 1)
+        self.assertIn("the versions I can restore are: none", self.env.replies[0])
+
+
+class RetryTest(AgentTestCase):
+    def attempts(self, error: Exception) -> int:
+        """Attempts to upload a file when the first one fails with `error`"""
+        module = importlib.import_module("tools.upload")
+        registry = FakeRegistry()
+        upload_file = registry.api.upload_file_v1_registry_upload_file_post
+        attempts = []
+
+        def flaky_upload_file(**kwargs):
+            attempts.append(kwargs["path"])
+            if len(attempts) == 1:
+                raise error
+            return upload_file(**kwargs)
+
+        registry.api.upload_file_v1_registry_upload_file_post = flaky_upload_file
+        location = nearai.EntryLocation(namespace="user.near", name="weather-agent", version="1.0.0")
+        with mock.patch.object(module, "UPLOAD_RETRY_DELAY", 0):
+            try:
+                module._upload_file(registry, location, "agent.py", b"print('weather')\n")
+            except Exception:
+                pass
+        return len(attempts)
+
+    def test_connection_errors_and_server_errors_are_retried(self):
+        exceptions = nearai.openapi_client.exceptions
+        for error in (exceptions.ServiceException(status=503, reason="Service Unavailable"),
+                      exceptions.ApiException(status=429, reason="Too Many Requests"),
+                      urllib3.exceptions.ProtocolError("Connection aborted"),
+                      ConnectionResetError(), TimeoutError()):
+            self.assertEqual(self.attempts(error), 2, repr(error))
+
+    def test_rejected_requests_and_local_errors_fail_right_away(self):
+        exceptions = nearai.openapi_client.exceptions
+        for error in (exceptions.UnauthorizedException(status=401, reason="Unauthorized"),
+                      exceptions.ForbiddenException(status=403, reason="Forbidden"),
+                      exceptions.NotFoundException(status=404, reason="Not Found"),
+                      exceptions.BadRequestException(status=400, reason="Bad Request"),
+                      ValueError("Invalid version"), KeyError("namespace")):
+            self.assertEqual(self.attempts(error), 1, repr(error))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+import tests  # noqa: F401, puts the agent on sys.path
+from fakes import FakeEnvironment, ScriptedCompletions
+from utils import Context
+from utils.validation import validate_agent_code
+
+
+VALID = "import json\n\n\ndef run(env):\n    env.add_reply(json.dumps({}))\n"
+INVALID = "import numpy\n\n\ndef run(env):\n    env.add_reply(str(numpy.zeros(1)))\n"
+
+
+class ValidateAgentCodeTest(unittest.TestCase):
+    def setUp(self):
+        Context.registry.clear()
+
+    def tearDown(self):
+        Context.registry.clear()
+
+    def context(self, fixed_code: str) -> Context:
+        # Edits that can't be applied, the model then rewrites the whole file
+        context = Context(FakeEnvironment(ScriptedCompletions(default=fixed_code), thread_id="thread_validation"))
+        context.load_state()
+        return context
+
+    def test_valid_code_is_kept(self):
+        context = self.context(VALID)
+        self.assertEqual(validate_agent_code(VALID), VALID)
+        self.assertEqual(context.env.scripted.calls, 0)
+
+    def test_problems_are_fixed_by_the_model(self):
+        context = self.context(VALID)
+        self.assertEqual(validate_agent_code(INVALID), VALID)
+        self.assertIn("fixing it", context.env.replies[0])
+
+    def test_problems_left_are_reported(self):
+        context = self.context(INVALID)
+        self.assertEqual(validate_agent_code(INVALID), INVALID)
+        self.assertIn("`numpy` is not one of the available libraries", context.env.replies[-1])
+
+
+if __name__ == "__main__":
+    unittest.main()